@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# benchmarks/bench_backends.py
+#
+# Paridad y velocidad de los backends de inferencia (services/inference_backends.py).
+# Compara las probabilidades de onsets y frames de cada backend contra el
+# modelo de Keras (model.predict, la ruta original) y mide el tiempo de
+# predict_probabilities. Termina con código 1 si algún backend se sale de la
+# tolerancia, así que sirve como prueba de paridad antes de cambiar
+# INFERENCE_BACKEND en un host.
+#
+# Uso (desde BackEnd/):
+#   python -m benchmarks.bench_backends --frames 3000
+#   python -m benchmarks.bench_backends --model modelos/modelo.keras --backends onnx tflite_int8
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from services.inference_backends import BACKENDS, load_backend
+from services.transcription import predict_probabilities, T_ONSETS, T_FRAMES
+from benchmarks.stand_in import build_stand_in_model, synthetic_features
+
+
+def parity(reference, candidate, threshold: float) -> dict:
+    """Diferencia máxima de probabilidades y concordancia de los rolls binarios."""
+    return {
+        "max_abs_diff": float(np.max(np.abs(reference - candidate))),
+        "binary_agreement": float(np.mean((reference > threshold) == (candidate > threshold))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Paridad y velocidad de los backends de inferencia")
+    parser.add_argument("--model", default=None, help="Modelo .keras (por defecto, el modelo sustituto)")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS[1:]), choices=list(BACKENDS))
+    parser.add_argument("--frames", type=int, default=3000, help="Frames de entrada (~43 por segundo)")
+    parser.add_argument("--stride", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=0, help="Hilos de ONNX Runtime / TFLite")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="max|Δ| permitido (float32)")
+    parser.add_argument("--int8-tolerance", type=float, default=0.05, help="max|Δ| permitido con INT8")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="backends-")
+    model_path = args.model
+    if model_path is None:
+        model_path = os.path.join(workdir, "stand_in.keras")
+        build_stand_in_model(seed=args.seed).save(model_path)
+    export_folder = os.path.join(workdir, "exportados")
+    features = synthetic_features(args.frames, seed=args.seed)
+
+    def timed(model):
+        # Calentamiento para no medir la compilación del grafo
+        predict_probabilities(model, features[:400], stride=args.stride)
+        t0 = time.perf_counter()
+        result = predict_probabilities(model, features, stride=args.stride)
+        return time.perf_counter() - t0, result
+
+    reference = load_backend("keras", model_path, export_folder)
+    ref_seconds, (ref_onsets, ref_frames) = timed(reference)
+    print(f"{'keras':<12} {ref_seconds:8.3f}s  (referencia, model.predict)")
+
+    failed = []
+    for kind in args.backends:
+        t0 = time.perf_counter()
+        try:
+            backend = load_backend(kind, model_path, export_folder, args.threads)
+        except Exception as e:
+            print(f"{kind:<12} no disponible: {e}")
+            failed.append(kind)
+            continue
+        load_seconds = time.perf_counter() - t0
+
+        seconds, (onsets, frames) = timed(backend)
+        on = parity(ref_onsets, onsets, T_ONSETS)
+        fr = parity(ref_frames, frames, T_FRAMES)
+        tolerance = args.int8_tolerance if kind.endswith("int8") else args.tolerance
+        ok = max(on["max_abs_diff"], fr["max_abs_diff"]) <= tolerance
+        if not ok:
+            failed.append(kind)
+        print(
+            f"{kind:<12} {seconds:8.3f}s  x{ref_seconds / seconds:5.1f}  (carga/exportación {load_seconds:6.2f}s)  "
+            f"onsets: max|Δ| {on['max_abs_diff']:.2e} acuerdo {on['binary_agreement']:.5f}  "
+            f"frames: max|Δ| {fr['max_abs_diff']:.2e} acuerdo {fr['binary_agreement']:.5f}  "
+            f"{'OK' if ok else 'FUERA DE TOLERANCIA'}"
+        )
+
+    if failed:
+        print(f"❌ Backends con problemas: {', '.join(failed)}")
+        sys.exit(1)
+    print("✅ Todos los backends dentro de la tolerancia")
+
+
+if __name__ == "__main__":
+    main()
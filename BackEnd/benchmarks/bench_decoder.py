@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# benchmarks/bench_decoder.py
+#
+# Verifica que el decodificador vectorizado (piano_roll_to_midi) produce
+# exactamente las mismas notas que la máquina de estados original
+# (piano_roll_to_midi_loop) sobre rolls aleatorios, y mide ambos.
+#
+# Uso (desde BackEnd/):
+#   python -m benchmarks.bench_decoder --cases 300 --seconds 120
+
+import argparse
+import time
+
+import numpy as np
+import librosa
+
+from services.transcription import (
+    piano_roll_to_midi,
+    piano_roll_to_midi_loop,
+    SR,
+    HOP_LENGTH,
+    N_KEYS,
+)
+
+
+def random_rolls(rng: np.random.Generator, n_frames: int):
+    """
+    Rolls binarios aleatorios: rachas de frames activos de longitud variable y
+    onsets dispersos (incluye onsets con nota ya activa y fuera de las rachas).
+    """
+    p_active = rng.uniform(0.0, 1.0)
+    p_onset = rng.uniform(0.0, 0.5)
+    # Rachas: un proceso de Markov por tecla con probabilidad de cambio variable
+    switch = rng.random((n_frames, N_KEYS)) < rng.uniform(0.01, 0.5)
+    frames = (np.cumsum(switch, axis=0) + (rng.random(N_KEYS) < p_active)) % 2
+    onsets = rng.random((n_frames, N_KEYS)) < p_onset
+    return onsets.astype(np.uint8), frames.astype(np.uint8)
+
+
+def note_list(midi) -> list:
+    return [(n.pitch, n.start, n.end, n.velocity) for n in midi.instruments[0].notes]
+
+
+def frame_times_for(n_frames: int) -> np.ndarray:
+    return librosa.frames_to_time(np.arange(n_frames), sr=SR, hop_length=HOP_LENGTH)
+
+
+def check_equivalence(cases: int, seed: int) -> int:
+    """Compara ambas implementaciones en `cases` rolls aleatorios y casos borde."""
+    rng = np.random.default_rng(seed)
+    shapes = [1, 2, 3] + [int(rng.integers(1, 400)) for _ in range(cases)]
+    
+    checked = 0
+    for n_frames in shapes:
+        onsets, frames = random_rolls(rng, n_frames)
+        edge_cases = [
+            (onsets, frames),
+            (np.ones_like(onsets), np.ones_like(frames)),   # activa hasta el final
+            (onsets, np.zeros_like(frames)),                # onsets sin frames activos
+            (np.zeros_like(onsets), frames),                # frames sin onsets
+        ]
+        times = frame_times_for(n_frames)
+        for on, fr in edge_cases:
+            expected = note_list(piano_roll_to_midi_loop(on, fr, times))
+            actual = note_list(piano_roll_to_midi(on, fr, times))
+            if expected != actual:
+                raise AssertionError(f"Diferencia con n_frames={n_frames}: {expected[:5]} != {actual[:5]}")
+            checked += 1
+    return checked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Equivalencia y benchmark del decodificador MIDI")
+    parser.add_argument("--cases", type=int, default=300)
+    parser.add_argument("--seconds", type=float, default=120.0, help="Duración del roll para el benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    checked = check_equivalence(args.cases, args.seed)
+    print(f"✅ {checked} rolls con notas idénticas")
+    
+    n_frames = int(args.seconds * SR / HOP_LENGTH)
+    onsets, frames = random_rolls(np.random.default_rng(args.seed), n_frames)
+    times = frame_times_for(n_frames)
+    
+    timings = {}
+    for name, fn in (("bucle", piano_roll_to_midi_loop), ("vectorizado", piano_roll_to_midi)):
+        t0 = time.perf_counter()
+        midi = fn(onsets, frames, times)
+        timings[name] = time.perf_counter() - t0
+        print(f"{name:12s} {timings[name] * 1000:9.1f} ms  ({len(midi.instruments[0].notes)} notas, {n_frames} frames)")
+    
+    print(f"Aceleración: x{timings['bucle'] / timings['vectorizado']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# benchmarks/bench_engraving.py
+#
+# Compara el tiempo de generar la partitura PDF con el grabado nativo
+# (services/engraving.py, en proceso) frente a MuseScore: un proceso por PDF
+# (midi_to_pdf_sheet_music) y el pool persistente (services/render_pool.py).
+# Las rutas de MuseScore se omiten si no está instalado.
+#
+# Uso (desde BackEnd/):
+#   python -m benchmarks.bench_engraving --seconds 30 120 300 --notes-per-second 8
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pretty_midi as pm
+
+from services.engraving import engrave_pdf
+from services.sheet_music import midi_to_pdf_sheet_music, find_musescore
+from services.render_pool import RenderPool
+
+
+def synthetic_midi(seconds: float, notes_per_second: float, seed: int) -> pm.PrettyMIDI:
+    """
+    Melodía en la mano derecha y acordes de tres notas en la izquierda, con
+    duraciones variadas; la probabilidad de acorde ajusta la densidad de notas.
+    """
+    rng = np.random.default_rng(seed)
+    midi = pm.PrettyMIDI()
+    piano = pm.Instrument(program=0, name="Piano")
+
+    steps = np.array([0.125, 0.25, 0.375, 0.5])
+    chord_probability = float(np.clip((notes_per_second * steps.mean() - 1) / 3, 0.0, 1.0))
+
+    t = 0.0
+    while t < seconds:
+        step = float(rng.choice(steps))
+        piano.notes.append(pm.Note(100, int(rng.integers(60, 90)), t, t + step))
+        if rng.random() < chord_probability:
+            root = int(rng.integers(36, 56))
+            for interval in (0, 4, 7):
+                piano.notes.append(pm.Note(80, root + interval, t, t + 2 * step))
+        t += step
+
+    midi.instruments.append(piano)
+    return midi
+
+
+def time_call(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return statistics.median(timings)
+
+
+async def time_render_pool(midi_path: str, pdf_path: str, repeat: int) -> float:
+    pool = RenderPool()
+    await pool.start(pool_size=1, batch_size=1, batch_wait=0.0, job_timeout=60, health_interval=3600)
+    try:
+        timings = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            await pool.render(midi_path, pdf_path)
+            timings.append(time.perf_counter() - t0)
+        return statistics.median(timings)
+    finally:
+        await pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de generación de partituras PDF")
+    parser.add_argument("--seconds", type=float, nargs="+", default=[30.0, 120.0, 300.0])
+    parser.add_argument("--notes-per-second", type=float, default=8.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    musescore = find_musescore()
+    if not musescore:
+        print("⚠️  MuseScore no está instalado: solo se mide el grabado nativo")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for seconds in args.seconds:
+            midi = synthetic_midi(seconds, args.notes_per_second, args.seed)
+            midi_path = os.path.join(tmp, "bench.mid")
+            midi.write(midi_path)
+            n_notes = len(midi.instruments[0].notes)
+
+            results = {
+                "nativo": time_call(
+                    lambda: engrave_pdf(midi_path, os.path.join(tmp, "nativo.pdf")), args.repeat
+                )
+            }
+            if musescore:
+                results["musescore"] = time_call(
+                    lambda: midi_to_pdf_sheet_music(midi_path, os.path.join(tmp, "musescore.pdf")),
+                    args.repeat
+                )
+                results["pool"] = asyncio.run(
+                    time_render_pool(midi_path, os.path.join(tmp, "pool.pdf"), args.repeat)
+                )
+
+            line = "  ".join(f"{name} {value * 1000:8.1f} ms" for name, value in results.items())
+            print(f"{seconds:6.0f}s ({n_notes:5d} notas)  {line}")
+
+
+if __name__ == "__main__":
+    main()
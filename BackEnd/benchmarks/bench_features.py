@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# benchmarks/bench_features.py
+#
+# Compara el cálculo de Mel + Delta + Delta-Delta de referencia (la
+# implementación original con librosa, copiada abajo) con MelFeatureEngine:
+# tiempo, memoria adicional sobre la señal de entrada (pico de RSS) y
+# diferencia máxima entre ambas salidas.
+# Sale con código 1 si la diferencia supera la tolerancia.
+#
+# Uso (desde BackEnd/):
+#   python -m benchmarks.bench_features --minutes 1 10 60
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import librosa
+
+from services.audio_processing import (
+    SR, N_FFT, HOP_LENGTH, N_MELS_FEATURE, F_MIN, F_MAX, extract_mel_spectrogram
+)
+
+# Diferencia máxima admitida en las características normalizadas (dB / 80 + 1)
+TOLERANCE = 1e-4
+
+
+def reference_features(y: np.ndarray, sr: int) -> np.ndarray:
+    """extract_mel_spectrogram antes de MelFeatureEngine."""
+    S = librosa.feature.melspectrogram(
+        y=y, sr=sr, n_fft=N_FFT, hop_length=HOP_LENGTH,
+        n_mels=N_MELS_FEATURE, fmin=F_MIN, fmax=F_MAX
+    )
+    S_db = librosa.power_to_db(S, ref=np.max)
+    S_delta = librosa.feature.delta(S_db)
+    S_delta2 = librosa.feature.delta(S_db, order=2)
+    X = np.concatenate((S_db, S_delta, S_delta2), axis=0).T
+    X = (X / 80.0) + 1.0
+    return X.astype(np.float32)
+
+
+def synthetic_signal(minutes: float, sr: int = SR, seed: int = 0) -> np.ndarray:
+    """Señal mono (ya filtrada y normalizada) con notas decrecientes y ruido."""
+    rng = np.random.default_rng(seed)
+    y = np.empty(int(minutes * 60 * sr), dtype=np.float32)
+    block = sr * 2
+    t = np.arange(block) / sr
+    for offset in range(0, len(y), block):
+        n = min(block, len(y) - offset)
+        freq = rng.uniform(30, 4000)
+        note = 0.5 * np.sin(2 * np.pi * freq * t[:n]) * np.exp(-2.0 * t[:n])
+        y[offset:offset + n] = note + 0.01 * rng.standard_normal(n)
+    y /= max(y.max(), -y.min())
+    return y
+
+
+def measure(mode: str, minutes: str, out_path: str):
+    """Se ejecuta en un subproceso para medir el pico de RSS de cada modo por separado."""
+    y = synthetic_signal(float(minutes))
+    base_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    t0 = time.perf_counter()
+    if mode == "referencia":
+        X = reference_features(y, SR)
+    else:
+        X, _ = extract_mel_spectrogram(y, SR)
+    seconds = time.perf_counter() - t0
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    np.save(out_path, X)
+    print(json.dumps({"seconds": seconds, "extra_rss_mb": peak_mb - base_mb, "frames": int(X.shape[0])}))
+
+
+def run_mode(mode: str, minutes: float, out_path: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_features", "--measure", mode, str(minutes), out_path],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del motor de características")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 10, 60])
+    parser.add_argument("--measure", nargs=3, metavar=("MODE", "MINUTES", "OUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for minutes in args.minutes:
+            results = {}
+            for mode in ("referencia", "motor"):
+                results[mode] = run_mode(mode, minutes, os.path.join(tmp, f"{mode}.npy"))
+
+            X_ref = np.load(os.path.join(tmp, "referencia.npy"), mmap_mode="r")
+            X_engine = np.load(os.path.join(tmp, "motor.npy"), mmap_mode="r")
+            ok = X_ref.shape == X_engine.shape
+            diff = float(np.max(np.abs(X_ref - X_engine))) if ok else float("inf")
+            ok = ok and diff <= TOLERANCE
+            failed = failed or not ok
+            del X_ref, X_engine
+
+            ref, engine = results["referencia"], results["motor"]
+            print(f"{minutes:5.1f} min ({engine['frames']:7d} frames)  "
+                  f"referencia: {ref['seconds']:6.2f}s +{ref['extra_rss_mb']:6.0f} MB  "
+                  f"motor: {engine['seconds']:6.2f}s +{engine['extra_rss_mb']:6.0f} MB  "
+                  f"x{ref['seconds'] / engine['seconds']:.1f}  max|Δ| {diff:.2e}  {'OK' if ok else 'FALLA'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# benchmarks/bench_inference_stride.py
+#
+# Compara la inferencia original (stride=1, una ventana por frame) contra el
+# modo con stride: tiempo de ejecución y concordancia de los piano rolls.
+# Termina con código 1 si algún stride se sale de la tolerancia (max|Δ| de las
+# probabilidades o acuerdo de los rolls binarios), así que sirve como prueba
+# antes de subir INFERENCE_STRIDE en un host.
+#
+# Uso (desde BackEnd/):
+#   python -m benchmarks.bench_inference_stride --frames 3000 --strides 20 50 80
+#   python -m benchmarks.bench_inference_stride --strides 80 --tolerance 0.02 --min-agreement 0.9995
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from services.transcription import predict_probabilities, T_ONSETS, T_FRAMES
+from benchmarks.stand_in import build_stand_in_model, synthetic_features
+
+
+def compare(reference: np.ndarray, candidate: np.ndarray, threshold: float) -> dict:
+    """Diferencia de probabilidades y concordancia de los rolls binarios."""
+    ref_bin = reference > threshold
+    cand_bin = candidate > threshold
+    return {
+        "max_abs_diff": float(np.max(np.abs(reference - candidate))),
+        "mean_abs_diff": float(np.mean(np.abs(reference - candidate))),
+        "binary_agreement": float(np.mean(ref_bin == cand_bin)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de inferencia con stride")
+    parser.add_argument("--frames", type=int, default=3000, help="Frames de entrada (~43 por segundo)")
+    parser.add_argument("--strides", type=int, nargs="+", default=[20, 50, 80])
+    parser.add_argument("--tolerance", type=float, default=0.05, help="max|Δ| permitido en las probabilidades")
+    parser.add_argument("--min-agreement", type=float, default=0.999, help="Acuerdo mínimo de los rolls binarios")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    model = build_stand_in_model(seed=args.seed)
+    features = synthetic_features(args.frames, seed=args.seed)
+    
+    # Calentamiento para no medir la compilación del grafo
+    predict_probabilities(model, features[:200], stride=1)
+    
+    t0 = time.perf_counter()
+    ref_onsets, ref_frames = predict_probabilities(model, features, stride=1)
+    ref_seconds = time.perf_counter() - t0
+    print(f"stride=1   {ref_seconds:8.3f}s  (referencia)")
+    
+    failed = []
+    for stride in args.strides:
+        t0 = time.perf_counter()
+        onsets, frames = predict_probabilities(model, features, stride=stride)
+        seconds = time.perf_counter() - t0
+        
+        assert onsets.shape == ref_onsets.shape and frames.shape == ref_frames.shape
+        on = compare(ref_onsets, onsets, T_ONSETS)
+        fr = compare(ref_frames, frames, T_FRAMES)
+        ok = (
+            max(on["max_abs_diff"], fr["max_abs_diff"]) <= args.tolerance
+            and min(on["binary_agreement"], fr["binary_agreement"]) >= args.min_agreement
+        )
+        if not ok:
+            failed.append(stride)
+        print(
+            f"stride={stride:<3} {seconds:8.3f}s  x{ref_seconds / seconds:5.1f}  "
+            f"onsets: acuerdo {on['binary_agreement']:.4f} max|Δ| {on['max_abs_diff']:.4f}  "
+            f"frames: acuerdo {fr['binary_agreement']:.4f} max|Δ| {fr['max_abs_diff']:.4f}  "
+            f"{'OK' if ok else 'FUERA DE TOLERANCIA'}"
+        )
+
+    if failed:
+        print(f"❌ Strides fuera de tolerancia: {', '.join(str(stride) for stride in failed)}")
+        sys.exit(1)
+    print("✅ Todos los strides dentro de la tolerancia")
+
+
+if __name__ == "__main__":
+    main()
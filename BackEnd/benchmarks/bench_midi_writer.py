@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# benchmarks/bench_midi_writer.py
+#
+# Verifica que el escritor SMF directo (NoteTable.to_midi_bytes) produce
+# exactamente los mismos bytes que PrettyMIDI.write sobre rolls aleatorios, y
+# compara ambos caminos desde los rolls hasta el archivo: tiempo y memoria
+# asignada en Python (tracemalloc) para un pasaje denso.
+#
+# Uso (desde BackEnd/):
+#   python -m benchmarks.bench_midi_writer --cases 200 --seconds 600
+
+import argparse
+import io
+import time
+import tracemalloc
+
+import numpy as np
+
+from services.midi_decoding import piano_roll_to_notes, SR, HOP_LENGTH
+from benchmarks.bench_decoder import random_rolls, frame_times_for
+
+
+def pretty_midi_bytes(notes) -> bytes:
+    """Camino anterior: un pm.Note por nota y PrettyMIDI.write."""
+    buffer = io.BytesIO()
+    notes.to_pretty_midi().write(buffer)
+    return buffer.getvalue()
+
+
+def check_equivalence(cases: int, seed: int) -> int:
+    rng = np.random.default_rng(seed)
+    checked = 0
+    for n_frames in [1, 2, 3] + [int(rng.integers(1, 2000)) for _ in range(cases)]:
+        onsets, frames = random_rolls(rng, n_frames)
+        for on, fr in ((onsets, frames), (np.ones_like(onsets), np.ones_like(frames)), (onsets, np.zeros_like(frames))):
+            notes = piano_roll_to_notes(on, fr, frame_times_for(n_frames))
+            if notes.to_midi_bytes() != pretty_midi_bytes(notes):
+                raise AssertionError(f"MIDI distinto con n_frames={n_frames} ({len(notes)} notas)")
+            checked += 1
+    return checked
+
+
+def measure(fn) -> tuple:
+    """(resultado, segundos, pico de memoria en MB); tracemalloc va en otra ejecución porque la hace más lenta."""
+    t0 = time.perf_counter()
+    data = fn()
+    seconds = time.perf_counter() - t0
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return data, seconds, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Equivalencia y benchmark del escritor MIDI directo")
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=600.0, help="Duración del roll para el benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    checked = check_equivalence(args.cases, args.seed)
+    print(f"✅ {checked} rolls con MIDI idéntico byte a byte")
+
+    n_frames = int(args.seconds * SR / HOP_LENGTH)
+    onsets, frames = random_rolls(np.random.default_rng(args.seed), n_frames)
+    times = frame_times_for(n_frames)
+    notes = piano_roll_to_notes(onsets, frames, times)
+
+    results = {}
+    for name, fn in (("pretty_midi", lambda: pretty_midi_bytes(notes)), ("directo", notes.to_midi_bytes)):
+        data, seconds, peak_mb = measure(fn)
+        results[name] = (data, seconds)
+        print(f"{name:12s} {seconds * 1000:9.1f} ms  pico {peak_mb:7.1f} MB  "
+              f"({len(notes)} notas, {len(data) / 1024:.0f} KB)")
+
+    assert results["pretty_midi"][0] == results["directo"][0]
+    print(f"Aceleración: x{results['pretty_midi'][1] / results['directo'][1]:.1f}")
+
+
+if __name__ == "__main__":
+    main()
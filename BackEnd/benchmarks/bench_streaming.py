@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# benchmarks/bench_streaming.py
+#
+# Compara la extracción de características completa (extract_features) con la
+# versión por bloques (extract_features_streaming): tiempo, pico de memoria
+# (RSS) y diferencia máxima entre ambas salidas.
+# Después verifica que la inferencia con decodificación por chunks
+# (run_streaming_inference, la que usa el servicio) da el mismo MIDI y las
+# mismas probabilidades que la inferencia completa + write_midi_from_rolls, y
+# que IncrementalNoteDecoder equivale a decode_note_indices sobre rolls aleatorios.
+# Las verificaciones van después de las mediciones y la de inferencia corre en
+# su propio subproceso: un hijo arranca con el pico de RSS del padre, así que
+# TensorFlow cargado en el padre taparía la diferencia entre los modos.
+#
+# Uso (desde BackEnd/):
+#   python -m benchmarks.bench_streaming --minutes 1 5 10
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+
+def write_test_wav(path: str, minutes: float, sr: int = 44100, seed: int = 0):
+    """WAV estéreo de 16 bits con tonos decrecientes y ruido, escrito por bloques."""
+    rng = np.random.default_rng(seed)
+    block = sr * 10
+    total = int(minutes * 60 * sr)
+    with sf.SoundFile(path, "w", samplerate=sr, channels=2, subtype="PCM_16") as f:
+        for offset in range(0, total, block):
+            n = min(block, total - offset)
+            t = np.arange(n) / sr
+            freq = rng.uniform(80, 2000)
+            y = 0.3 * np.sin(2 * np.pi * freq * t) * np.exp(-1.5 * t)
+            y += 0.01 * rng.standard_normal(n)
+            f.write(np.stack([y, 0.7 * y], axis=1).astype(np.float32))
+
+
+def check_incremental_decoder(cases: int, seed: int) -> int:
+    """IncrementalNoteDecoder con cortes aleatorios vs. decode_note_indices sobre el roll completo."""
+    from services.midi_decoding import IncrementalNoteDecoder, decode_note_indices
+    from benchmarks.bench_decoder import random_rolls
+    
+    rng = np.random.default_rng(seed)
+    for _ in range(cases):
+        n_frames = int(rng.integers(1, 1500))
+        onsets, frames = random_rolls(rng, n_frames)
+        cuts = np.sort(rng.integers(0, n_frames + 1, int(rng.integers(0, 8))))
+        decoder = IncrementalNoteDecoder()
+        parts = [decoder.feed(onsets[a:b], frames[a:b]) for a, b in zip([0, *cuts], [*cuts, n_frames])]
+        parts.append(decoder.finish())
+        incremental = sorted(zip(*(np.concatenate(column).tolist() for column in zip(*parts))))
+        reference = sorted(zip(*(column.tolist() for column in decode_note_indices(onsets, frames))))
+        if incremental != reference:
+            raise AssertionError(f"Notas distintas con n_frames={n_frames}, cortes={cuts.tolist()}")
+    return cases
+
+
+def check_streaming_inference(tmp: str, seed: int) -> int:
+    """Inferencia por chunks con decodificación incremental vs. la inferencia completa (modelo sustituto)."""
+    from benchmarks.stand_in import build_stand_in_model, synthetic_features
+    from services.audio_processing import compute_frame_times
+    from services.midi_decoding import write_midi_from_rolls, write_midi_from_notes
+    from services.transcription import run_inference_with_sliding_window, run_streaming_inference
+    
+    model = build_stand_in_model(seed)
+    checked = 0
+    for n_frames, stride, chunk_frames in ((2500, 1, 700), (2500, 4, 640), (333, 2, 100)):
+        X = synthetic_features(n_frames, seed)
+        frame_times = compute_frame_times(n_frames)
+        full_npy, chunked_npy = os.path.join(tmp, "completo.npy"), os.path.join(tmp, "chunks.npy")
+        
+        Y_onsets, Y_frames = run_inference_with_sliding_window(model, X, stride, probabilities_path=full_npy)
+        reference = write_midi_from_rolls(Y_onsets, Y_frames, frame_times, None)
+        notes = run_streaming_inference(model, X, stride, probabilities_path=chunked_npy, chunk_frames=chunk_frames)
+        streamed = write_midi_from_notes(*notes, frame_times, None)
+        
+        if streamed["midi_bytes"] != reference["midi_bytes"]:
+            raise AssertionError(f"MIDI distinto con n_frames={n_frames}, stride={stride}")
+        if not np.array_equal(np.load(full_npy), np.load(chunked_npy)):
+            raise AssertionError(f"Probabilidades distintas con n_frames={n_frames}, stride={stride}")
+        checked += 1
+    return checked
+
+
+def measure(mode: str, path: str, out_path: str):
+    """Se ejecuta en un subproceso para medir el pico de RSS de cada modo por separado."""
+    from services.audio_processing import extract_features, extract_features_streaming
+    
+    fn = extract_features_streaming if mode == "streaming" else extract_features
+    t0 = time.perf_counter()
+    X, _ = fn(path)
+    seconds = time.perf_counter() - t0
+    np.save(out_path, X)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"seconds": seconds, "peak_rss_mb": peak_mb, "frames": int(X.shape[0])}))
+
+
+def run_mode(mode: str, path: str, out_path: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_streaming", "--measure", mode, path, out_path],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_inference_check(tmp: str, seed: int) -> int:
+    """check_streaming_inference en un subproceso (TensorFlow no queda cargado en este proceso)."""
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_streaming", "--check-inference", tmp, "--seed", str(seed)],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise AssertionError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "falló")
+    return json.loads(result.stdout.strip().splitlines()[-1])["checked"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extracción por bloques")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--cases", type=int, default=300, help="Rolls aleatorios para el decodificador incremental")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--measure", nargs=3, metavar=("MODE", "WAV", "OUT"), help=argparse.SUPPRESS)
+    parser.add_argument("--check-inference", metavar="TMP", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.measure:
+        measure(*args.measure)
+        return
+    if args.check_inference:
+        print(json.dumps({"checked": check_streaming_inference(args.check_inference, args.seed)}))
+        return
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for minutes in args.minutes:
+            wav = os.path.join(tmp, f"audio_{minutes}min.wav")
+            write_test_wav(wav, minutes)
+            
+            results = {}
+            for mode in ("completo", "streaming"):
+                out = os.path.join(tmp, f"{mode}.npy")
+                results[mode] = run_mode(mode, wav, out)
+            
+            diff = np.max(np.abs(np.load(os.path.join(tmp, "completo.npy")) - np.load(os.path.join(tmp, "streaming.npy"))))
+            size_mb = os.path.getsize(wav) / 1024 / 1024
+            print(f"{minutes:5.1f} min ({size_mb:6.1f} MB)  "
+                  f"completo: {results['completo']['seconds']:6.2f}s {results['completo']['peak_rss_mb']:7.0f} MB  "
+                  f"streaming: {results['streaming']['seconds']:6.2f}s {results['streaming']['peak_rss_mb']:7.0f} MB  "
+                  f"max|Δ| {diff:.2e}")
+        
+        checked = check_incremental_decoder(args.cases, args.seed)
+        print(f"✅ {checked} rolls: decodificación por chunks idéntica a la completa")
+        checked = run_inference_check(tmp, args.seed)
+        print(f"✅ {checked} casos: inferencia por chunks con el mismo MIDI y probabilidades")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# benchmarks/bench_wav_loader.py
+#
+# Compara la carga del audio con librosa.load (load_audio_mono) y con el lector
+# WAV nativo (mapeado en memoria + resample_poly): tiempo, pico de memoria
+# (RSS) y diferencia máxima entre ambas señales y entre las características
+# resultantes (el remuestreador no es el mismo, así que no son idénticas).
+#
+# Uso (desde BackEnd/):
+#   python -m benchmarks.bench_wav_loader --minutes 1 10 60
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_streaming import write_test_wav
+
+
+def measure(mode: str, path: str, out_path: str):
+    """Se ejecuta en un subproceso para medir el pico de RSS de cada modo por separado."""
+    from services.audio_processing import load_audio_mono, SR
+
+    t0 = time.perf_counter()
+    y, _ = load_audio_mono(path, sr=SR, fast_wav=(mode == "nativo"))
+    seconds = time.perf_counter() - t0
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    np.save(out_path, y)
+    print(json.dumps({"seconds": seconds, "peak_rss_mb": peak_mb, "samples": int(len(y))}))
+
+
+def run_mode(mode: str, path: str, out_path: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_wav_loader", "--measure", mode, path, out_path],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def feature_difference(tmp: str) -> float:
+    """Diferencia máxima de las características (pasos filtro -> Mel) entre ambas cargas."""
+    from services.audio_processing import aplicar_filtro_paso_bajo, extract_mel_spectrogram, SR, F_MAX
+
+    X = [
+        extract_mel_spectrogram(aplicar_filtro_paso_bajo(np.load(os.path.join(tmp, f"{mode}.npy")), SR, F_MAX), SR)[0]
+        for mode in ("librosa", "nativo")
+    ]
+    return float(np.max(np.abs(X[0] - X[1])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del lector WAV nativo")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 10, 60])
+    parser.add_argument("--samplerate", type=int, default=44100)
+    parser.add_argument("--features", action="store_true",
+                        help="Comparar también las características (solo el archivo más corto)")
+    parser.add_argument("--measure", nargs=3, metavar=("MODE", "WAV", "OUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, minutes in enumerate(sorted(args.minutes)):
+            wav = os.path.join(tmp, f"audio_{minutes}min.wav")
+            write_test_wav(wav, minutes, sr=args.samplerate)
+
+            results = {}
+            for mode in ("librosa", "nativo"):
+                results[mode] = run_mode(mode, wav, os.path.join(tmp, f"{mode}.npy"))
+
+            y_librosa = np.load(os.path.join(tmp, "librosa.npy"), mmap_mode="r")
+            y_native = np.load(os.path.join(tmp, "nativo.npy"), mmap_mode="r")
+            same_length = len(y_librosa) == len(y_native)
+            diff = float(np.max(np.abs(y_librosa - y_native))) if same_length else float("nan")
+            del y_librosa, y_native
+            size_mb = os.path.getsize(wav) / 1024 / 1024
+            line = (
+                f"{minutes:5.1f} min ({size_mb:6.1f} MB)  "
+                f"librosa: {results['librosa']['seconds']:6.2f}s {results['librosa']['peak_rss_mb']:7.0f} MB  "
+                f"nativo: {results['nativo']['seconds']:6.2f}s {results['nativo']['peak_rss_mb']:7.0f} MB  "
+                f"x{results['librosa']['seconds'] / results['nativo']['seconds']:.1f}  "
+                f"max|Δ| señal {diff:.2e}"
+            )
+            if args.features and i == 0:
+                line += f"  características {feature_difference(tmp):.2e}"
+            print(line)
+            os.remove(wav)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# benchmarks/load_inference_server.py
+#
+# Prueba de carga del servidor de inferencia: simula N subidas simultáneas
+# (cada una con su audio de características sintéticas) y compara
+#   - "serial": cada tarea ejecuta su propio model.predict en el único hilo de
+#     inferencia, una tras otra (comportamiento sin servidor).
+#   - "server": un hilo por tarea envía bloques de ventanas al servidor, que
+#     los agrupa en micro-batches compartidos.
+# Reporta el throughput total, la latencia por tarea (p50/p95/máx) y el
+# tamaño medio de los batches, y verifica que ambas salidas coincidan.
+#
+# Uso (desde BackEnd/):
+#   python -m benchmarks.load_inference_server --tasks 8 --seconds 10 --stride 4
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from services.inference_server import InferenceServer
+from services.transcription import predict_probabilities, INFERENCE_BLOCK_SIZE
+from benchmarks.stand_in import build_stand_in_model, synthetic_features
+
+FRAMES_PER_SECOND = 43
+
+
+def run_load(submit_task, inputs, workers: int, arrival_spread: float):
+    """
+    Lanza una tarea por entrada (llegadas repartidas en `arrival_spread` segundos)
+    y retorna (segundos totales, latencias por tarea, resultados).
+    """
+    def arrive(i):
+        # La latencia se mide desde la llegada: incluye la espera por el ejecutor
+        time.sleep(arrival_spread * i / max(1, len(inputs) - 1))
+        t0 = time.perf_counter()
+        result = executor.submit(submit_task, i, inputs[i]).result()
+        return time.perf_counter() - t0, result
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(inputs)) as arrivals, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [arrivals.submit(arrive, i) for i in range(len(inputs))]
+        outcomes = [f.result() for f in futures]
+    total = time.perf_counter() - t0
+    return total, [o[0] for o in outcomes], [o[1] for o in outcomes]
+
+
+def summarize(name: str, total: float, latencies, n_windows: int, audio_seconds: float):
+    lat = np.array(latencies)
+    print(
+        f"{name:<7} total {total:7.2f}s  {n_windows / total:8.0f} ventanas/s  "
+        f"{audio_seconds / total:6.1f} s de audio/s  latencia p50 {np.percentile(lat, 50):6.2f}s  "
+        f"p95 {np.percentile(lat, 95):6.2f}s  máx {lat.max():6.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor de inferencia")
+    parser.add_argument("--tasks", type=int, default=8, help="Subidas simultáneas")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Duración de cada audio")
+    parser.add_argument("--stride", type=int, default=4)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--arrival-spread", type=float, default=0.0,
+                        help="Segundos entre la primera y la última llegada")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model = build_stand_in_model(seed=args.seed)
+    n_frames = int(args.seconds * FRAMES_PER_SECOND)
+    inputs = [synthetic_features(n_frames, seed=args.seed + i) for i in range(args.tasks)]
+    n_windows = args.tasks * -(-n_frames // args.stride)
+    audio_seconds = args.tasks * args.seconds
+    print(f"{args.tasks} tareas de {args.seconds:.0f}s ({n_frames} frames), stride={args.stride}, "
+          f"{n_windows} ventanas en total")
+
+    # Calentamiento de las dos rutas (formas de batch de Keras y del servidor)
+    predict_probabilities(model, inputs[0][:400], stride=args.stride)
+    for size in range(INFERENCE_BLOCK_SIZE, args.max_batch + 1, INFERENCE_BLOCK_SIZE):
+        model.predict_on_batch(np.zeros((size,) + model.input_shape[1:], dtype=np.float32))
+
+    # 1. Sin servidor: un model.predict por tarea en un único hilo
+    total, latencies, serial_results = run_load(
+        lambda i, features: predict_probabilities(model, features, stride=args.stride),
+        inputs, workers=1, arrival_spread=args.arrival_spread
+    )
+    summarize("serial", total, latencies, n_windows, audio_seconds)
+    serial_total = total
+
+    # 2. Con servidor: micro-batches compartidos entre todas las tareas
+    server = InferenceServer()
+    server.start(lambda: model, args.max_batch, args.max_wait_ms / 1000, bucket=INFERENCE_BLOCK_SIZE)
+    try:
+        total, latencies, server_results = run_load(
+            lambda i, features: predict_probabilities(
+                None, features, stride=args.stride,
+                predict_fn=lambda windows: server.submit(f"tarea-{i}", windows)
+            ),
+            inputs, workers=args.tasks, arrival_spread=args.arrival_spread
+        )
+    finally:
+        server.shutdown()
+    summarize("server", total, latencies, n_windows, audio_seconds)
+    print(f"aceleración x{serial_total / total:.2f}")
+
+    stats = server.stats()
+    print(f"batches: {stats['batches']}  ventanas por batch: {stats['avg_batch_windows']}  "
+          f"tareas por batch: {stats['avg_batch_tasks']}  espera en cola p50 {stats['queue_wait_p50_s']}s "
+          f"p95 {stats['queue_wait_p95_s']}s")
+
+    max_diff = max(
+        float(np.max(np.abs(a - b)))
+        for serial, batched in zip(serial_results, server_results)
+        for a, b in zip(serial, batched)
+    )
+    print(f"diferencia máxima de probabilidades entre modos: {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
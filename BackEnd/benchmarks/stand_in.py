@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# benchmarks/stand_in.py
+#
+# Modelo sustituto con pesos aleatorios y las mismas formas de entrada/salida que
+# el CNN-LSTM real: (SEQ_LEN, 384) -> dos salidas (SEQ_LEN, 88), y audio de
+# piano sintético y determinista (notas aleatorias de pretty_midi sintetizadas
+# con parciales y envolvente de piano).
+# Permite medir el pipeline sin el modelo privado modelos/modelo.keras.
+
+import numpy as np
+import keras
+import pretty_midi
+import soundfile as sf
+
+from services.transcription import SEQ_LEN, N_MELS_MODELO, N_KEYS
+
+
+def build_stand_in_model(seed: int = 0, units: int = 64) -> keras.Model:
+    """Construye un CNN-LSTM pequeño con pesos aleatorios deterministas."""
+    keras.utils.set_random_seed(seed)
+    
+    inputs = keras.Input(shape=(SEQ_LEN, N_MELS_MODELO))
+    x = keras.layers.Conv1D(units, 3, padding="same", activation="relu")(inputs)
+    x = keras.layers.Conv1D(units, 3, padding="same", activation="relu")(x)
+    x = keras.layers.Bidirectional(keras.layers.LSTM(units, return_sequences=True))(x)
+    onsets = keras.layers.Dense(N_KEYS, activation="sigmoid", name="onsets")(x)
+    frames = keras.layers.Dense(N_KEYS, activation="sigmoid", name="frames")(x)
+    
+    return keras.Model(inputs, [onsets, frames], name="stand_in_cnn_lstm")
+
+
+def synthetic_features(n_frames: int, seed: int = 0) -> np.ndarray:
+    """
+    Características sintéticas (n_frames, 384) con estructura temporal suave,
+    en el mismo rango que extract_mel_spectrogram (dB/80 + 1).
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.standard_normal((n_frames, N_MELS_MODELO)).astype(np.float32)
+    # Suavizado temporal simple para imitar la continuidad de un espectrograma
+    kernel = np.ones(5, dtype=np.float32) / 5
+    smooth = np.apply_along_axis(lambda col: np.convolve(col, kernel, mode="same"), 0, noise)
+    return (0.5 + 0.25 * smooth).astype(np.float32)
+
+
+def random_piano_notes(seconds: float, polyphony: int = 4, seed: int = 0) -> pretty_midi.PrettyMIDI:
+    """
+    Notas aleatorias deterministas: `polyphony` voces que tocan notas seguidas
+    (0.1-1s, con pausas cortas), cada una en su propio registro del teclado.
+    """
+    rng = np.random.default_rng(seed)
+    midi = pretty_midi.PrettyMIDI()
+    piano = pretty_midi.Instrument(program=0, name="Piano")
+    for voice in range(polyphony):
+        # Registros repartidos entre A0 (21) y C8 (108), solapados
+        low = 21 + int(voice * 70 / max(1, polyphony))
+        t = float(rng.uniform(0, 0.5))
+        while t < seconds:
+            duration = float(rng.uniform(0.1, 1.0))
+            piano.notes.append(pretty_midi.Note(
+                velocity=int(rng.integers(40, 111)),
+                pitch=int(rng.integers(low, min(108, low + 24) + 1)),
+                start=t,
+                end=min(t + duration, seconds)
+            ))
+            t += duration + float(rng.uniform(0.0, 0.3))
+    piano.notes.sort(key=lambda note: note.start)
+    midi.instruments.append(piano)
+    return midi
+
+
+def write_piano_wav(path: str, seconds: float, polyphony: int = 4, sr: int = 44100,
+                    seed: int = 0, block_seconds: float = 10.0) -> pretty_midi.PrettyMIDI:
+    """
+    Sintetiza random_piano_notes en un WAV estéreo de 16 bits, por bloques
+    (memoria acotada también para audios largos). Cada nota suma parciales
+    levemente inarmónicos con ataque corto, decaimiento que depende de la
+    altura y liberación al soltar la tecla. Retorna las notas (referencia).
+    """
+    midi = random_piano_notes(seconds, polyphony, seed)
+    notes = midi.instruments[0].notes
+    release = 0.15
+    gain = 0.8 / max(1, polyphony)
+    total = int(seconds * sr)
+    block = int(block_seconds * sr)
+    first = 0
+    with sf.SoundFile(path, "w", samplerate=sr, channels=2, subtype="PCM_16") as f:
+        for offset in range(0, total, block):
+            n = min(block, total - offset)
+            y = np.zeros(n, dtype=np.float64)
+            t_block = offset / sr
+            t_end = (offset + n) / sr
+            # Las notas están ordenadas por inicio: saltar las que ya terminaron
+            while first < len(notes) and notes[first].end + release < t_block - 1.0:
+                first += 1
+            for note in notes[first:]:
+                if note.start >= t_end:
+                    break
+                if note.end + release <= t_block:
+                    continue
+                a = max(0, int(note.start * sr) - offset)
+                b = min(n, int((note.end + release) * sr) - offset)
+                if b <= a:
+                    continue
+                t = (offset + np.arange(a, b)) / sr - note.start
+                y[a:b] += gain * (note.velocity / 127) * _piano_tone(note.pitch, t, note.end - note.start, release, sr)
+            np.clip(y, -1.0, 1.0, out=y)
+            f.write(np.stack([y, 0.8 * y], axis=1).astype(np.float32))
+    return midi
+
+
+def _piano_tone(pitch: int, t: np.ndarray, held: float, release: float, sr: int) -> np.ndarray:
+    """Tono de una nota en los instantes `t` (segundos desde su inicio)."""
+    f0 = pretty_midi.note_number_to_hz(pitch)
+    tone = np.zeros(len(t))
+    for k in range(1, 7):
+        # Inarmonicidad de cuerda: los parciales altos quedan un poco sobre k * f0
+        fk = k * f0 * np.sqrt(1 + 1e-4 * k * k)
+        if fk >= sr / 2:
+            break
+        tone += np.sin(2 * np.pi * fk * t) / k ** 1.5
+    envelope = np.minimum(t / 0.005, 1.0) * np.exp(-t * (1.0 + (pitch - 21) / 30))
+    released = t > held
+    envelope[released] *= np.exp(-(t[released] - held) / (release / 5))
+    return tone * envelope
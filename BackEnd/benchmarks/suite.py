@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+# benchmarks/suite.py
+#
+# Suite de benchmarks reproducible, sin el modelo privado: sintetiza audios de
+# piano deterministas (benchmarks/stand_in.py) y usa el modelo sustituto con
+# pesos aleatorios (o --model). Mide:
+#   - Pipeline: características -> inferencia -> MIDI con la configuración
+#     actual (STREAMING_FEATURES, INFERENCE_BACKEND, INFERENCE_STRIDE...), cada
+#     duración en su propio subproceso: tiempo de punta a punta (p50/p95),
+#     segundos de audio por segundo, tiempo por etapa y pico de RSS.
+#   - HTTP: levanta la API con uvicorn y lanza --http-clients clientes que
+#     suben el audio y esperan el resultado: latencia p50/p95, throughput,
+#     rechazos 503, tiempo medio por etapa (de /metrics) y pico de RSS.
+# Los resultados se guardan en JSON (por defecto benchmarks/results/<commit>.json)
+# para comparar entre commits con --compare.
+#
+# Uso (desde BackEnd/):
+#   python -m benchmarks.suite --durations 10 60 600 --runs 3
+#   python -m benchmarks.suite --durations 10 --http-clients 4 --http-requests 16
+#   python -m benchmarks.suite --compare benchmarks/results/a1b2c3d.json benchmarks/results/e4f5a6b.json
+
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FOLDER = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+
+def percentiles(values: List[float]) -> Optional[dict]:
+    if not values:
+        return None
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p95": round(float(np.percentile(values, 95)), 4),
+        "max": round(float(values.max()), 4),
+        "mean": round(float(values.mean()), 4),
+    }
+
+
+def git_revision() -> str:
+    """Commit actual (con "-dirty" si hay cambios sin guardar), o "desconocido"."""
+    try:
+        rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        return f"{rev}-dirty" if dirty else rev
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+
+def pipeline_config() -> dict:
+    """Opciones de config.py que cambian lo que se mide."""
+    from config import settings
+    return {
+        name: getattr(settings, name) for name in (
+            "STREAMING_FEATURES", "PIPELINED_INGEST", "FAST_WAV_LOADER", "INFERENCE_BACKEND",
+            "INFERENCE_STRIDE", "INFERENCE_THREADS", "INFERENCE_SERVER_ENABLED", "CPU_WORKERS",
+            "MAX_CONCURRENT_TRANSCRIPTIONS",
+        )
+    }
+
+
+# --- Pipeline (subproceso por duración) ---
+
+def measure_pipeline(wav_path: str, model_path: str, runs: str, workdir: str):
+    """Se ejecuta en un subproceso: `runs` transcripciones del WAV, una tras otra."""
+    from config import settings
+    from services.metrics import metrics
+    from services.model_registry import model_registry
+    from services.midi_decoding import write_midi_from_rolls
+    from services.transcription import run_inference_with_sliding_window
+    from routers.upload import feature_function
+
+    metrics.start(True)
+    model_registry.configure(settings.INFERENCE_BACKEND, os.path.join(workdir, "exportados"),
+                             settings.INFERENCE_THREADS)
+    with metrics.collect(publish=False) as startup:
+        model_registry.load(model_path)
+    model = model_registry.get_model()
+    feature_fn = feature_function()
+    midi_path = os.path.join(workdir, "bench.mid")
+
+    end_to_end, stage_runs = [], []
+    for _ in range(int(runs)):
+        t0 = time.perf_counter()
+        with metrics.collect(publish=False) as records:
+            X_features, frame_times = feature_fn(wav_path)
+            with metrics.stage("inference"):
+                Y_onsets, Y_frames = run_inference_with_sliding_window(
+                    model, X_features, stride=settings.INFERENCE_STRIDE
+                )
+            info = write_midi_from_rolls(Y_onsets, Y_frames, frame_times, midi_path)
+        end_to_end.append(time.perf_counter() - t0)
+        stage_runs.append(metrics.breakdown(records))
+
+    print(json.dumps({
+        "startup": metrics.breakdown(startup),
+        "end_to_end": end_to_end,
+        "stage_runs": stage_runs,
+        "frames": int(X_features.shape[0]),
+        "notes": info.get("total_notes"),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def summarize_stages(stage_runs: List[Dict[str, dict]]) -> Dict[str, dict]:
+    """Mediana del tiempo y máximo del crecimiento de RSS de cada etapa entre corridas."""
+    summary = {}
+    for name in stage_runs[0]:
+        entries = [run[name] for run in stage_runs if name in run]
+        summary[name] = {"seconds_p50": round(float(np.median([e["seconds"] for e in entries])), 4)}
+        deltas = [e["rss_delta_mb"] for e in entries if "rss_delta_mb" in e]
+        if deltas:
+            summary[name]["rss_delta_mb_max"] = max(deltas)
+    return summary
+
+
+def run_pipeline(duration: float, wav_path: str, model_path: str, runs: int, workdir: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.suite", "--measure-pipeline", wav_path, model_path, str(runs), workdir],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Falló la medición de {duration}s:\n{result.stderr[-2000:]}")
+    raw = json.loads(result.stdout.strip().splitlines()[-1])
+    latency = percentiles(raw["end_to_end"])
+    return {
+        "duration_seconds": duration,
+        "runs": runs,
+        "frames": raw["frames"],
+        "notes": raw["notes"],
+        "end_to_end_seconds": latency,
+        # Segundos de audio transcritos por segundo de reloj (mediana)
+        "audio_seconds_per_second": round(duration / latency["p50"], 2),
+        "peak_rss_mb": round(raw["peak_rss_mb"], 1),
+        "startup": raw["startup"],
+        "stages": summarize_stages(raw["stage_runs"]),
+    }
+
+
+# --- Prueba de carga HTTP ---
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_tree_peak_rss_mb(pid: int) -> Dict[str, float]:
+    """Pico de RSS (VmHWM) del servidor y la suma de los de sus procesos hijos."""
+    def vm_hwm(p: int) -> float:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                match = re.search(r"VmHWM:\s+(\d+) kB", f.read())
+            return int(match.group(1)) / 1024 if match else 0.0
+        except OSError:
+            return 0.0
+
+    def children(p: int) -> List[int]:
+        pids = []
+        for task in os.listdir(f"/proc/{p}/task") if os.path.isdir(f"/proc/{p}/task") else []:
+            try:
+                with open(f"/proc/{p}/task/{task}/children") as f:
+                    pids += [int(c) for c in f.read().split()]
+            except OSError:
+                pass
+        return pids
+
+    pending, workers = children(pid), 0.0
+    while pending:
+        child = pending.pop()
+        workers += vm_hwm(child)
+        pending += children(child)
+    return {"server_mb": round(vm_hwm(pid), 1), "workers_mb": round(workers, 1)}
+
+
+def parse_stage_means(text: str) -> Dict[str, float]:
+    """Tiempo medio por etapa a partir de los histogramas de /metrics."""
+    sums, counts = {}, {}
+    for name, target in (("sum", sums), ("count", counts)):
+        pattern = rf'^transcription_stage_seconds_{name}{{stage="([^"]+)"}} (\S+)$'
+        for stage, value in re.findall(pattern, text, flags=re.MULTILINE):
+            target[stage] = float(value)
+    return {stage: round(sums[stage] / counts[stage], 4) for stage in sums if counts.get(stage)}
+
+
+def run_http_load(wav_path: str, duration: float, model_path: str, clients: int,
+                  requests: int, workdir: str) -> dict:
+    import httpx
+
+    port = free_port()
+    data = os.path.join(workdir, "servidor")
+    env = {
+        **os.environ,
+        "MODEL_PATH": model_path,
+        "EXPORT_FOLDER": os.path.join(data, "exportados"),
+        # Los MIDI se escriben en "temp_uploads" relativo al directorio de trabajo
+        "UPLOAD_FOLDER": os.path.join(data, "temp_uploads"),
+        "JOB_QUEUE_PATH": os.path.join(data, "trabajos.db"),
+        "CHECKPOINT_FOLDER": os.path.join(data, "checkpoints"),
+        "TASK_STORE": "memory",
+        # Todas las subidas son el mismo audio: sin caché se transcribe cada una
+        "CACHE_ENABLED": "false",
+        "METRICS_ENABLED": "true",
+        "MAX_FILE_SIZE": str(max(os.path.getsize(wav_path) * 2, 10 * 1024 * 1024)),
+        "MODEL_WATCH_INTERVAL": "0",
+    }
+    # El servidor corre en el directorio temporal: los archivos de salida (y el
+    # .env de BackEnd/, que no se carga) quedan fuera del repositorio
+    os.makedirs(data, exist_ok=True)
+    log_path = os.path.join(workdir, "uvicorn.log")
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=data, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 180
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"El servidor terminó al iniciar (ver {log_path})")
+            try:
+                if httpx.get(f"{base_url}/health", timeout=2).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError(f"El servidor no respondió (ver {log_path})")
+            time.sleep(0.5)
+
+        with open(wav_path, "rb") as f:
+            audio = f.read()
+        latencies, outcomes = [], {"completed": 0, "failed": 0, "rejected": 0}
+        lock = threading.Lock()
+        remaining = [requests]
+
+        def client():
+            with httpx.Client(base_url=base_url, timeout=600) as http:
+                while True:
+                    with lock:
+                        if remaining[0] == 0:
+                            return
+                        remaining[0] -= 1
+                    t0 = time.perf_counter()
+                    response = http.post("/api/v1/transcribe/", files={"file": ("bench.wav", audio, "audio/wav")})
+                    if response.status_code == 503:
+                        with lock:
+                            outcomes["rejected"] += 1
+                        continue
+                    response.raise_for_status()
+                    task_id = response.json()["task_id"]
+                    while True:
+                        status = http.get(f"/api/v1/transcribe/status/{task_id}").json()["status"]
+                        if status in ("completed", "failed"):
+                            break
+                        time.sleep(0.05)
+                    with lock:
+                        outcomes[status] += 1
+                        if status == "completed":
+                            latencies.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - t0
+
+        metrics_text = httpx.get(f"{base_url}/metrics", timeout=10).text
+        peak = process_tree_peak_rss_mb(server.pid)
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    return {
+        "clients": clients,
+        "requests": requests,
+        "audio_duration_seconds": duration,
+        **outcomes,
+        "wall_seconds": round(wall, 3),
+        "latency_seconds": percentiles(latencies),
+        "requests_per_second": round(outcomes["completed"] / wall, 3),
+        "audio_seconds_per_second": round(outcomes["completed"] * duration / wall, 2),
+        "stage_mean_seconds": parse_stage_means(metrics_text),
+        "peak_rss_mb": peak,
+    }
+
+
+# --- Comparación ---
+
+def ratio(old: Optional[float], new: Optional[float]) -> str:
+    if not old or not new:
+        return "    -"
+    return f"x{old / new:5.2f}"
+
+
+def compare(old_path: str, new_path: str):
+    """Imprime las diferencias entre dos resultados (x>1: el nuevo es más rápido)."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['revision']} -> {new['revision']}  (x>1: más rápido / menos memoria)")
+
+    old_runs = {run["duration_seconds"]: run for run in old.get("pipeline", [])}
+    for run in new.get("pipeline", []):
+        before = old_runs.get(run["duration_seconds"])
+        if before is None:
+            continue
+        print(f"{run['duration_seconds']:6.0f}s  punta a punta p50 "
+              f"{before['end_to_end_seconds']['p50']:7.2f}s -> {run['end_to_end_seconds']['p50']:7.2f}s "
+              f"{ratio(before['end_to_end_seconds']['p50'], run['end_to_end_seconds']['p50'])}  "
+              f"RSS {before['peak_rss_mb']:6.0f} -> {run['peak_rss_mb']:6.0f} MB "
+              f"{ratio(before['peak_rss_mb'], run['peak_rss_mb'])}")
+        for stage, entry in run["stages"].items():
+            previous = before["stages"].get(stage, {}).get("seconds_p50")
+            print(f"          {stage:<20} {previous if previous is not None else '-':>8} -> "
+                  f"{entry['seconds_p50']:8.4f}s {ratio(previous, entry['seconds_p50'])}")
+
+    if old.get("http") and new.get("http"):
+        before, after = old["http"], new["http"]
+        print(f"HTTP     audio/s {before['audio_seconds_per_second']:7.2f} -> {after['audio_seconds_per_second']:7.2f} "
+              f"{ratio(after['audio_seconds_per_second'], before['audio_seconds_per_second'])}  "
+              f"latencia p95 {(before['latency_seconds'] or {}).get('p95')} -> "
+              f"{(after['latency_seconds'] or {}).get('p95')}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suite de benchmarks con audio sintético y modelo sustituto")
+    parser.add_argument("--durations", type=float, nargs="+", default=[10, 60, 600], help="Segundos de audio")
+    parser.add_argument("--polyphony", type=int, default=4, help="Voces simultáneas del audio sintético")
+    parser.add_argument("--samplerate", type=int, default=44100)
+    parser.add_argument("--runs", type=int, default=3, help="Transcripciones por duración")
+    parser.add_argument("--model", default=None, help="Modelo .keras (por defecto, el modelo sustituto)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--http-clients", type=int, default=4, help="Clientes simultáneos (0 = sin prueba HTTP)")
+    parser.add_argument("--http-requests", type=int, default=16, help="Subidas en total")
+    parser.add_argument("--http-duration", type=float, default=10, help="Segundos de cada audio subido")
+    parser.add_argument("--output", default=None, help="JSON de resultados")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "DESPUES"), help="Comparar dos resultados")
+    parser.add_argument("--measure-pipeline", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure_pipeline:
+        measure_pipeline(*args.measure_pipeline)
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    from benchmarks.stand_in import build_stand_in_model, write_piano_wav
+
+    revision = git_revision()
+    results = {
+        "revision": revision,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "config": pipeline_config(),
+        "params": {
+            "polyphony": args.polyphony, "samplerate": args.samplerate, "seed": args.seed,
+            "model": args.model or "stand_in",
+        },
+        "pipeline": [],
+        "http": None,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="bench-suite-") as workdir:
+        model_path = args.model
+        if model_path is None:
+            model_path = os.path.join(workdir, "stand_in.keras")
+            build_stand_in_model(seed=args.seed).save(model_path)
+
+        def synthetic_wav(duration: float) -> str:
+            path = os.path.join(workdir, f"piano_{duration:g}s.wav")
+            if not os.path.exists(path):
+                write_piano_wav(path, duration, polyphony=args.polyphony, sr=args.samplerate, seed=args.seed)
+            return path
+
+        for duration in args.durations:
+            wav_path = synthetic_wav(duration)
+            run = run_pipeline(duration, wav_path, model_path, args.runs, workdir)
+            results["pipeline"].append(run)
+            latency = run["end_to_end_seconds"]
+            stages = "  ".join(f"{name} {entry['seconds_p50']:.3f}s" for name, entry in run["stages"].items())
+            print(f"{duration:6.0f}s  p50 {latency['p50']:7.2f}s  p95 {latency['p95']:7.2f}s  "
+                  f"x{run['audio_seconds_per_second']:6.1f} tiempo real  RSS {run['peak_rss_mb']:6.0f} MB  |  {stages}")
+
+        if args.http_clients > 0:
+            wav_path = synthetic_wav(args.http_duration)
+            http = run_http_load(wav_path, args.http_duration, model_path, args.http_clients,
+                                 args.http_requests, workdir)
+            results["http"] = http
+            latency = http["latency_seconds"] or {}
+            print(f"HTTP    {http['clients']} clientes, {http['completed']}/{http['requests']} completadas "
+                  f"({http['rejected']} rechazos 503) en {http['wall_seconds']:.1f}s  "
+                  f"{http['audio_seconds_per_second']:.1f} s de audio/s  latencia p50 {latency.get('p50')}s "
+                  f"p95 {latency.get('p95')}s  RSS servidor {http['peak_rss_mb']['server_mb']:.0f} MB "
+                  f"+ workers {http['peak_rss_mb']['workers_mb']:.0f} MB")
+
+    output = args.output or os.path.join(RESULTS_FOLDER, f"{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"💾 Resultados en {output}")
+
+
+if __name__ == "__main__":
+    main()
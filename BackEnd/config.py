@@ -14,6 +14,87 @@ class Settings(BaseSettings):
     
     # Configuración del modelo de transcripción
     MODEL_PATH: str = os.getenv("MODEL_PATH", "modelos/modelo.keras")
+    # Segundos entre revisiones del archivo del modelo para recargarlo en caliente (0 = desactivado)
+    MODEL_WATCH_INTERVAL: int = int(os.getenv("MODEL_WATCH_INTERVAL", 0))
+    # Frames que aporta cada ventana de inferencia (1 = una ventana por frame, máximo 100)
+    INFERENCE_STRIDE: int = int(os.getenv("INFERENCE_STRIDE", 1))
+    # Backend de inferencia: keras, tf_function, savedmodel, onnx, tflite o tflite_int8
+    INFERENCE_BACKEND: str = os.getenv("INFERENCE_BACKEND", "keras")
+    # Carpeta de los modelos exportados (se generan desde MODEL_PATH si faltan o están desactualizados)
+    EXPORT_FOLDER: str = os.getenv("EXPORT_FOLDER", "modelos/exportados")
+    # Hilos de ONNX Runtime / TFLite (0 = lo que decida el runtime)
+    INFERENCE_THREADS: int = int(os.getenv("INFERENCE_THREADS", 0))
+    
+    # Configuración de workers (procesos para audio/decodificación/PDF y límites de cola)
+    CPU_WORKERS: int = int(os.getenv("CPU_WORKERS", 2))
+    MAX_CONCURRENT_TRANSCRIPTIONS: int = int(os.getenv("MAX_CONCURRENT_TRANSCRIPTIONS", 2))
+    MAX_QUEUED_TRANSCRIPTIONS: int = int(os.getenv("MAX_QUEUED_TRANSCRIPTIONS", 8))
+    
+    # Transcripción por lotes: máximo de archivos por petición y ventanas por llamada al modelo
+    BATCH_MAX_FILES: int = int(os.getenv("BATCH_MAX_FILES", 50))
+    PACKED_BATCH_SIZE: int = int(os.getenv("PACKED_BATCH_SIZE", 256))
+    
+    # Servidor de inferencia: agrupa en micro-batches las ventanas de todas las
+    # transcripciones en curso (hasta INFERENCE_MAX_BATCH ventanas o INFERENCE_MAX_WAIT_MS de espera)
+    INFERENCE_SERVER_ENABLED: bool = os.getenv("INFERENCE_SERVER_ENABLED", "true").lower() == "true"
+    INFERENCE_MAX_BATCH: int = int(os.getenv("INFERENCE_MAX_BATCH", 256))
+    INFERENCE_MAX_WAIT_MS: float = float(os.getenv("INFERENCE_MAX_WAIT_MS", 5))
+    
+    # Extraer características leyendo el WAV por bloques (memoria acotada en archivos largos)
+    STREAMING_FEATURES: bool = os.getenv("STREAMING_FEATURES", "true").lower() == "true"
+    # Calcular las características mientras llega la subida (requiere STREAMING_FEATURES)
+    PIPELINED_INGEST: bool = os.getenv("PIPELINED_INGEST", "true").lower() == "true"
+    # Sin STREAMING_FEATURES: leer el WAV mapeado en memoria y remuestrear con
+    # resample_poly en lugar de librosa.load (más rápido y sin copias completas)
+    FAST_WAV_LOADER: bool = os.getenv("FAST_WAV_LOADER", "true").lower() == "true"
+    
+    # Caché de resultados por contenido (hash del audio + modelo + umbrales)
+    CACHE_ENABLED: bool = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+    CACHE_FOLDER: str = os.getenv("CACHE_FOLDER", "cache")
+    CACHE_MAX_BYTES: int = int(os.getenv("CACHE_MAX_BYTES", 500 * 1024 * 1024))  # 500MB
+    
+    # Método de partitura: "music21" (MuseScore), "lilypond" o "native" (en proceso, sin programas externos)
+    SHEET_MUSIC_METHOD: str = os.getenv("SHEET_MUSIC_METHOD", "music21")
+    
+    # Pool persistente de MuseScore para generar los PDF (0 = lanzar un proceso por PDF)
+    RENDER_POOL_SIZE: int = int(os.getenv("RENDER_POOL_SIZE", 2))
+    RENDER_BATCH_SIZE: int = int(os.getenv("RENDER_BATCH_SIZE", 4))
+    RENDER_BATCH_WAIT: float = float(os.getenv("RENDER_BATCH_WAIT", 0.2))  # segundos
+    RENDER_JOB_TIMEOUT: int = int(os.getenv("RENDER_JOB_TIMEOUT", 30))  # segundos por PDF del lote
+    RENDER_HEALTH_INTERVAL: int = int(os.getenv("RENDER_HEALTH_INTERVAL", 30))
+    
+    # Estado de las tareas: "memory" (un solo proceso) o "sqlite" (compartido entre
+    # workers de uvicorn o contenedores con un volumen común)
+    TASK_STORE: str = os.getenv("TASK_STORE", "memory")
+    TASK_STORE_PATH: str = os.getenv("TASK_STORE_PATH", "data/tareas.db")
+    # Segundos sin cambios tras los que una tarea se elimina
+    TASK_TTL_SECONDS: int = int(os.getenv("TASK_TTL_SECONDS", 3600))
+    # Archivos de las tareas (un directorio por tarea en UPLOAD_FOLDER): cuota total,
+    # al superarla se eliminan las tareas más antiguas; y cada cuánto se revisan los vencimientos
+    ARTIFACT_MAX_BYTES: int = int(os.getenv("ARTIFACT_MAX_BYTES", 2 * 1024 * 1024 * 1024))  # 2GB
+    ARTIFACT_SWEEP_INTERVAL: int = int(os.getenv("ARTIFACT_SWEEP_INTERVAL", 60))  # segundos
+    # Artefactos hasta este tamaño (el MIDI) se guardan en memoria en lugar de en disco.
+    # Con TASK_STORE=sqlite siempre van a disco: otro worker puede servir la descarga
+    ARTIFACT_MEMORY_MAX_BYTES: int = int(os.getenv("ARTIFACT_MEMORY_MAX_BYTES", 1024 * 1024))  # 1MB
+    # Segundos que la tarea sigue disponible después de descargar el MIDI y el PDF
+    ARTIFACT_DOWNLOADED_TTL: int = int(os.getenv("ARTIFACT_DOWNLOADED_TTL", 300))
+    # Cada cuánto se consulta el estado compartido desde el stream de eventos (segundos)
+    TASK_STORE_POLL_INTERVAL: float = float(os.getenv("TASK_STORE_POLL_INTERVAL", 1.0))
+    # Segundos tras los que un PDF/MusicXML "en generación" por otro worker se da por abandonado
+    ARTIFACT_CLAIM_TIMEOUT: int = int(os.getenv("ARTIFACT_CLAIM_TIMEOUT", 300))
+    # Segundos tras un PDF/MusicXML fallido (p. ej. timeout de MuseScore) antes de reintentarlo al pedirlo
+    ARTIFACT_RETRY_SECONDS: int = int(os.getenv("ARTIFACT_RETRY_SECONDS", 30))
+    
+    # Cola persistente de trabajos: se reanudan tras un reinicio desde la última etapa completa
+    JOB_QUEUE_PATH: str = os.getenv("JOB_QUEUE_PATH", "data/trabajos.db")
+    CHECKPOINT_FOLDER: str = os.getenv("CHECKPOINT_FOLDER", "data/checkpoints")
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", 3))  # intentos antes de marcarlo como fallido
+    JOB_LEASE_SECONDS: int = int(os.getenv("JOB_LEASE_SECONDS", 60))  # sin renovar, otro proceso lo retoma
+    JOB_RETRY_BACKOFF: float = float(os.getenv("JOB_RETRY_BACKOFF", 5.0))  # espera base entre intentos
+    
+    # Métricas por etapa (tiempo y memoria) y endpoint /metrics de Prometheus
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_SAMPLE_INTERVAL_MS: float = float(os.getenv("METRICS_SAMPLE_INTERVAL_MS", 10))  # muestreo del RSS
     
     # Configuración de audio
     SAMPLE_RATE: int = 22050
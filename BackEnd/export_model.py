@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# export_model.py
+#
+# Convierte modelos/modelo.keras a los formatos de los backends de inferencia
+# (SavedModel, ONNX, TFLite y TFLite INT8). El servidor también los genera al
+# arrancar si faltan, pero exportarlos de antemano (p. ej. al construir la
+# imagen) evita esa espera en el primer inicio.
+#
+# Uso (desde BackEnd/):
+#   python export_model.py
+#   python export_model.py --formats onnx tflite_int8 --model modelos/modelo.keras
+
+import argparse
+import sys
+
+import keras
+
+from config import settings
+from services.inference_backends import EXPORT_SUFFIXES, export_model, export_lock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportar el modelo a otros backends de inferencia")
+    parser.add_argument("--model", default=settings.MODEL_PATH, help="Modelo .keras de origen")
+    parser.add_argument("--output", default=settings.EXPORT_FOLDER, help="Carpeta de destino")
+    parser.add_argument("--formats", nargs="+", default=list(EXPORT_SUFFIXES),
+                        choices=list(EXPORT_SUFFIXES))
+    args = parser.parse_args()
+
+    model = keras.models.load_model(args.model)
+    failed = False
+    for kind in args.formats:
+        # Un formato que falla (p. ej. sin tf2onnx) no impide exportar los demás
+        try:
+            with export_lock(args.output):
+                export_model(args.model, args.output, [kind], model=model)
+        except Exception as e:
+            failed = True
+            print(f"❌ No se pudo exportar a {kind}: {e}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,70 +1,203 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import os
 import asyncio
 from contextlib import asynccontextmanager
 
-# Tarea de limpieza de fondo
+# Tareas de fondo
 cleanup_task = None
+model_watch_task = None
+job_supervisor_task = None
 
-async def periodic_cleanup():
+async def periodic_cleanup(interval: int):
     """
     Tarea que se ejecuta periódicamente para limpiar archivos antiguos.
-    Elimina archivos en temp_uploads que tengan más de 1 hora.
+    Cada `interval` segundos desaloja las tareas vencidas (TASK_TTL_SECONDS)
+    desde el índice del gestor de artefactos, sin recorrer temp_uploads; una
+    vez por hora purga además las tareas del almacén que no están en el
+    índice de este proceso.
     """
-    from utils.file_handling import cleanup_files
+    from routers.upload import purge_expired_tasks
+    from services.artifacts import artifact_manager
     from config import settings
     import time
     
+    last_purge = time.monotonic()
     while True:
         try:
-            await asyncio.sleep(3600)  # Ejecutar cada hora
+            await asyncio.sleep(interval)
             
-            temp_dir = settings.UPLOAD_FOLDER
-            if not os.path.exists(temp_dir):
-                continue
+            # En un hilo: desalojar borra directorios y el estado de las tareas (SQLite)
+            expired = await asyncio.to_thread(artifact_manager.expire)
+            if expired > 0:
+                print(f"🗑️  Limpieza automática: {expired} tareas vencidas eliminadas con sus archivos")
             
-            current_time = time.time()
-            files_deleted = 0
-            
-            for filename in os.listdir(temp_dir):
-                file_path = os.path.join(temp_dir, filename)
-                
-                if os.path.isfile(file_path):
-                    # Verificar si el archivo tiene más de 1 hora
-                    file_age = current_time - os.path.getmtime(file_path)
-                    if file_age > 3600:  # 1 hora en segundos
-                        cleanup_files([file_path])
-                        files_deleted += 1
-            
-            if files_deleted > 0:
-                print(f"🗑️  Limpieza automática: {files_deleted} archivos antiguos eliminados")
+            if time.monotonic() - last_purge >= 3600:
+                last_purge = time.monotonic()
+                tasks_expired = await asyncio.to_thread(purge_expired_tasks, settings.TASK_TTL_SECONDS)
+                if tasks_expired > 0:
+                    print(f"🗑️  Limpieza automática: {tasks_expired} tareas expiradas eliminadas")
                 
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             print(f"❌ Error en limpieza automática: {e}")
 
+async def watch_model_file(interval: int):
+    """
+    Revisa periódicamente el archivo del modelo y lo recarga en caliente
+    si fue reemplazado en disco.
+    """
+    from services.model_registry import model_registry
+    
+    while True:
+        try:
+            await asyncio.sleep(interval)
+            if await asyncio.to_thread(model_registry.reload_if_changed):
+                print("🔄 Modelo recargado en caliente")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Error recargando el modelo: {e}")
+
+async def supervise_jobs(interval: float):
+    """
+    Renueva el lease de los trabajos de este proceso y retoma los que
+    quedaron sin dueño (por ejemplo, los de un worker que murió).
+    """
+    from routers.upload import resume_jobs
+    from services.job_queue import job_queue
+    
+    while True:
+        try:
+            await asyncio.sleep(interval)
+            # En un hilo: con la base ocupada por otro worker la renovación puede
+            # esperar el lock, y el event loop no debe quedarse bloqueado
+            await asyncio.to_thread(job_queue.heartbeat)
+            resumed = resume_jobs()
+            if resumed:
+                print(f"🔁 {resumed} trabajos sin dueño retomados")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Error supervisando la cola de trabajos: {e}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Gestiona el ciclo de vida de la aplicación.
-    Inicia y detiene tareas de fondo.
+    Carga el modelo, inicia y detiene tareas de fondo.
     """
-    global cleanup_task
+    global cleanup_task, model_watch_task, job_supervisor_task
+    from config import settings
+    from services.model_registry import model_registry
+    from services.workers import worker_pool
+    from services.result_cache import result_cache
+    from services.render_pool import render_pool
+    from services.task_store import task_store
+    from services.job_queue import job_queue
+    from services.inference_server import inference_server
+    from services.transcription import INFERENCE_BLOCK_SIZE
+    from services.metrics import metrics
+    from services.artifacts import artifact_manager
+    from routers.upload import resume_jobs, artifact_keeper, take_task_ownership
+    
+    # Métricas por etapa: antes de cargar el modelo para medir su carga y calentamiento
+    metrics.start(settings.METRICS_ENABLED, settings.METRICS_SAMPLE_INTERVAL_MS / 1000)
+    
+    # Estado de las tareas (en memoria o compartido entre workers)
+    task_store.start(settings.TASK_STORE, settings.TASK_STORE_PATH)
+    
+    # Inicio: Cargar y calentar el modelo una sola vez (con el backend configurado)
+    model_registry.configure(settings.INFERENCE_BACKEND, settings.EXPORT_FOLDER, settings.INFERENCE_THREADS)
+    try:
+        await asyncio.to_thread(model_registry.load, settings.MODEL_PATH)
+    except Exception as e:
+        # El servidor arranca igual; el modelo se intentará cargar en la primera transcripción
+        print(f"⚠️  No se pudo cargar el modelo al iniciar: {e}")
+    
+    # Servidor de inferencia: un solo hilo ejecuta el modelo con las ventanas de todas las tareas
+    if settings.INFERENCE_SERVER_ENABLED:
+        inference_server.start(
+            model_registry.get_model,
+            max_batch=settings.INFERENCE_MAX_BATCH,
+            max_wait=settings.INFERENCE_MAX_WAIT_MS / 1000,
+            bucket=INFERENCE_BLOCK_SIZE
+        )
+    
+    # Pool de workers para el trabajo pesado de las transcripciones
+    worker_pool.start(
+        cpu_workers=settings.CPU_WORKERS,
+        max_concurrent=settings.MAX_CONCURRENT_TRANSCRIPTIONS,
+        max_queued=settings.MAX_QUEUED_TRANSCRIPTIONS,
+        inference_threads=settings.MAX_CONCURRENT_TRANSCRIPTIONS if inference_server.enabled else 1
+    )
+    
+    # Cola persistente: retomar los trabajos que quedaron a medias en el reinicio anterior
+    job_queue.start(
+        settings.JOB_QUEUE_PATH,
+        settings.CHECKPOINT_FOLDER,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        lease_seconds=settings.JOB_LEASE_SECONDS,
+        retry_backoff=settings.JOB_RETRY_BACKOFF
+    )
+    # Índice de los archivos de las tareas (el disco se recorre solo aquí). Cada
+    # worker indexa solo sus tareas: las de otro worker vivo no se tocan
+    orphans = artifact_manager.start(
+        settings.UPLOAD_FOLDER,
+        ttl_seconds=settings.TASK_TTL_SECONDS,
+        max_bytes=settings.ARTIFACT_MAX_BYTES,
+        keep=artifact_keeper(),
+        orphan_age=settings.JOB_LEASE_SECONDS,
+        memory_max_bytes=settings.ARTIFACT_MEMORY_MAX_BYTES if settings.TASK_STORE == "memory" else 0,
+        adopt=take_task_ownership
+    )
+    if orphans:
+        print(f"🗑️  {orphans} archivos huérfanos eliminados")
+    resumed = resume_jobs()
+    if resumed:
+        print(f"🔁 {resumed} trabajos reanudados desde su último checkpoint")
+    job_supervisor_task = asyncio.create_task(supervise_jobs(settings.JOB_LEASE_SECONDS / 3))
+    
+    # Caché de resultados en disco
+    if settings.CACHE_ENABLED:
+        result_cache.start(settings.CACHE_FOLDER, settings.CACHE_MAX_BYTES)
+    
+    # Display virtual y workers de MuseScore persistentes (solo si se usa MuseScore)
+    await render_pool.start(
+        pool_size=settings.RENDER_POOL_SIZE if settings.SHEET_MUSIC_METHOD == "music21" else 0,
+        batch_size=settings.RENDER_BATCH_SIZE,
+        batch_wait=settings.RENDER_BATCH_WAIT,
+        job_timeout=settings.RENDER_JOB_TIMEOUT,
+        health_interval=settings.RENDER_HEALTH_INTERVAL
+    )
+    
+    if settings.MODEL_WATCH_INTERVAL > 0:
+        model_watch_task = asyncio.create_task(watch_model_file(settings.MODEL_WATCH_INTERVAL))
     
-    # Inicio: Crear tarea de limpieza
-    cleanup_task = asyncio.create_task(periodic_cleanup())
+    # Crear tarea de limpieza
+    cleanup_task = asyncio.create_task(periodic_cleanup(settings.ARTIFACT_SWEEP_INTERVAL))
     print("✅ Tarea de limpieza automática iniciada")
     
     yield
     
-    # Cierre: Cancelar tarea de limpieza
-    if cleanup_task:
-        cleanup_task.cancel()
-        try:
-            await cleanup_task
-        except asyncio.CancelledError:
-            pass
+    # Cierre: Cancelar tareas de fondo
+    for task in (cleanup_task, model_watch_task, job_supervisor_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
     print("🛑 Tarea de limpieza automática detenida")
+    
+    await render_pool.shutdown()
+    worker_pool.shutdown()
+    inference_server.shutdown()
+    job_queue.shutdown()
+    task_store.shutdown()
+    print("🛑 Workers detenidos")
 
 app = FastAPI(
     title="Piano Transcription API",
@@ -90,10 +223,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Importa el router de transcripción
-from routers import upload
+# Importa los routers
+from routers import upload, model
+from services.model_registry import model_registry
+from services.workers import worker_pool
+from services.render_pool import render_pool
+from services.task_store import task_store
+from services.job_queue import job_queue
+from services.inference_server import inference_server
+from services.result_cache import result_cache
+from services.artifacts import artifact_manager
+from services.metrics import metrics
 
 app.include_router(upload.router, prefix="/api/v1")
+app.include_router(model.router, prefix="/api/v1")
 
 @app.get("/")
 async def root():
@@ -101,10 +244,74 @@ async def root():
         "message": "Piano Transcription API",
         "version": "1.0.0",
         "status": "running",
+        "model": model_registry.info(),
         "endpoints": {
             "transcribe": "/api/v1/transcribe/",
             "status": "/api/v1/transcribe/status/{task_id}",
+            "events": "/api/v1/transcribe/events/{task_id}",
             "download_midi": "/api/v1/transcribe/download/midi/{task_id}",
-            "download_pdf": "/api/v1/transcribe/download/pdf/{task_id}"
+            "download_pdf": "/api/v1/transcribe/download/pdf/{task_id}",
+            "download_bundle": "/api/v1/transcribe/download/bundle/{task_id}",
+            "health": "/health",
+            "metrics": "/metrics",
+            "cache_stats": "/api/v1/transcribe/cache/stats",
+            "model_reload": "/api/v1/model/reload"
         }
-    }
\ No newline at end of file
+    }
+
+@app.get("/health")
+async def health():
+    """Estado del servicio y del modelo cargado (tiempos de carga y calentamiento)."""
+    return {
+        "status": "ok" if model_registry.is_loaded else "degraded",
+        "model": model_registry.info(),
+        "workers": worker_pool.stats(),
+        "render_pool": render_pool.stats(),
+        "inference_server": inference_server.stats(),
+        "tasks": task_store.stats(),
+        "jobs": job_queue.stats(),
+        "artifacts": artifact_manager.stats()
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Métricas en formato de texto de Prometheus: histogramas de tiempo y memoria
+    por etapa, transcripciones por resultado y el estado actual de las colas.
+    """
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Métricas desactivadas (METRICS_ENABLED=false)")
+    
+    workers = worker_pool.stats()
+    renders = render_pool.stats()
+    cache = result_cache.stats()
+    jobs = job_queue.stats()
+    tasks = task_store.stats()
+    artifacts = artifact_manager.stats()
+    gauges = [
+        ("transcriptions_running", "Transcripciones ejecutándose en este proceso",
+         [({}, workers["running"])]),
+        ("transcriptions_queued", "Transcripciones admitidas esperando un lugar",
+         [({}, workers["queued"])]),
+        ("inference_queue_depth", "Peticiones esperando en el servidor de inferencia",
+         [({}, inference_server.stats()["queue_depth"])]),
+        ("render_queue_depth", "Partituras esperando un worker de MuseScore",
+         [({}, renders["queue_depth"])]),
+        ("render_in_flight", "Partituras generándose en MuseScore",
+         [({}, renders["in_flight"])]),
+        ("jobs", "Trabajos de la cola persistente por estado",
+         [({"state": state}, jobs[state]) for state in ("queued", "running", "done", "dead")]),
+        ("tasks", "Tareas activas por estado",
+         [({"status": status}, count) for status, count in sorted(tasks["by_status"].items())]),
+        ("result_cache_entries", "Entradas en la caché de resultados",
+         [({}, cache["entries"])]),
+        ("result_cache_lookups", "Búsquedas en la caché de resultados desde el inicio",
+         [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])]),
+        ("artifact_tasks", "Tareas con archivos", [({}, artifacts["tasks"])]),
+        ("artifact_bytes", "Bytes de los archivos de las tareas", [({}, artifact_manager.total_bytes)]),
+        ("artifact_memory_bytes", "Bytes de los archivos de las tareas guardados en memoria",
+         [({}, artifact_manager.memory_bytes)]),
+        ("model_loaded", "1 si el modelo está cargado",
+         [({}, int(model_registry.is_loaded))]),
+    ]
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from services.model_registry import model_registry
+import asyncio
+
+router = APIRouter(tags=["Model"])
+
+
+@router.get("/model")
+async def get_model_info():
+    """
+    Información del modelo cargado en memoria.
+    """
+    return JSONResponse(content=model_registry.info())
+
+
+@router.post("/model/reload")
+async def reload_model():
+    """
+    Recarga el modelo en caliente (por ejemplo, después de reemplazar el .keras).
+    Las transcripciones en curso terminan con el modelo anterior.
+    """
+    try:
+        await asyncio.to_thread(model_registry.load)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al recargar el modelo: {str(e)}")
+    
+    return JSONResponse(content={
+        "message": "Modelo recargado exitosamente",
+        "model": model_registry.info()
+    })
@@ -1,282 +1,1580 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
-from services.transcription import transcribe_piano_audio
-from services.sheet_music import generate_sheet_music_pdf
-from utils.file_handling import save_uploaded_file, cleanup_files
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from services.transcription import (
+    run_streaming_inference, run_packed_inference, T_ONSETS, T_FRAMES
+)
+from services.audio_processing import extract_features, extract_features_streaming
+from services.midi_decoding import write_midi_from_rolls, write_midi_from_notes, redecode_probabilities
+from services.model_registry import model_registry
+from services.sheet_music import generate_sheet_music_pdf, midi_to_musicxml
+from services.render_pool import render_pool, RenderError
+from services.workers import worker_pool, QueueFullError
+from services.result_cache import result_cache, make_cache_key
+from services.task_events import task_events
+from services.task_store import task_store
+from services.job_queue import job_queue, LeaseLostError
+from services.inference_server import inference_server
+from services.ingest import MultipartFileStream, PipelinedFeatureIngest
+from services.metrics import metrics
+from services.artifacts import artifact_manager, StoredArtifact, AUDIO_NAME, OUTPUT_STEM
+from services.note_table import NoteTable
+from utils.file_handling import (
+    save_uploaded_file, write_upload_stream, cleanup_files, extract_wavs_from_zip, client_filename,
+    UploadError
+)
+from utils.artifact_responses import artifact_response, iter_zip, content_disposition
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from schemas import RedecodeRequest
+from config import settings
 import os
 import json
+import time
 import asyncio
+import functools
+import shutil
 import uuid
+import zipfile
+from typing import Callable, Optional, Dict, List, Set, Tuple
 
 router = APIRouter(tags=["Piano Transcription"])
 
-# Diccionario en memoria para almacenar estado de transcripciones
-# En producción, usar Redis o base de datos
-transcription_status = {}
+# El estado de las transcripciones vive en task_store (memoria o SQLite compartido)
 
+# Artefactos que se generan bajo demanda a partir del MIDI
+LAZY_ARTIFACTS = ("pdf", "musicxml")
 
-@router.post("/transcribe/")
-async def start_transcription(file: UploadFile = File(...)):
+# Sufijo del nombre de descarga y tipo de contenido de cada artefacto
+ARTIFACT_DOWNLOADS = {
+    "midi": (".mid", "audio/midi"),
+    "pdf": ("_partitura.pdf", "application/pdf"),
+    "musicxml": (".musicxml", "application/vnd.recordare.musicxml+xml"),
+    "notes": ("_notas.bin", "application/octet-stream"),
+}
+
+# Rango de progreso (%) de cada etapa del pipeline
+STAGE_PROGRESS = {
+    "features": (5, 35),
+    "inference": (35, 85),
+    "decoding": (85, 99),
+}
+
+# Mensaje de cada paso informado por los workers
+STEP_MESSAGES = {
+    "load": "Cargando audio...",
+    "filter": "Aplicando filtro paso bajo...",
+    "features": "Extrayendo características del audio...",
+    "inference": "Ejecutando el modelo de transcripción...",
+}
+
+# Segundos entre comentarios keep-alive en el stream de eventos
+EVENTS_KEEPALIVE_SECONDS = 15
+# Segundos mínimos entre escrituras del progreso de una tarea en el almacén
+PROGRESS_WRITE_INTERVAL = 0.5
+# Margen para las cabeceras del multipart al comparar Content-Length con MAX_FILE_SIZE
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Renders en curso por (task_id, artefacto): las peticiones simultáneas esperan el mismo
+artifact_renders: Dict[Tuple[str, str], asyncio.Task] = {}
+
+# Trabajos de la cola con un runner activo en este proceso
+local_jobs: Set[str] = set()
+
+# Etapa en curso de las tareas que procesa este proceso, y último progreso
+# informado por los workers que aún no se escribió en el almacén
+local_stages: Dict[str, str] = {}
+pending_progress: Dict[str, Tuple[Optional[str], float, Optional[str]]] = {}
+progress_writers: Set[str] = set()
+# Escrituras del almacén lanzadas desde callbacks síncronos del event loop
+background_writes: Set[asyncio.Task] = set()
+
+
+# Documentación del cuerpo: el endpoint lee el formulario por su cuenta
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"],
+        }}},
+    }
+}
+
+
+@router.post("/transcribe/", openapi_extra=UPLOAD_REQUEST_BODY)
+async def start_transcription(request: Request):
     """
     Endpoint para iniciar la transcripción de piano.
     Retorna un ID de tarea para hacer seguimiento del progreso.
+    
+    Con PIPELINED_INGEST el formulario se lee a medida que llega y las
+    características del audio se calculan durante la subida; la tarea pasa
+    directo a la inferencia cuando llega el último byte.
     """
-    temp_audio_path = None
+    # Un cuerpo declarado más grande que el límite se rechaza sin leerlo
+    content_length = int(request.headers.get("content-length") or 0)
+    if content_length > settings.MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Archivo demasiado grande. Tamaño máximo: {settings.MAX_FILE_SIZE // (1024 * 1024)}MB"
+        )
     
+    # Reservar un lugar en la cola antes de recibir el archivo completo
     try:
-        # Validar que es un archivo WAV únicamente
-        if not file.filename.lower().endswith('.wav'):
-            raise HTTPException(
-                status_code=400,
-                detail="Formato de audio no soportado. Solo se permiten archivos WAV"
-            )
+        worker_pool.admit()
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Servidor ocupado: {str(e)}",
+            headers={"Retry-After": "30"}
+        )
+    
+    # Generar ID único para esta transcripción (y su directorio de archivos).
+    # Fijada mientras se recibe: la cuota no puede desalojar la subida en curso
+    task_id = str(uuid.uuid4())
+    artifact_manager.task_dir(task_id)
+    artifact_manager.pin(task_id)
+    
+    try:
+        # Guardar el audio en el directorio de la tarea (calculando su hash).
+        # La tarea aún no existe: las etapas de la subida se juntan y se guardan al crearla
+        with metrics.collect() as upload_stages:
+            if settings.PIPELINED_INGEST and settings.STREAMING_FEATURES:
+                filename, temp_audio_path, audio_digest, features = await receive_upload_pipelined(request, task_id)
+            else:
+                filename, temp_audio_path, audio_digest = await receive_upload(request, task_id)
+                features = None
+        artifact_manager.add(task_id, temp_audio_path)
         
-        # Guardar archivo temporalmente
-        temp_audio_path = await save_uploaded_file(file)
+        # Inicializar estado
+        task_record = new_task_record(filename, temp_audio_path, audio_digest)
+        task_record["stages"] = metrics.breakdown(upload_stages)
+        await task_store.acreate(task_id, task_record)
         
-        # Generar ID único para esta transcripción
-        task_id = str(uuid.uuid4())
+        # Si el mismo audio ya se transcribió con el mismo modelo, usar la caché
+        # (si la entrada ya no se puede leer, sigue el pipeline normal)
+        cache_key = build_cache_key(audio_digest)
+        cached = await asyncio.to_thread(result_cache.get, cache_key) if cache_key else None
+        files = await asyncio.to_thread(restore_cached_files, task_id, cache_key, cached) if cached else None
+        if files is not None:
+            await complete_from_cache(task_id, cached, cache_key, files)
+            worker_pool.release()
+            artifact_manager.discard(task_id, temp_audio_path)
+            return JSONResponse(content={
+                "task_id": task_id,
+                "message": "Transcripción recuperada de la caché."
+            })
         
-        # Inicializar estado
-        transcription_status[task_id] = {
-            "status": "pending",
-            "progress": 0,
-            "message": "Iniciando transcripción...",
-            "audio_path": temp_audio_path,
-            "filename": file.filename,
-            "midi_path": None,
-            "pdf_path": None,
-            "error": None
-        }
+        # Características calculadas durante la subida: quedan como checkpoint de la etapa
+        checkpoints = None
+        if features is not None:
+            X_features, frame_times = features
+            outputs = await asyncio.to_thread(
+                job_queue.save_arrays, task_id, features=X_features, frame_times=frame_times
+            )
+            checkpoints = {"features": outputs}
         
-        # Iniciar transcripción en background
-        asyncio.create_task(run_transcription_task(task_id))
+        # Registrar el trabajo en la cola persistente e iniciarlo en background
+        await asyncio.to_thread(job_queue.enqueue, task_id, task_record, checkpoints)
+        start_job_runner(task_id)
         
         return JSONResponse(content={
             "task_id": task_id,
             "message": "Transcripción iniciada. Use /transcribe/status/{task_id} para ver el progreso."
         })
-        
+    
+    except HTTPException:
+        worker_pool.release()
+        artifact_manager.evict(task_id)
+        raise
+    except UploadError as e:
+        worker_pool.release()
+        artifact_manager.evict(task_id)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
-        if temp_audio_path and os.path.exists(temp_audio_path):
-            cleanup_files([temp_audio_path])
+        worker_pool.release()
+        artifact_manager.evict(task_id)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        artifact_manager.unpin(task_id)
+
+
+def check_wav_filename(filename: str):
+    if not filename.lower().endswith('.wav'):
+        raise HTTPException(
+            status_code=400,
+            detail="Formato de audio no soportado. Solo se permiten archivos WAV"
+        )
+
 
+async def receive_upload(request: Request, task_id: str) -> Tuple[str, str, str]:
+    """Lee el formulario completo y guarda el audio: (nombre original, ruta, hash)."""
+    form = await request.form()
+    file = form.get("file")
+    if not isinstance(file, StarletteUploadFile):
+        raise UploadError("Falta el archivo en el campo 'file' del formulario")
+    filename = client_filename(file.filename)
+    check_wav_filename(filename)
+    with metrics.stage("upload_save"):
+        path, digest = await save_uploaded_file(
+            file, artifact_manager.task_dir(task_id), filename=AUDIO_NAME, validate_wav=True
+        )
+    return filename, path, digest
 
-async def run_transcription_task(task_id: str):
+
+async def receive_upload_pipelined(request: Request, task_id: str):
     """
-    Ejecuta la tarea de transcripción en background.
+    Lee el archivo del formulario a medida que llega: cada bloque se guarda
+    en disco y a la vez alimenta la extracción de características.
+    Retorna (nombre original, ruta, hash, (características, tiempos) o None);
+    None si el WAV no se pudo procesar por partes (la tarea lo hará normalmente).
     """
-    task_data = transcription_status[task_id]
-    audio_path = task_data["audio_path"]
-    filename = task_data["filename"]
+    stream = MultipartFileStream(request, "file")
+    filename = client_filename(await stream.open())
+    check_wav_filename(filename)
     
+    path = os.path.join(artifact_manager.task_dir(task_id), AUDIO_NAME)
+    ingest = PipelinedFeatureIngest(worker_pool.run_ingest)
     try:
-        # Actualizar estado
-        task_data["status"] = "processing"
-        task_data["message"] = "Procesando transcripción..."
+        with metrics.stage("upload_save"):
+            digest = await write_upload_stream(stream.chunks(), path, validate_wav=True, on_chunk=ingest.feed)
+    except BaseException:
+        await ingest.close()
+        raise
+    
+    t0 = time.perf_counter()
+    with metrics.stage("features_pipelined"):
+        features = await ingest.finish()
+    if features is None:
+        print(f"⚠️  Características de {filename} en la ruta normal: {ingest.failed}")
+    else:
+        print(f"⚡ Características de {filename} listas {time.perf_counter() - t0:.2f}s después del último byte")
+    return filename, path, digest, features
+
+
+@router.post("/transcribe/batch")
+async def start_batch_transcription(files: List[UploadFile] = File(...)):
+    """
+    Transcribe varios archivos WAV (o uno o más ZIP con WAVs) en una sola petición.
+    Las ventanas de todos los archivos se empaquetan en batches compartidos del
+    modelo. Cada archivo recibe su propio task_id, así que su estado, MIDI y PDF
+    se consultan con los endpoints de siempre. La respuesta llega al terminar e
+    incluye el throughput (segundos de audio por segundo de reloj).
+    """
+    for file in files:
+        if not file.filename.lower().endswith(('.wav', '.zip')):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Formato no soportado: {file.filename}. Solo se permiten archivos WAV o ZIP"
+            )
+    if len(files) > settings.BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El lote supera el máximo de {settings.BATCH_MAX_FILES} archivos"
+        )
+    
+    # Un lote ocupa un solo lugar en la cola
+    try:
+        worker_pool.admit()
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Servidor ocupado: {str(e)}",
+            headers={"Retry-After": "30"}
+        )
+    
+    batch_id = str(uuid.uuid4())
+    batch_dir = os.path.join(settings.UPLOAD_FOLDER, f"lote_{batch_id}")
+    try:
+        # Marcado como propio antes de recibir los archivos: no es un huérfano para otro worker
+        artifact_manager.claim_dir(batch_dir)
+        try:
+            with metrics.stage("upload_save"):
+                entries = await save_batch_files(files, batch_dir)
+        except UploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except (ValueError, zipfile.BadZipFile) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not entries:
+            raise HTTPException(status_code=400, detail="El lote no contiene archivos WAV")
         
-        # Definir rutas de salida
-        output_dir = "temp_uploads"
-        base_name = os.path.splitext(filename)[0]
-        midi_path = os.path.join(output_dir, f"{base_name}_{task_id}.mid")
-        pdf_path = os.path.join(output_dir, f"{base_name}_{task_id}_partitura.pdf")
+        result = await run_batch_transcription(batch_id, entries)
+        return JSONResponse(content=result)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        worker_pool.release()
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+
+async def save_batch_files(files: List[UploadFile], batch_dir: str) -> List[Tuple[str, str, str]]:
+    """Guarda los archivos de un lote (extrayendo los ZIP): [(nombre, ruta, hash), ...]."""
+    entries = []
+    for file in files:
+        name = client_filename(file.filename)
+        # Prefijo con el índice: el lote puede traer nombres repetidos
+        try:
+            path, digest = await save_uploaded_file(
+                file, batch_dir, filename=f"{len(entries):03d}_{name}", validate_wav=name.lower().endswith(".wav")
+            )
+        except UploadError as e:
+            raise UploadError(f"{name}: {e}", e.status_code)
+        if name.lower().endswith(".zip"):
+            entries.extend(await asyncio.to_thread(
+                extract_wavs_from_zip, path, batch_dir, len(entries), settings.BATCH_MAX_FILES
+            ))
+            os.remove(path)
+        else:
+            entries.append((name, path, digest))
+    
+    if len(entries) > settings.BATCH_MAX_FILES:
+        raise ValueError(f"El lote supera el máximo de {settings.BATCH_MAX_FILES} archivos")
+    return entries
+
+
+async def fail_task(task_id: str, error: Exception):
+    message = str(error) or type(error).__name__
+    local_stages.pop(task_id, None)
+    await task_store.aupdate(task_id, status="failed", error=message, message=f"Error: {message}")
+    task_events.notify(task_id)
+    metrics.increment("transcriptions_total", status="failed")
+
+
+def infer_packed_with_shared_model(features_list: list, stride: int, probabilities_paths: list):
+    """Inferencia empaquetada de un lote con el modelo del registro (worker de inferencia)."""
+    model = model_registry.get_model()
+    with metrics.stage("inference_packed"):
+        return run_packed_inference(
+            model, features_list, stride=stride,
+            batch_size=settings.PACKED_BATCH_SIZE, probabilities_paths=probabilities_paths
+        )
+
+
+async def run_batch_transcription(batch_id: str, entries: List[Tuple[str, str, str]]) -> dict:
+    """
+    Ejecuta un lote. Sus tareas quedan fijadas mientras dura la petición: el
+    TTL y la cuota no las desalojan a mitad del lote.
+    """
+    task_ids: List[str] = []
+    try:
+        return await transcribe_batch(batch_id, entries, task_ids)
+    finally:
+        for task_id in task_ids:
+            artifact_manager.unpin(task_id)
+
+
+async def transcribe_batch(batch_id: str, entries: List[Tuple[str, str, str]], task_ids: List[str]) -> dict:
+    """
+    Pipeline de un lote: características de todos los archivos en paralelo,
+    una sola inferencia empaquetada y decodificación en paralelo. Un archivo
+    que falla no detiene a los demás. Agrega a `task_ids` cada tarea creada
+    (y fijada).
+    """
+    t0 = time.perf_counter()
+    pending, cached, filenames = [], 0, {}
+    for filename, audio_path, audio_digest in entries:
+        task_id = str(uuid.uuid4())
+        artifact_manager.task_dir(task_id)
+        artifact_manager.pin(task_id)
+        task_ids.append(task_id)
+        filenames[task_id] = filename
+        await task_store.acreate(task_id, {**new_task_record(filename, audio_path, audio_digest), "batch_id": batch_id})
+        
+        cache_key = build_cache_key(audio_digest)
+        cached_result = await asyncio.to_thread(result_cache.get, cache_key) if cache_key else None
+        files = None
+        if cached_result:
+            files = await asyncio.to_thread(restore_cached_files, task_id, cache_key, cached_result)
+        if files is not None:
+            await complete_from_cache(task_id, cached_result, cache_key, files)
+            cached += 1
+        else:
+            pending.append(task_id)
+    
+    timings, paths = {}, {}
+    async with worker_pool.running_slot():
+        tasks = {task_id: await task_store.aget(task_id) for task_id in pending}
+        for task_id in pending:
+            await task_store.aupdate(task_id, status="processing")
+            await set_stage(task_id, "features", 5, "Extrayendo características del audio...")
+        
+        # 1. Características de todos los archivos (pool de procesos, en paralelo)
+        t_stage = time.perf_counter()
+        feature_fn = feature_function()
+        features = await asyncio.gather(*(
+            worker_pool.run_cpu(feature_fn, tasks[task_id]["audio_path"], progress_task=task_id)
+            for task_id in pending
+        ), return_exceptions=True)
+        ready = []
+        for task_id, result in zip(pending, features):
+            if isinstance(result, Exception):
+                await fail_task(task_id, result)
+            else:
+                ready.append((task_id, result))
+        timings["features_seconds"] = round(time.perf_counter() - t_stage, 3)
+        
+        # 2. Inferencia empaquetada: ventanas de todos los archivos en batches compartidos
+        t_stage = time.perf_counter()
+        rolls = []
+        if ready:
+            for task_id, _ in ready:
+                await set_stage(task_id, "inference", 35, "Ejecutando el modelo de transcripción (lote)...")
+            paths = {task_id: task_output_paths(task_id) for task_id, _ in ready}
+            try:
+                rolls = await worker_pool.run_inference(
+                    infer_packed_with_shared_model,
+                    [X_features for _, (X_features, _) in ready],
+                    settings.INFERENCE_STRIDE,
+                    [paths[task_id]["probabilities"] for task_id, _ in ready]
+                )
+            except Exception as e:
+                for task_id, _ in ready:
+                    await fail_task(task_id, e)
+                ready = []
+        timings["inference_seconds"] = round(time.perf_counter() - t_stage, 3)
+        
+        # 3. Decodificar a MIDI (pool de procesos, en paralelo)
+        t_stage = time.perf_counter()
+        for task_id, _ in ready:
+            await set_stage(task_id, "decoding", 85, "Generando archivo MIDI...")
+        decoded = await asyncio.gather(*(
+            worker_pool.run_cpu(
+                write_midi_from_rolls, Y_onsets, Y_frames, frame_times, None, metrics_task=task_id
+            )
+            for (task_id, (_, frame_times)), (Y_onsets, Y_frames) in zip(ready, rolls)
+        ), return_exceptions=True)
+        timings["decoding_seconds"] = round(time.perf_counter() - t_stage, 3)
+    
+    audio_seconds = 0.0
+    for (task_id, _), result in zip(ready, decoded):
+        if isinstance(result, Exception):
+            await fail_task(task_id, result)
+            continue
+        audio_seconds += result.get("duration_seconds", 0.0)
+        midi_path = paths[task_id]["midi"]
+        probabilities_path = paths[task_id]["probabilities"]
+        midi_data = keep_midi(task_id, paths[task_id], result)
+        artifact_manager.add(task_id, probabilities_path)
+        await record_timing(task_id, "midi_ready_seconds", time.time() - tasks[task_id]["created_at"])
+        await complete_task(task_id, result, midi_path=midi_path, probabilities_path=probabilities_path)
+        await set_stage(task_id, "done", 100, "Transcripción completada exitosamente")
         
-        # 1. Transcribir audio a MIDI
-        transcription_result = transcribe_piano_audio(audio_path, midi_path)
-        task_data["midi_path"] = midi_path
+        cache_key = build_cache_key(tasks[task_id]["audio_digest"])
+        if cache_key:
+            try:
+                await asyncio.to_thread(
+                    result_cache.put, cache_key, midi_path, None, result, probabilities_path, midi_data
+                )
+                await task_store.aupdate(task_id, cache_key=cache_key)
+            except Exception as cache_error:
+                print(f"⚠️  No se pudo guardar en caché: {cache_error}")
+    
+    wall_seconds = time.perf_counter() - t0
+    file_results = []
+    for task_id in task_ids:
+        task_data = await task_store.aget(task_id)
+        if task_data is None:
+            # Eliminada durante el lote (p. ej. por la limpieza de otro worker)
+            file_results.append({
+                "task_id": task_id, "filename": filenames[task_id], "status": "failed",
+                "error": "La tarea se eliminó durante el lote", "cached": False,
+                "duration_seconds": None, "total_notes": None,
+            })
+            continue
+        info = task_data.get("transcription_info") or {}
+        file_results.append({
+            "task_id": task_id,
+            "filename": task_data["filename"],
+            "status": task_data["status"],
+            "error": task_data.get("error"),
+            "cached": bool(info.get("cached")),
+            "duration_seconds": info.get("duration_seconds"),
+            "total_notes": info.get("total_notes"),
+        })
+    
+    completed = sum(1 for item in file_results if item["status"] == "completed")
+    print(f"📦 Lote {batch_id}: {completed}/{len(task_ids)} archivos, "
+          f"{audio_seconds:.1f}s de audio en {wall_seconds:.1f}s")
+    return {
+        "batch_id": batch_id,
+        "total_files": len(task_ids),
+        "completed": completed,
+        "failed": len(task_ids) - completed,
+        "cached": cached,
+        "audio_seconds": round(audio_seconds, 2),
+        "wall_seconds": round(wall_seconds, 3),
+        # Segundos de audio transcritos (sin contar la caché) por segundo de reloj
+        "throughput": round(audio_seconds / wall_seconds, 2) if wall_seconds > 0 else None,
+        "timings": timings,
+        "files": file_results
+    }
+
+
+def new_task_record(filename: str, audio_path: str, audio_digest: str) -> dict:
+    """
+    Estado inicial de una tarea (también se guarda en la cola para recrearla
+    al reanudar). `filename` es el nombre del cliente ya saneado (client_filename);
+    `owner` es el proceso que tiene la tarea en su índice de artefactos.
+    """
+    return {
+        "status": "pending",
+        "owner": artifact_manager.owner,
+        "stage": "queued",
+        "progress": 0,
+        "message": "En cola, esperando un worker disponible...",
+        "audio_path": audio_path,
+        "filename": filename,
+        "audio_digest": audio_digest,
+        "midi_path": None,
+        "pdf_path": None,
+        "pdf_status": "pending",
+        "pdf_error": None,
+        "musicxml_path": None,
+        "musicxml_status": "pending",
+        "musicxml_error": None,
+        "probabilities_path": None,
+        "cache_key": None,
+        "created_at": time.time(),
+        "timings": {},
+        "stages": {},
+        "error": None
+    }
+
+
+def build_cache_key(audio_digest: str) -> Optional[str]:
+    """Clave de caché para un audio con el modelo y los parámetros actuales."""
+    if not result_cache.enabled or not model_registry.fingerprint:
+        return None
+    return make_cache_key(
+        audio_digest,
+        model_registry.fingerprint,
+        backend=model_registry.backend,
+        t_onsets=T_ONSETS,
+        t_frames=T_FRAMES,
+        stride=settings.INFERENCE_STRIDE,
+        streaming=settings.STREAMING_FEATURES,
+        fast_wav=uses_fast_wav_loader()
+    )
+
+
+def uses_fast_wav_loader() -> bool:
+    """El lector WAV nativo solo se usa en la extracción completa (sin streaming)."""
+    return settings.FAST_WAV_LOADER and not settings.STREAMING_FEATURES
+
+
+def feature_function():
+    """Función de extracción de características según la configuración."""
+    if settings.STREAMING_FEATURES:
+        return extract_features_streaming
+    return functools.partial(extract_features, fast_wav=uses_fast_wav_loader())
+
+
+def task_output_paths(task_id: str) -> Dict[str, str]:
+    """
+    Rutas de los archivos de una tarea: MIDI, lista de notas, PDF, MusicXML y
+    probabilidades crudas. Los nombres son fijos dentro del directorio de la
+    tarea; el nombre del cliente solo aparece en las descargas (download_name).
+    """
+    output_dir = artifact_manager.task_dir(task_id)
+    return {
+        "midi": os.path.join(output_dir, f"{OUTPUT_STEM}.mid"),
+        "notes": os.path.join(output_dir, f"{OUTPUT_STEM}_notas.bin"),
+        "pdf": os.path.join(output_dir, f"{OUTPUT_STEM}_partitura.pdf"),
+        "musicxml": os.path.join(output_dir, f"{OUTPUT_STEM}.musicxml"),
+        "probabilities": os.path.join(output_dir, f"{OUTPUT_STEM}_probabilidades.npy"),
+    }
+
+
+def restore_cached_files(task_id: str, cache_key: str, cached: dict) -> Optional[dict]:
+    """
+    Copia un resultado de la caché a los archivos de la tarea (se ejecuta en un hilo).
+    Retorna los campos de la tarea que apuntan a los archivos copiados, o None
+    si la entrada ya no se puede leer (p. ej. otro worker la desalojó): la
+    tarea sigue entonces por el pipeline normal.
+    """
+    paths = task_output_paths(task_id)
+    
+    try:
+        with open(cached["midi_path"], "rb") as f:
+            artifact_manager.store(task_id, paths["midi"], f.read())
+        fields = {"midi_path": paths["midi"]}
+        if cached["pdf_path"]:
+            shutil.copyfile(cached["pdf_path"], paths["pdf"])
+            fields["pdf_path"] = paths["pdf"]
+            fields["pdf_status"] = "ready"
+        if cached["probabilities_path"]:
+            shutil.copyfile(cached["probabilities_path"], paths["probabilities"])
+            fields["probabilities_path"] = paths["probabilities"]
+    except OSError as e:
+        print(f"⚠️  No se pudo restaurar de la caché, se transcribe de nuevo: {e}")
+        artifact_manager.discard(task_id, paths["midi"], paths["pdf"], paths["probabilities"])
+        result_cache.discard(cache_key)
+        return None
+    return fields
+
+
+async def complete_from_cache(task_id: str, cached: dict, cache_key: str, files: dict):
+    """Marca completada una tarea restaurada desde la caché."""
+    def apply(task: dict):
+        task.update(files)
+        task["cache_key"] = cache_key
+        task["timings"]["midi_ready_seconds"] = round(time.time() - task["created_at"], 3)
+        task["status"] = "completed"
+        task["transcription_info"] = {**cached["info"], "midi_path": files["midi_path"], "cached": True}
+    
+    await task_store.amutate(task_id, apply)
+    artifact_manager.add(task_id, files["midi_path"], files.get("pdf_path"), files.get("probabilities_path"))
+    await set_stage(task_id, "done", 100, "Transcripción completada (resultado en caché)")
+    metrics.increment("transcriptions_total", status="cached")
+
+
+async def complete_task(task_id: str, transcription_result: dict, **fields):
+    """
+    Marca completada una tarea. transcription_info lleva el desglose por etapa
+    medido hasta ahora (las etapas posteriores, como el PDF, se agregan al terminar).
+    """
+    def apply(task: dict):
+        task.update(fields)
+        task["status"] = "completed"
+        task["transcription_info"] = {**transcription_result, "stages": dict(task.get("stages") or {})}
+    
+    await task_store.amutate(task_id, apply)
+    artifact_manager.touch(task_id)
+    metrics.increment("transcriptions_total", status="completed")
+
+
+def keep_midi(task_id: str, paths: Dict[str, str], result: dict) -> Optional[bytes]:
+    """
+    Guarda el MIDI y la lista de notas que devolvió el worker como artefactos
+    de la tarea (en memoria o, si son grandes, en disco) y los quita del resultado.
+    """
+    midi_data = result.pop("midi_bytes", None)
+    notes_data = result.pop("notes_bytes", None)
+    result["midi_path"] = paths["midi"]
+    if midi_data is not None:
+        artifact_manager.store(task_id, paths["midi"], midi_data)
+    if notes_data is not None:
+        artifact_manager.store(task_id, paths["notes"], notes_data)
+    return midi_data
+
+
+async def set_stage(task_id: str, stage: str, progress: int, message: str):
+    """Actualiza la etapa, el progreso y el mensaje de una tarea y avisa a los suscriptores."""
+    # El progreso pendiente de la etapa anterior ya no corresponde
+    pending_progress.pop(task_id, None)
+    if stage in STAGE_PROGRESS:
+        local_stages[task_id] = stage
+    else:
+        local_stages.pop(task_id, None)
+    await task_store.aupdate(task_id, stage=stage, step=None, progress=progress, message=message)
+    task_events.notify(task_id)
+
+
+async def record_timing(task_id: str, name: str, seconds: float):
+    """Guarda una duración en task["timings"]."""
+    await task_store.amutate(task_id, lambda task: task["timings"].update({name: round(seconds, 3)}))
+
+
+def write_in_background(coro):
+    """Lanza una escritura del almacén sin esperarla (desde un callback síncrono del event loop)."""
+    task = asyncio.ensure_future(coro)
+    background_writes.add(task)
+    task.add_done_callback(background_writes.discard)
+
+
+def handle_stage_progress(task_id: str, fraction: float, step: Optional[str] = None):
+    """
+    Progreso informado por los workers dentro de la etapa actual (se ejecuta
+    en el event loop). No escribe en el almacén: guarda el último valor y un
+    escritor por tarea lo publica como mucho cada PROGRESS_WRITE_INTERVAL segundos.
+    """
+    previous = pending_progress.get(task_id)
+    if step is None and previous is not None:
+        step = previous[2]
+    pending_progress[task_id] = (local_stages.get(task_id), fraction, step)
+    if task_id not in progress_writers:
+        progress_writers.add(task_id)
+        write_in_background(write_stage_progress(task_id))
+
+
+async def write_stage_progress(task_id: str):
+    """Escribe el progreso pendiente de una tarea hasta que no llegue más."""
+    try:
+        while task_id in pending_progress:
+            await write_progress(task_id, *pending_progress.pop(task_id))
+            await asyncio.sleep(PROGRESS_WRITE_INTERVAL)
+    finally:
+        progress_writers.discard(task_id)
+
+
+async def write_progress(task_id: str, stage: Optional[str], fraction: float, step: Optional[str]):
+    """Publica un progreso de `stage`; solo si cambia el porcentaje o el paso."""
+    def apply(task: dict):
+        # Progreso de una etapa que ya terminó
+        if task.get("stage") not in STAGE_PROGRESS or (stage and task["stage"] != stage):
+            return False
         
-        # 2. Generar partitura PDF
-        task_data["message"] = "Generando partitura en PDF..."
+        low, high = STAGE_PROGRESS[task["stage"]]
+        progress = int(low + (high - low) * min(max(fraction, 0.0), 1.0))
+        if progress <= task["progress"] and step == task.get("step"):
+            return False
         
+        task["progress"] = max(progress, task["progress"])
+        if step and step != task.get("step"):
+            task["step"] = step
+            task["message"] = STEP_MESSAGES.get(step, task["message"])
+    
+    try:
+        if await task_store.amutate(task_id, apply) is not None:
+            task_events.notify(task_id)
+    except Exception as e:
+        print(f"⚠️  No se pudo guardar el progreso de {task_id}: {e}")
+
+
+worker_pool.progress_listener = handle_stage_progress
+
+
+def handle_stage_metrics(task_id: str, name: str, entry: dict):
+    """
+    Guarda el tiempo y la memoria de una etapa en la tarea (task["stages"]).
+    Desde el event loop la escritura corre en segundo plano.
+    """
+    def apply(task: dict):
+        task.setdefault("stages", {})[name] = entry
+        if task.get("transcription_info") is not None:
+            task["transcription_info"]["stages"] = dict(task["stages"])
+    
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # Hilo del worker de inferencia u otro hilo fuera del event loop
+        task_store.mutate(task_id, apply)
+        return
+    write_in_background(task_store.amutate(task_id, apply))
+
+
+metrics.stage_listener = handle_stage_metrics
+
+
+def infer_with_shared_model(X_features, stride: int, probabilities_path: Optional[str] = None,
+                            task_id: Optional[str] = None):
+    """
+    Inferencia con el modelo del registro (se ejecuta en el worker de inferencia).
+    Con el servidor de inferencia activo, las ventanas se envían a su cola y se
+    agrupan con las de las demás transcripciones en curso. Cada chunk se
+    decodifica al salir del modelo: retorna las notas (keys, start_idx, end_idx).
+    """
+    model, predict_fn = None, None
+    if inference_server.enabled:
+        client_id = task_id or str(uuid.uuid4())
+        predict_fn = lambda windows: inference_server.submit(client_id, windows)
+    else:
+        model = model_registry.get_model()
+    progress = None
+    if task_id is not None:
+        progress = lambda fraction: worker_pool.publish_progress(task_id, fraction, "inference")
+    with metrics.stage("inference", task_id):
+        return run_streaming_inference(
+            model, X_features, stride=stride, probabilities_path=probabilities_path,
+            progress=progress, predict_fn=predict_fn
+        )
+
+
+async def render_task_pdf(midi_path: str, pdf_path: str, title: str) -> str:
+    """
+    Genera la partitura de una tarea con el pool persistente de MuseScore.
+    Si el pool no está activo (o se eligió otro método) se usa
+    generate_sheet_music_pdf; si MuseScore falla se usa el grabado nativo.
+    """
+    composer = "Generado por IA CNN-LSTM"
+    method = settings.SHEET_MUSIC_METHOD
+    if method != "music21" or not render_pool.enabled:
+        return await worker_pool.run_cpu(
+            generate_sheet_music_pdf, midi_path, pdf_path, title, composer, method
+        )
+    
+    try:
+        return await render_pool.render(midi_path, pdf_path)
+    except RenderError as e:
+        print(f"Falló MuseScore, usando el grabado nativo: {e}")
         try:
-            pdf_result = generate_sheet_music_pdf(
-                midi_path,
-                pdf_path,
-                title=f"Transcripción: {base_name}",
-                composer="Generado por IA CNN-LSTM"
+            return await worker_pool.run_cpu(
+                generate_sheet_music_pdf, midi_path, pdf_path, title, composer, "native"
             )
-            task_data["pdf_path"] = pdf_result
-        except Exception as pdf_error:
-            # Si falla la generación del PDF, al menos tenemos el MIDI
-            print(f"Error generando PDF: {pdf_error}")
-            task_data["pdf_path"] = None
-            task_data["message"] = f"Transcripción completada (PDF no disponible: {str(pdf_error)})"
+        except Exception as e2:
+            raise Exception(f"Todos los métodos fallaron. MuseScore: {e}, nativo: {e2}")
+
+
+async def claim_artifact(task_id: str, kind: str) -> Optional[str]:
+    """
+    Reserva la generación del PDF o MusicXML para este worker (transición
+    atómica pending -> rendering). Si otro worker ya lo está generando, espera
+    su resultado y retorna la ruta; retorna None cuando la reserva es nuestra.
+    """
+    status_field = f"{kind}_status"
+    claimed_field = f"{kind}_claimed_at"
+    while not await task_store.atransition(
+        task_id, status_field, ("pending",), **{status_field: "rendering", claimed_field: time.time()}
+    ):
+        task_data = await task_store.aget(task_id)
+        if task_data is None:
+            raise Exception("Tarea no encontrada")
         
-        # Completar tarea
-        task_data["status"] = "completed"
-        task_data["progress"] = 100
-        task_data["message"] = "Transcripción completada exitosamente"
-        task_data["transcription_info"] = transcription_result
+        status = task_data[status_field]
+        path = task_data.get(f"{kind}_path")
+        if status == "ready":
+            if path and os.path.exists(path):
+                return path
+            # El archivo ya no existe (p. ej. lo borró la limpieza): generarlo otra vez
+            await task_store.atransition(task_id, status_field, ("ready",), **{status_field: "pending"})
+            continue
+        if status == "failed":
+            if await retry_failed_artifact(task_id, kind, task_data):
+                continue
+            raise Exception(task_data.get(f"{kind}_error") or f"Error generando {kind}")
         
+        # "rendering" en otro worker: esperar, salvo que lleve demasiado tiempo
+        claimed_at = task_data.get(claimed_field) or 0
+        if time.time() - claimed_at > settings.ARTIFACT_CLAIM_TIMEOUT:
+            await task_store.atransition(task_id, claimed_field, (claimed_at,), **{status_field: "pending"})
+            continue
+        await asyncio.sleep(settings.TASK_STORE_POLL_INTERVAL)
+    
+    return None
+
+
+async def render_artifact(task_id: str, kind: str) -> str:
+    """Genera el PDF o el MusicXML de una tarea a partir de su MIDI."""
+    existing = await claim_artifact(task_id, kind)
+    if existing:
+        return existing
+    task_events.notify(task_id)
+    
+    task_data = await task_store.aget(task_id)
+    midi_path = task_data["midi_path"]
+    output_path = task_output_paths(task_id)[kind]
+    status_field = f"{kind}_status"
+    
+    t0 = time.perf_counter()
+    try:
+        # MuseScore y music21 leen el MIDI desde un archivo
+        await asyncio.to_thread(artifact_manager.materialize, task_id, midi_path)
+        with metrics.stage(f"{kind}_render", task_id):
+            if kind == "pdf":
+                title = f"Transcripción: {os.path.splitext(task_data['filename'])[0]}"
+                result_path = await render_task_pdf(midi_path, output_path, title)
+            else:
+                result_path = await worker_pool.run_cpu(midi_to_musicxml, midi_path, output_path)
     except Exception as e:
-        task_data["status"] = "failed"
-        task_data["error"] = str(e)
-        task_data["message"] = f"Error: {str(e)}"
+        print(f"Error generando {kind}: {e}")
+        await task_store.atransition(
+            task_id, status_field, ("rendering",),
+            **{status_field: "failed", f"{kind}_error": str(e), f"{kind}_failed_at": time.time()}
+        )
+        task_events.notify(task_id)
+        raise
+    
+    # Solo se marca listo si nadie descartó los artefactos mientras tanto (re-decodificación)
+    await task_store.atransition(
+        task_id, status_field, ("rendering",), **{status_field: "ready", f"{kind}_path": result_path}
+    )
+    await record_timing(task_id, f"{kind}_seconds", time.perf_counter() - t0)
+    artifact_manager.add(task_id, result_path)
+    artifact_manager.touch(task_id)
+    task_events.notify(task_id)
+    
+    # Completar la entrada de caché para que la próxima subida ya tenga partitura
+    if kind == "pdf" and task_data.get("cache_key"):
+        try:
+            await asyncio.to_thread(result_cache.add_pdf, task_data["cache_key"], result_path)
+        except Exception as cache_error:
+            print(f"⚠️  No se pudo guardar el PDF en caché: {cache_error}")
     
+    return result_path
+
+
+async def retry_failed_artifact(task_id: str, kind: str, task_data: dict) -> bool:
+    """
+    Un PDF o MusicXML fallido vuelve a "pending" (y se genera otra vez) si
+    pasaron ARTIFACT_RETRY_SECONDS desde el fallo: un error pasajero, como
+    un timeout de MuseScore, no deja la tarea sin partitura para siempre.
+    """
+    failed_at = task_data.get(f"{kind}_failed_at") or 0
+    if time.time() - failed_at < settings.ARTIFACT_RETRY_SECONDS:
+        return False
+    status_field = f"{kind}_status"
+    await task_store.atransition(
+        task_id, status_field, ("failed",), **{status_field: "pending", f"{kind}_error": None}
+    )
+    return True
+
+
+async def ensure_artifact(task_id: str, kind: str) -> str:
+    """
+    Devuelve la ruta del PDF o MusicXML de una tarea, generándolo la primera vez.
+    Las peticiones simultáneas para la misma tarea comparten un único render
+    (dentro del proceso con artifact_renders, entre workers con claim_artifact).
+    """
+    task_data = await task_store.aget(task_id)
+    path = task_data.get(f"{kind}_path")
+    if path and os.path.exists(path):
+        return path
+    if task_data.get(f"{kind}_status") == "failed" and not await retry_failed_artifact(task_id, kind, task_data):
+        raise Exception(task_data.get(f"{kind}_error") or f"Error generando {kind}")
+    
+    key = (task_id, kind)
+    render = artifact_renders.get(key)
+    if render is None:
+        render = asyncio.create_task(render_artifact(task_id, kind))
+        artifact_renders[key] = render
+        render.add_done_callback(lambda _: artifact_renders.pop(key, None))
+    
+    # shield: si un cliente se desconecta, el render sigue para los demás
+    return await asyncio.shield(render)
+
+
+async def reset_artifacts(task_id: str):
+    """Descarta el PDF y el MusicXML de una tarea (p. ej. tras cambiar su MIDI)."""
+    # Esperar renders en curso para que no escriban sobre el MIDI nuevo
+    pending = [render for (tid, _), render in artifact_renders.items() if tid == task_id]
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    def apply(task: dict):
+        for kind in LAZY_ARTIFACTS:
+            artifact_manager.discard(task_id, task.get(f"{kind}_path"))
+            task[f"{kind}_path"] = None
+            task[f"{kind}_status"] = "pending"
+            task[f"{kind}_error"] = None
+            task["timings"].pop(f"{kind}_seconds", None)
+    
+    await task_store.amutate(task_id, apply)
+    task_events.notify(task_id)
+
+
+def start_job_runner(task_id: str):
+    """
+    Ejecuta un trabajo de la cola en background (el lugar ya se reservó con admit).
+    Mientras corre, sus archivos no se desalojan por TTL ni por la cuota.
+    """
+    local_jobs.add(task_id)
+    artifact_manager.pin(task_id)
+    
+    def finished(_):
+        local_jobs.discard(task_id)
+        artifact_manager.unpin(task_id)
+    
+    runner = asyncio.create_task(run_transcription_job(task_id))
+    runner.add_done_callback(finished)
+
+
+def resume_jobs() -> int:
+    """
+    Retoma los trabajos sin dueño activo: los que quedaron en cola o a medias
+    tras un reinicio, o los de otro worker que dejó de renovar su lease.
+    """
+    resumed = 0
+    for job in job_queue.recoverable():
+        if job["task_id"] in local_jobs:
+            continue
+        try:
+            worker_pool.admit()
+        except QueueFullError:
+            break
+        start_job_runner(job["task_id"])
+        resumed += 1
+    return resumed
+
+
+def take_task_ownership(task_id: str, force: bool = False) -> bool:
+    """
+    Pone a este proceso como dueño de la tarea si su dueño ya no está activo,
+    o siempre con `force` (este proceso reclamó su trabajo). Retorna True si
+    la tarea es de este proceso.
+    """
+    me = artifact_manager.owner
+    
+    def apply(task: dict):
+        owner = task.get("owner")
+        if owner == me:
+            return False
+        if not force and owner and artifact_manager.owner_alive(owner) is not False:
+            return False
+        task["owner"] = me
+    
+    task = task_store.mutate(task_id, apply) or task_store.get(task_id)
+    return task is not None and task.get("owner") == me
+
+
+def adopt_task(task_id: str, force: bool = False) -> bool:
+    """Pasa una tarea (y sus archivos) al índice de este proceso si puede ser suya."""
+    if not take_task_ownership(task_id, force):
+        return False
+    artifact_manager.adopt(task_id)
+    return True
+
+
+def artifact_keeper() -> Callable[[str], bool]:
+    """
+    Reconoce las entradas de UPLOAD_FOLDER que siguen vigentes al iniciar: el
+    audio (o el directorio) de un trabajo pendiente, o el directorio de una
+    tarea que todavía existe en el almacén. El resto son huérfanos.
+    """
+    in_use = set()
+    for path in job_queue.active_audio_paths():
+        if path:
+            in_use.add(os.path.abspath(path))
+            in_use.add(os.path.dirname(os.path.abspath(path)))
+    
+    def keep(path: str) -> bool:
+        path = os.path.abspath(path)
+        if path in in_use:
+            return True
+        return os.path.isdir(path) and task_store.get(os.path.basename(path)) is not None
+    
+    return keep
+
+
+async def run_transcription_job(task_id: str):
+    """
+    Ejecuta un trabajo de la cola persistente: lo reclama, corre las etapas que
+    faltan y, si falla, lo reintenta con espera exponencial hasta
+    JOB_MAX_ATTEMPTS; después queda como "dead" y la tarea como fallida.
+    Si el lease venció y otro proceso reclamó el trabajo, este runner lo
+    deja: no lo termina, no lo reencola y no borra sus archivos.
+    Las operaciones de la cola (SQLite) corren en un hilo.
+    """
+    try:
+        while True:
+            job = await asyncio.to_thread(job_queue.claim, task_id)
+            if job is None:
+                # Otro proceso lo tomó, o ya no está en cola
+                return
+            
+            # Con el almacén en memoria la tarea se pierde al reiniciar: recrearla
+            if await task_store.aget(task_id) is None:
+                await task_store.acreate(task_id, job["payload"])
+            # El trabajo es de este proceso: sus archivos pasan a su índice
+            await asyncio.to_thread(adopt_task, task_id, True)
+            
+            try:
+                await run_transcription_task(task_id, job["checkpoints"])
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                try:
+                    retry_in = await asyncio.to_thread(job_queue.fail, task_id, error)
+                except LeaseLostError as lost:
+                    print(f"⚠️  {lost}: se descarta el error de este intento ({error})")
+                    return
+                if retry_in is None:
+                    print(f"❌ Trabajo {task_id} falló {job['attempts'] + 1} veces: {error}")
+                    await task_store.aupdate(task_id, status="failed", error=error, message=f"Error: {error}")
+                    task_events.notify(task_id)
+                    metrics.increment("transcriptions_total", status="failed")
+                    artifact_manager.discard(task_id, job["payload"]["audio_path"])
+                    job_queue.discard_checkpoints(task_id)
+                    return
+                
+                attempt = job["attempts"] + 2
+                local_stages.pop(task_id, None)
+                await task_store.aupdate(
+                    task_id, status="pending", stage="queued", step=None, progress=0,
+                    message=f"Error: {error}. Reintentando en {retry_in:.0f}s "
+                            f"(intento {attempt} de {job_queue.max_attempts})..."
+                )
+                task_events.notify(task_id)
+                await asyncio.sleep(retry_in)
+                continue
+            
+            if not await asyncio.to_thread(job_queue.complete, task_id):
+                # El proceso que lo reclamó todavía necesita el audio y los checkpoints
+                print(f"⚠️  El trabajo {task_id} lo tomó otro proceso antes de terminar aquí")
+                return
+            artifact_manager.discard(task_id, job["payload"]["audio_path"])
+            job_queue.discard_checkpoints(task_id)
+            return
     finally:
-        # Limpiar archivo de audio temporal
-        if os.path.exists(audio_path):
-            cleanup_files([audio_path])
+        worker_pool.release()
 
 
-async def cleanup_task_files(task_id: str, delay: int = 5):
+async def run_transcription_task(task_id: str, checkpoints: Optional[dict] = None):
     """
-    Limpia los archivos asociados a una tarea después de un delay.
-    Se ejecuta después de que el usuario descargue los archivos.
+    Ejecuta las etapas de la transcripción, saltando las que ya tienen
+    checkpoint (trabajo reanudado). El trabajo pesado corre en el pool de
+    workers para no bloquear el event loop. Los errores se propagan al runner.
     """
-    await asyncio.sleep(delay)
+    checkpoints = checkpoints or {}
+    task_data = await task_store.aget(task_id)
+    audio_path = task_data["audio_path"]
     
-    if task_id in transcription_status:
-        task_data = transcription_status[task_id]
-        files_to_delete = []
+    async with worker_pool.running_slot():
+        # Actualizar estado
+        await task_store.aupdate(task_id, status="processing", error=None)
+        task_events.notify(task_id)
         
-        # Agregar MIDI si existe
-        if task_data.get("midi_path") and os.path.exists(task_data["midi_path"]):
-            files_to_delete.append(task_data["midi_path"])
+        # Definir rutas de salida
+        paths = task_output_paths(task_id)
+        midi_path = paths["midi"]
+        probabilities_path = paths["probabilities"]
+        cache_key = build_cache_key(task_data["audio_digest"])
         
-        # Agregar PDF si existe
-        if task_data.get("pdf_path") and os.path.exists(task_data["pdf_path"]):
-            files_to_delete.append(task_data["pdf_path"])
+        if "inference" not in checkpoints:
+            # 1. Cargar audio, filtrar y extraer características (pool de procesos)
+            if "features" in checkpoints:
+                arrays = await asyncio.to_thread(job_queue.load_arrays, checkpoints["features"])
+                X_features, frame_times = arrays["features"], arrays["frame_times"]
+            else:
+                await set_stage(task_id, "features", 5, "Extrayendo características del audio...")
+                feature_fn = feature_function()
+                X_features, frame_times = await worker_pool.run_cpu(
+                    feature_fn, audio_path, progress_task=task_id
+                )
+                outputs = await asyncio.to_thread(
+                    job_queue.save_arrays, task_id, features=X_features, frame_times=frame_times
+                )
+                await asyncio.to_thread(job_queue.checkpoint, task_id, "features", outputs)
+            
+            # 2. Inferencia con el modelo compartido (worker de inferencia), decodificando por chunks
+            await set_stage(task_id, "inference", 35, "Ejecutando el modelo de transcripción...")
+            note_indices = await worker_pool.run_inference(
+                infer_with_shared_model, X_features, settings.INFERENCE_STRIDE, probabilities_path, task_id
+            )
+            await asyncio.to_thread(
+                job_queue.checkpoint, task_id, "inference", {"probabilities_path": probabilities_path}
+            )
+            artifact_manager.add(task_id, probabilities_path)
+        await task_store.aupdate(task_id, probabilities_path=probabilities_path)
         
-        # Eliminar archivos
-        if files_to_delete:
-            cleanup_files(files_to_delete)
-            print(f"🗑️  Archivos de tarea {task_id} eliminados: {len(files_to_delete)} archivos")
+        # 3. Escribir el MIDI (pool de procesos); vuelve como bytes
+        midi_data = None
+        if "decoding" in checkpoints and artifact_manager.exists(task_id, midi_path):
+            transcription_result = checkpoints["decoding"]["transcription_info"]
+        else:
+            # (un MIDI que solo estaba en memoria se pierde al reiniciar: se decodifica otra vez)
+            await set_stage(task_id, "decoding", 85, "Generando archivo MIDI...")
+            if "inference" in checkpoints:
+                # Reanudado: las probabilidades guardadas con los umbrales por defecto
+                transcription_result = await worker_pool.run_cpu(
+                    redecode_probabilities, probabilities_path, None, T_ONSETS, T_FRAMES,
+                    metrics_task=task_id
+                )
+            else:
+                transcription_result = await worker_pool.run_cpu(
+                    write_midi_from_notes, *note_indices, frame_times, None,
+                    metrics_task=task_id
+                )
+            midi_data = keep_midi(task_id, paths, transcription_result)
+            await asyncio.to_thread(
+                job_queue.checkpoint, task_id, "decoding", {"transcription_info": transcription_result}
+            )
+        
+        # Completar tarea: la partitura y el MusicXML se generan al pedirlos
+        await record_timing(task_id, "midi_ready_seconds", time.time() - task_data["created_at"])
+        await complete_task(task_id, transcription_result, midi_path=midi_path)
+        await set_stage(task_id, "done", 100, "Transcripción completada exitosamente")
         
-        # Eliminar entrada del diccionario de estado
-        del transcription_status[task_id]
-        print(f"✅ Tarea {task_id} limpiada completamente")
+        # Guardar en caché para futuras subidas del mismo audio
+        if cache_key:
+            try:
+                await asyncio.to_thread(
+                    result_cache.put, cache_key, midi_path, None,
+                    transcription_result, probabilities_path, midi_data
+                )
+                await task_store.aupdate(task_id, cache_key=cache_key)
+            except Exception as cache_error:
+                print(f"⚠️  No se pudo guardar en caché: {cache_error}")
 
 
-@router.get("/transcribe/status/{task_id}")
-async def get_transcription_status(task_id: str):
+def forget_task(task_id: str) -> bool:
     """
-    Obtiene el estado actual de una transcripción.
+    Elimina el estado de una tarea cuyos archivos se desalojaron. Si otro
+    proceso la adoptó (p. ej. reclamó su trabajo) no se toca y retorna False.
     """
-    if task_id not in transcription_status:
-        raise HTTPException(status_code=404, detail="Tarea no encontrada")
-    
-    task_data = transcription_status[task_id]
-    
-    return JSONResponse(content={
+    task = task_store.get(task_id)
+    if task is not None and task.get("owner") not in (None, artifact_manager.owner):
+        return False
+    task_store.delete(task_id)
+    task_events.discard(task_id)
+    local_stages.pop(task_id, None)
+    job_queue.remove(task_id)
+    return True
+
+
+artifact_manager.on_evict = forget_task
+
+
+def task_files(task_data: dict) -> list:
+    """Archivos existentes de una tarea: audio, MIDI, PDF, MusicXML y probabilidades crudas."""
+    paths = [task_data.get(field) for field in
+             ("audio_path", "midi_path", "pdf_path", "musicxml_path", "probabilities_path")]
+    return [path for path in paths if path and os.path.exists(path)]
+
+
+def purge_expired_tasks(ttl_seconds: float) -> int:
+    """
+    Elimina las tareas sin cambios en `ttl_seconds` junto con sus archivos.
+    Cubre las tareas del almacén que no están en el índice de este proceso
+    (p. ej. de otro worker); las propias vencen con artifact_manager.expire.
+    """
+    expired = task_store.purge_expired(ttl_seconds)
+    for task_data in expired:
+        cleanup_files(task_files(task_data))
+    job_queue.purge_finished(ttl_seconds)
+    return len(expired)
+
+
+def build_status_payload(task_id: str, task_data: dict) -> dict:
+    """Estado público de una tarea (el mismo para polling y para SSE)."""
+    return {
         "task_id": task_id,
         "status": task_data["status"],
+        "stage": task_data.get("stage"),
+        "step": task_data.get("step"),
         "progress": task_data["progress"],
         "message": task_data["message"],
         "error": task_data.get("error"),
         "has_midi": task_data.get("midi_path") is not None,
-        "has_pdf": task_data.get("pdf_path") is not None,
+        # El PDF y el MusicXML se generan al pedirlos: "has_" indica que se pueden descargar
+        "has_pdf": task_data["status"] == "completed" and task_data.get("pdf_status") != "failed",
+        "pdf_status": task_data.get("pdf_status"),
+        "has_musicxml": task_data["status"] == "completed" and task_data.get("musicxml_status") != "failed",
+        "musicxml_status": task_data.get("musicxml_status"),
+        "timings": task_data.get("timings"),
         "transcription_info": task_data.get("transcription_info")
-    })
+    }
 
 
-@router.get("/transcribe/download/midi/{task_id}")
-async def download_midi(task_id: str):
+@router.get("/transcribe/status/{task_id}")
+async def get_transcription_status(task_id: str):
     """
-    Descarga el archivo MIDI generado.
-    Marca el archivo para limpieza después de la descarga.
+    Obtiene el estado actual de una transcripción.
+    Se mantiene por compatibilidad; /transcribe/events/{task_id} envía los cambios sin polling.
     """
-    if task_id not in transcription_status:
+    task_data = await task_store.aget(task_id)
+    if task_data is None:
         raise HTTPException(status_code=404, detail="Tarea no encontrada")
     
-    task_data = transcription_status[task_id]
+    return JSONResponse(content=build_status_payload(task_id, task_data))
+
+
+@router.get("/transcribe/events/{task_id}")
+async def stream_transcription_events(task_id: str):
+    """
+    Server-Sent Events con el estado de una transcripción: se envía un evento
+    cada vez que cambia la etapa, el progreso o el estado del PDF. El stream
+    termina cuando la tarea se completa o falla (y no hay un PDF generándose).
+    Con un almacén compartido, los cambios hechos por otros workers se
+    detectan consultándolo cada TASK_STORE_POLL_INTERVAL segundos.
+    """
+    if await task_store.aget(task_id) is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    
+    wait_seconds = settings.TASK_STORE_POLL_INTERVAL if task_store.shared else EVENTS_KEEPALIVE_SECONDS
+    
+    async def event_stream():
+        last_payload = None
+        event_id = 0
+        last_sent = time.monotonic()
+        while True:
+            # Leer la versión antes que la tarea para no perder un aviso intermedio
+            version = task_events.version(task_id)
+            task_data = await task_store.aget(task_id)
+            if task_data is None:
+                break
+            
+            payload = build_status_payload(task_id, task_data)
+            if payload != last_payload:
+                last_payload = payload
+                event_id += 1
+                last_sent = time.monotonic()
+                yield f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
+                
+                finished = payload["status"] in ("completed", "failed")
+                rendering = "rendering" in (payload["pdf_status"], payload["musicxml_status"])
+                if finished and not rendering:
+                    break
+            elif time.monotonic() - last_sent >= EVENTS_KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            
+            await task_events.wait(task_id, version, wait_seconds)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def completed_task_or_404(task_id: str) -> dict:
+    """Estado de una tarea terminada; 404 si no existe y 400 si aún no termina."""
+    task_data = await task_store.aget(task_id)
+    if task_data is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
     
     if task_data["status"] != "completed":
         raise HTTPException(status_code=400, detail="La transcripción aún no ha finalizado")
+    return task_data
+
+
+def download_name(task_data: dict, kind: str) -> str:
+    return os.path.splitext(task_data["filename"])[0] + ARTIFACT_DOWNLOADS[kind][0]
+
+
+async def mark_downloaded(task_id: str, *kinds: str):
+    """
+    Marca artefactos como descargados. Con el MIDI y el PDF descargados la
+    tarea vence en ARTIFACT_DOWNLOADED_TTL segundos (queda margen para
+    reanudar la descarga o repetirla) en lugar del TTL completo.
+    """
+    task_data = await task_store.amutate(
+        task_id, lambda task: task.update({f"{kind}_downloaded": True for kind in kinds})
+    )
+    if task_data and task_data.get("midi_downloaded") and task_data.get("pdf_downloaded"):
+        artifact_manager.touch(task_id, settings.ARTIFACT_DOWNLOADED_TTL)
+    else:
+        artifact_manager.touch(task_id)
+
+
+@router.get("/transcribe/download/midi/{task_id}")
+async def download_midi(task_id: str, request: Request):
+    """
+    Descarga el archivo MIDI generado (desde memoria), con ETag y rangos.
+    """
+    task_data = await completed_task_or_404(task_id)
     
-    if not task_data.get("midi_path") or not os.path.exists(task_data["midi_path"]):
+    midi = await asyncio.to_thread(artifact_manager.get, task_id, task_data.get("midi_path"))
+    if midi is None:
         raise HTTPException(status_code=404, detail="Archivo MIDI no encontrado")
     
-    filename = os.path.splitext(task_data["filename"])[0] + ".mid"
+    await mark_downloaded(task_id, "midi")
+    return artifact_response(request, midi, ARTIFACT_DOWNLOADS["midi"][1], download_name(task_data, "midi"))
+
+
+@router.get("/transcribe/download/pdf/{task_id}")
+async def download_pdf_sheet(task_id: str, request: Request):
+    """
+    Descarga la partitura en PDF. Se genera en la primera petición.
+    """
+    task_data = await completed_task_or_404(task_id)
     
-    # Marcar que el MIDI fue descargado
-    task_data["midi_downloaded"] = True
+    try:
+        pdf_path = await ensure_artifact(task_id, "pdf")
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Partitura PDF no disponible: {str(e)}")
     
-    # Programar limpieza si ambos archivos fueron descargados
-    if task_data.get("midi_downloaded") and task_data.get("pdf_downloaded"):
-        asyncio.create_task(cleanup_task_files(task_id, delay=5))
+    pdf = await asyncio.to_thread(artifact_manager.get, task_id, pdf_path)
+    if pdf is None:
+        raise HTTPException(status_code=404, detail="Partitura PDF no disponible")
     
-    return FileResponse(
-        task_data["midi_path"],
-        media_type="audio/midi",
-        filename=filename
+    await mark_downloaded(task_id, "pdf")
+    return artifact_response(request, pdf, ARTIFACT_DOWNLOADS["pdf"][1], download_name(task_data, "pdf"))
+
+
+@router.get("/transcribe/download/musicxml/{task_id}")
+async def download_musicxml(task_id: str, request: Request):
+    """
+    Descarga la transcripción en MusicXML. Se genera en la primera petición.
+    """
+    task_data = await completed_task_or_404(task_id)
+    
+    try:
+        musicxml_path = await ensure_artifact(task_id, "musicxml")
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"MusicXML no disponible: {str(e)}")
+    
+    musicxml = await asyncio.to_thread(artifact_manager.get, task_id, musicxml_path)
+    if musicxml is None:
+        raise HTTPException(status_code=404, detail="MusicXML no disponible")
+    
+    artifact_manager.touch(task_id)
+    return artifact_response(
+        request, musicxml, ARTIFACT_DOWNLOADS["musicxml"][1], download_name(task_data, "musicxml")
     )
 
 
-@router.get("/transcribe/download/pdf/{task_id}")
-async def download_pdf_sheet(task_id: str):
+@router.get("/transcribe/download/bundle/{task_id}")
+async def download_bundle(task_id: str, musicxml: bool = True):
     """
-    Descarga la partitura en PDF.
-    Marca el archivo para limpieza después de la descarga.
+    Descarga en un solo ZIP el MIDI, la partitura en PDF y (con musicxml=true)
+    el MusicXML; el PDF y el MusicXML se generan si hace falta. Si alguno no
+    se puede generar, el ZIP sale sin él y se indica en X-Bundle-Missing.
     """
-    if task_id not in transcription_status:
-        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    task_data = await completed_task_or_404(task_id)
     
-    task_data = transcription_status[task_id]
+    midi = await asyncio.to_thread(artifact_manager.get, task_id, task_data.get("midi_path"))
+    if midi is None:
+        raise HTTPException(status_code=404, detail="Archivo MIDI no encontrado")
     
-    if task_data["status"] != "completed":
-        raise HTTPException(status_code=400, detail="La transcripción aún no ha finalizado")
+    kinds = LAZY_ARTIFACTS if musicxml else ("pdf",)
+    paths = await asyncio.gather(*(ensure_artifact(task_id, kind) for kind in kinds), return_exceptions=True)
+    members, missing = [(download_name(task_data, "midi"), midi)], []
+    for kind, path in zip(kinds, paths):
+        artifact = None
+        if not isinstance(path, Exception):
+            artifact = await asyncio.to_thread(artifact_manager.get, task_id, path)
+        if artifact is None:
+            missing.append(kind)
+        else:
+            members.append((download_name(task_data, kind), artifact))
     
-    if not task_data.get("pdf_path") or not os.path.exists(task_data["pdf_path"]):
-        raise HTTPException(status_code=404, detail="Partitura PDF no disponible")
+    await mark_downloaded(task_id, "midi", *(kind for kind in kinds if kind not in missing))
     
-    filename = os.path.splitext(task_data["filename"])[0] + "_partitura.pdf"
+    headers = {"Content-Disposition": content_disposition(os.path.splitext(task_data["filename"])[0] + ".zip")}
+    if missing:
+        headers["X-Bundle-Missing"] = ",".join(missing)
+    return StreamingResponse(iter_zip(members), media_type="application/zip", headers=headers)
+
+
+def load_note_table(task_id: str, task_data: dict) -> Optional[StoredArtifact]:
+    """
+    Lista de notas de la tarea. Si no está (resultado de la caché o trabajo
+    reanudado) se obtiene una vez leyendo el MIDI y se guarda.
+    """
+    notes_path = task_output_paths(task_id)["notes"]
+    notes = artifact_manager.get(task_id, notes_path)
+    if notes is not None:
+        return notes
+    midi = artifact_manager.get(task_id, task_data.get("midi_path"))
+    if midi is None:
+        return None
+    midi_data = midi.data
+    if midi_data is None:
+        with open(midi.path, "rb") as f:
+            midi_data = f.read()
+    artifact_manager.store(task_id, notes_path, NoteTable.from_midi_bytes(midi_data).by_start().to_bytes())
+    return artifact_manager.get(task_id, notes_path)
+
+
+@router.get("/transcribe/notes/{task_id}")
+async def get_transcription_notes(task_id: str, request: Request, format: str = "json"):
+    """
+    Notas transcritas, ordenadas por inicio, para dibujarlas sin descargar ni
+    interpretar el MIDI. format=json: columnas pitch, start, end y velocity
+    (segundos). format=binary: 10 bytes por nota (ver services/note_table.py),
+    con ETag y rangos como las descargas.
+    """
+    if format not in ("json", "binary"):
+        raise HTTPException(status_code=400, detail="Formato no soportado. Use 'json' o 'binary'")
     
-    # Marcar que el PDF fue descargado
-    task_data["pdf_downloaded"] = True
+    task_data = await completed_task_or_404(task_id)
+    notes = await asyncio.to_thread(load_note_table, task_id, task_data)
+    if notes is None:
+        raise HTTPException(status_code=404, detail="Archivo MIDI no encontrado")
+    artifact_manager.touch(task_id)
     
-    # Programar limpieza si ambos archivos fueron descargados
-    if task_data.get("midi_downloaded") and task_data.get("pdf_downloaded"):
-        asyncio.create_task(cleanup_task_files(task_id, delay=5))
+    if format == "binary":
+        return artifact_response(request, notes, ARTIFACT_DOWNLOADS["notes"][1], download_name(task_data, "notes"))
     
-    return FileResponse(
-        task_data["pdf_path"],
-        media_type="application/pdf",
-        filename=filename
-    )
+    data = notes.data
+    if data is None:
+        with open(notes.path, "rb") as f:
+            data = f.read()
+    table = NoteTable.from_bytes(data)
+    return JSONResponse(content={
+        "task_id": task_id, "duration_seconds": round(table.duration, 4), **table.to_dict()
+    })
 
 
-@router.get("/transcribe/cleanup-status")
-async def get_cleanup_status():
+@router.post("/transcribe/{task_id}/redecode")
+async def redecode_transcription(task_id: str, request: RedecodeRequest):
     """
-    Endpoint para monitorear el estado de los archivos temporales.
-    Útil para debugging y verificar que la limpieza funcione.
+    Vuelve a generar el MIDI (y opcionalmente el PDF) con nuevos umbrales,
+    a partir de las probabilidades guardadas, sin repetir la inferencia.
     """
-    from config import settings
-    import time
+    task_data = await task_store.aget(task_id)
+    if task_data is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
     
-    temp_dir = settings.UPLOAD_FOLDER
+    if task_data["status"] != "completed":
+        raise HTTPException(status_code=400, detail="La transcripción aún no ha finalizado")
     
-    if not os.path.exists(temp_dir):
-        return JSONResponse(content={
-            "temp_folder": temp_dir,
-            "exists": False,
-            "message": "Carpeta temporal no existe"
-        })
+    probabilities_path = task_data.get("probabilities_path")
+    if not probabilities_path or not os.path.exists(probabilities_path):
+        raise HTTPException(status_code=404, detail="Probabilidades no disponibles para esta tarea")
     
-    files_info = []
-    total_size = 0
+    paths = task_output_paths(task_id)
+    midi_path = paths["midi"]
     
-    for filename in os.listdir(temp_dir):
-        file_path = os.path.join(temp_dir, filename)
-        if os.path.isfile(file_path):
-            file_stat = os.stat(file_path)
-            file_age_hours = (time.time() - file_stat.st_mtime) / 3600
-            file_size_kb = file_stat.st_size / 1024
-            
-            files_info.append({
-                "filename": filename,
-                "size_kb": round(file_size_kb, 2),
-                "age_hours": round(file_age_hours, 2),
-                "will_be_deleted": file_age_hours > 1
-            })
-            total_size += file_size_kb
+    # La partitura y el MusicXML anteriores ya no corresponden al nuevo MIDI
+    await reset_artifacts(task_id)
+    # La entrada de caché corresponde a los umbrales por defecto
+    await task_store.aupdate(task_id, cache_key=None)
+    
+    t0 = time.perf_counter()
+    try:
+        transcription_result = await worker_pool.run_cpu(
+            redecode_probabilities, probabilities_path, None, request.t_onsets, request.t_frames,
+            metrics_task=task_id
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al re-decodificar: {str(e)}")
+    keep_midi(task_id, paths, transcription_result)
+    await task_store.aupdate(task_id, midi_path=midi_path)
+    artifact_manager.touch(task_id)
+    decode_ms = (time.perf_counter() - t0) * 1000
+    
+    pdf_error = None
+    if request.regenerate_pdf:
+        try:
+            await ensure_artifact(task_id, "pdf")
+        except Exception as e:
+            pdf_error = str(e)
+    
+    message = f"MIDI regenerado con umbrales onsets={request.t_onsets}, frames={request.t_frames}"
+    
+    def apply(task: dict):
+        task["transcription_info"] = {**transcription_result, "stages": dict(task.get("stages") or {})}
+        task["message"] = message
+        # Permitir descargar de nuevo los archivos regenerados
+        task.pop("midi_downloaded", None)
+        task.pop("pdf_downloaded", None)
+    
+    task_data = await task_store.amutate(task_id, apply) or task_data
+    task_events.notify(task_id)
     
     return JSONResponse(content={
-        "temp_folder": temp_dir,
-        "total_files": len(files_info),
-        "total_size_mb": round(total_size / 1024, 2),
-        "active_tasks": len(transcription_status),
-        "files": files_info
-    })
\ No newline at end of file
+        "task_id": task_id,
+        "message": message,
+        "decode_ms": round(decode_ms, 1),
+        "has_midi": True,
+        "has_pdf": task_data["pdf_status"] != "failed",
+        "pdf_status": task_data["pdf_status"],
+        "pdf_error": pdf_error,
+        "transcription_info": transcription_result
+    })
+
+
+@router.get("/transcribe/jobs/dead-letter")
+async def get_dead_letter_jobs(limit: int = 50):
+    """
+    Trabajos que agotaron sus reintentos (JOB_MAX_ATTEMPTS), con su último error.
+    """
+    return JSONResponse(content={
+        "jobs": job_queue.dead_letters(limit),
+        "queue": job_queue.stats()
+    })
+
+
+@router.get("/transcribe/cache/stats")
+async def get_cache_stats():
+    """
+    Estadísticas de la caché de resultados (aciertos, fallos y tamaño).
+    """
+    return JSONResponse(content=result_cache.stats())
+
+
+@router.get("/transcribe/cleanup-status")
+async def get_cleanup_status():
+    """
+    Estado de los archivos temporales, desde el índice del gestor de
+    artefactos (sin recorrer el disco): tareas, archivos, tamaño total,
+    cuota, próximo vencimiento y tareas desalojadas por TTL o por cuota.
+    """
+    return JSONResponse(content={
+        **artifact_manager.stats(),
+        "active_tasks": await task_store.acount()
+    })
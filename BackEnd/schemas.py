@@ -1,18 +1,29 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
+from services.transcription import T_ONSETS, T_FRAMES
 
 class TranscriptionStatus(BaseModel):
     """Estado de una tarea de transcripción"""
     task_id: str
-    status: str  # "processing", "completed", "error"
+    status: str  # "pending", "processing", "completed", "failed"
+    stage: Optional[str] = None  # "queued", "features", "inference", "decoding", "done"
+    step: Optional[str] = None  # paso dentro de la etapa: "load", "filter", "features", "inference"
     progress: int  # 0-100
     message: str
     midi_path: Optional[str] = None
     pdf_path: Optional[str] = None
+    pdf_status: Optional[str] = None  # "pending", "rendering", "ready", "failed"
+    timings: Optional[Dict[str, float]] = None  # midi_ready_seconds, pdf_seconds, ...
     transcription_info: Optional[Dict[str, Any]] = None
 
 class TranscriptionResponse(BaseModel):
     """Respuesta al iniciar una transcripción"""
     task_id: str
     message: str
-    status: str
\ No newline at end of file
+    status: str
+
+class RedecodeRequest(BaseModel):
+    """Nuevos umbrales para re-decodificar una transcripción ya completada"""
+    t_onsets: float = Field(T_ONSETS, gt=0.0, lt=1.0)
+    t_frames: float = Field(T_FRAMES, gt=0.0, lt=1.0)
+    regenerate_pdf: bool = False  # Si es False, el PDF se genera al descargarlo
@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+# services/artifacts.py
+#
+# Archivos de las tareas con un índice en memoria, en lugar de recorrer
+# temp_uploads en cada limpieza. Cada tarea tiene su directorio:
+#     <UPLOAD_FOLDER>/<task_id>/{audio.wav, transcripcion.mid, transcripcion_*...}
+# (nombres fijos; el nombre del archivo del cliente solo se usa en las descargas).
+# El índice guarda el tamaño de cada archivo y el vencimiento de la tarea:
+#   - Vencimiento: heap de (vence_en, task_id). `touch` extiende el vencimiento
+#     y agrega otra entrada; las entradas viejas se descartan al sacarlas.
+#   - Cuota: si el total supera ARTIFACT_MAX_BYTES se desalojan primero las
+#     tareas más antiguas (orden de creación).
+# Desalojar borra el directorio y llama a `on_evict(task_id)`, que elimina el
+# estado de la tarea; las tareas con un trabajo en curso están fijadas (`pin`)
+# y no se desalojan. El disco se recorre una sola vez, al iniciar.
+# Con varios workers cada proceso indexa solo sus tareas: al crear un
+# directorio se escribe el archivo `.propietario` con el dueño (antes de
+# recibir la subida), y al iniciar solo se adoptan las tareas cuyo dueño ya
+# no está activo. Un directorio sin tarea es huérfano si su archivo más
+# reciente (también los `.part` de una subida en curso) es antiguo y su
+# dueño no sigue vivo.
+# Los artefactos chicos (el MIDI pesa unos KB) se guardan en memoria con
+# `store` y no se escriben a disco salvo que un programa externo necesite la
+# ruta (`materialize`); los que superan `memory_max_bytes` van a disco. Los
+# archivos chicos del disco (PDF, MusicXML) se leen una vez y quedan en memoria.
+
+import asyncio
+import hashlib
+import heapq
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+AUDIO_NAME = "audio.wav"
+# Prefijo de los archivos generados de una tarea
+OUTPUT_STEM = "transcripcion"
+# Archivo con el proceso dueño de un directorio de UPLOAD_FOLDER
+OWNER_MARKER = ".propietario"
+
+
+def newest_mtime(path: str) -> float:
+    """Fecha de modificación más reciente de `path` y de los archivos que contiene."""
+    newest = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for directory, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    newest = max(newest, os.path.getmtime(os.path.join(directory, filename)))
+                except FileNotFoundError:
+                    pass
+    return newest
+
+
+class StoredArtifact:
+    """Contenido de un artefacto para servirlo: bytes en memoria (`data`) o solo la ruta en disco."""
+
+    __slots__ = ("path", "data", "size", "etag", "modified_at")
+
+    def __init__(self, path: str, data: Optional[bytes], size: int, etag: str, modified_at: float):
+        self.path = path
+        self.data = data
+        self.size = size
+        self.etag = etag
+        self.modified_at = modified_at
+
+    @classmethod
+    def from_bytes(cls, path: str, data: bytes, modified_at: Optional[float] = None) -> "StoredArtifact":
+        etag = '"' + hashlib.blake2b(data, digest_size=16).hexdigest() + '"'
+        return cls(path, data, len(data), etag, modified_at or time.time())
+
+    @classmethod
+    def from_file(cls, path: str) -> "StoredArtifact":
+        stat = os.stat(path)
+        return cls(path, None, stat.st_size, f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', stat.st_mtime)
+
+
+class TaskArtifacts:
+    """Entrada del índice: archivos de una tarea y su vencimiento."""
+
+    __slots__ = ("files", "blobs", "bytes", "expires_at")
+
+    def __init__(self, expires_at: float):
+        self.files: Dict[str, int] = {}  # ruta -> bytes (en memoria, en disco o ambos)
+        self.blobs: Dict[str, StoredArtifact] = {}  # ruta -> contenido en memoria
+        self.bytes = 0
+        self.expires_at = expires_at
+
+
+class ArtifactManager:
+    """Directorio por tarea, índice de archivos, vencimiento por TTL y cuota de disco."""
+
+    def __init__(self):
+        self.root: Optional[str] = None
+        self.ttl_seconds = 3600.0
+        self.max_bytes = 0
+        # Artefactos hasta este tamaño se guardan en memoria (0 = siempre en disco)
+        self.memory_max_bytes = 0
+        # Elimina el estado de una tarea desalojada (almacén de tareas, cola...);
+        # retorna False si la tarea ahora es de otro proceso y sus archivos no se tocan
+        self.on_evict: Optional[Callable[[str], Optional[bool]]] = None
+        # Identifica a este proceso como dueño de sus directorios (host:pid:nonce)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: "OrderedDict[str, TaskArtifacts]" = OrderedDict()  # orden de creación
+        # Tareas con un trabajo en curso; se cuentan aunque la tarea aún no esté en el índice
+        self._pins: Dict[str, int] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.total_files = 0
+        self.memory_bytes = 0
+        self.evicted_expired = 0
+        self.evicted_quota = 0
+        self._quota_scheduled = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None
+
+    def start(self, root: str, ttl_seconds: float, max_bytes: int,
+              keep: Callable[[str], bool], orphan_age: float, memory_max_bytes: int = 0,
+              adopt: Optional[Callable[[str], bool]] = None) -> int:
+        """
+        Activa el gestor y arma el índice con los directorios de tareas que
+        `keep(ruta)` reconoce como vigentes y que `adopt(task_id)` asigna a este
+        proceso (su dueño anterior ya no está activo); los vigentes de otro
+        proceso no se tocan. El resto (audios de trabajos que ya no existen,
+        subidas a medias) se elimina si su archivo más reciente tiene más de
+        `orphan_age` segundos y su dueño no sigue vivo. Retorna la cantidad de
+        huérfanos eliminados.
+        """
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self._tasks.clear()
+        self._heap = []
+        self.total_bytes = 0
+        self.total_files = 0
+        self.memory_bytes = 0
+        os.makedirs(root, exist_ok=True)
+
+        now = time.time()
+        found, orphans = [], 0
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.startswith("."):
+                continue
+            if keep(path):
+                if os.path.isdir(path) and (adopt is None or adopt(name)):
+                    found.append((os.path.getmtime(path), name, path))
+                continue
+            if not self._is_orphan(path, now, orphan_age):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+            orphans += 1
+
+        # Orden de creación aproximado: fecha de modificación del directorio
+        for _, task_id, path in sorted(found):
+            self._index_dir(task_id, path, now + ttl_seconds)
+
+        print(f"🗂️  Artefactos: {len(self._tasks)} tareas, {self.total_bytes / 1024 / 1024:.1f} MB en {root}")
+        self.enforce_quota()
+        return orphans
+
+    def _is_orphan(self, path: str, now: float, orphan_age: float) -> bool:
+        """
+        Un directorio sin tarea es huérfano si su dueño ya no está activo y no
+        cambió en `orphan_age` segundos. Si el dueño es de otro host (no se
+        puede saber si sigue vivo) se espera el TTL completo.
+        """
+        alive = self.owner_alive(self.read_owner(path)) if os.path.isdir(path) else False
+        if alive:
+            return False
+        max_age = self.ttl_seconds if alive is None else orphan_age
+        try:
+            return now - newest_mtime(path) > max_age
+        except FileNotFoundError:
+            return False
+
+    def _index_dir(self, task_id: str, path: str, expires_at: float):
+        """Agrega al índice los archivos de un directorio de tarea y lo marca como propio."""
+        entry = TaskArtifacts(expires_at)
+        for filename in os.listdir(path):
+            file_path = os.path.join(path, filename)
+            if filename != OWNER_MARKER and os.path.isfile(file_path):
+                entry.files[file_path] = os.path.getsize(file_path)
+        entry.bytes = sum(entry.files.values())
+        self.claim_dir(path)
+        with self._lock:
+            if task_id in self._tasks:
+                return
+            self._tasks[task_id] = entry
+            heapq.heappush(self._heap, (entry.expires_at, task_id))
+            self.total_bytes += entry.bytes
+            self.total_files += len(entry.files)
+
+    @staticmethod
+    def read_owner(path: str) -> Optional[str]:
+        """Dueño escrito en el directorio, o None si no tiene."""
+        try:
+            with open(os.path.join(path, OWNER_MARKER)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def owner_alive(self, owner: Optional[str]) -> Optional[bool]:
+        """
+        True/False si el dueño es un proceso de este host que sigue vivo o no;
+        None si es de otro host (no se puede comprobar).
+        """
+        if not owner:
+            return False
+        if owner == self.owner:
+            return True
+        host, _, rest = owner.partition(":")
+        if host != socket.gethostname():
+            return None
+        try:
+            pid = int(rest.partition(":")[0])
+        except ValueError:
+            return False
+        if pid == os.getpid():
+            return False  # Este pid de un arranque anterior (p. ej. reinicio del contenedor)
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def claim_dir(self, path: str):
+        """Crea el directorio (si falta) y lo marca como de este proceso."""
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, OWNER_MARKER), "w") as f:
+            f.write(self.owner)
+
+    def adopt(self, task_id: str):
+        """Agrega al índice de este proceso una tarea existente (p. ej. de un worker que murió)."""
+        with self._lock:
+            if task_id in self._tasks:
+                return
+        path = os.path.join(self.root, task_id)
+        if os.path.isdir(path):
+            self._index_dir(task_id, path, time.time() + self.ttl_seconds)
+            self._check_quota()
+
+    def task_dir(self, task_id: str) -> str:
+        """Directorio de la tarea (se crea y se indexa la primera vez)."""
+        path = os.path.join(self.root, task_id)
+        with self._lock:
+            created = task_id not in self._tasks
+            if created:
+                expires_at = time.time() + self.ttl_seconds
+                self._tasks[task_id] = TaskArtifacts(expires_at)
+                heapq.heappush(self._heap, (expires_at, task_id))
+        if created:
+            # Antes de escribir nada: el barrido de otro worker no lo toma por huérfano
+            self.claim_dir(path)
+        else:
+            os.makedirs(path, exist_ok=True)
+        return path
+
+    def add(self, task_id: str, *paths: Optional[str]):
+        """Registra (o actualiza el tamaño de) archivos de la tarea y aplica la cuota."""
+        sizes = {path: os.path.getsize(path) for path in paths if path and os.path.isfile(path)}
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                return
+            for path, size in sizes.items():
+                if path not in entry.files:
+                    self.total_files += 1
+                delta = size - entry.files.get(path, 0)
+                entry.files[path] = size
+                entry.bytes += delta
+                self.total_bytes += delta
+        self._check_quota()
+
+    def discard(self, task_id: str, *paths: Optional[str]):
+        """Elimina archivos de la tarea del disco y del índice."""
+        for path in paths:
+            if not path:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                entry = self._tasks.get(task_id)
+                if entry is None or path not in entry.files:
+                    continue
+                size = entry.files.pop(path)
+                entry.bytes -= size
+                self.total_bytes -= size
+                self.total_files -= 1
+                blob = entry.blobs.pop(path, None)
+                if blob is not None:
+                    self.memory_bytes -= blob.size
+
+    def store(self, task_id: str, path: str, data: bytes) -> str:
+        """
+        Guarda el contenido de un artefacto de la tarea bajo `path`: en memoria
+        si no supera memory_max_bytes, si no en disco. Reemplaza la versión anterior.
+        """
+        if len(data) > self.memory_max_bytes or task_id not in self._tasks:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._drop_blob(task_id, path)
+            self.add(task_id, path)
+            return path
+
+        # Una versión anterior en disco ya no corresponde
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self._keep_blob(task_id, StoredArtifact.from_bytes(path, data))
+        self._check_quota()
+        return path
+
+    def get(self, task_id: str, path: Optional[str]) -> Optional[StoredArtifact]:
+        """
+        Artefacto listo para servir: desde memoria, o desde el disco (los
+        archivos chicos se leen una vez y quedan en memoria). None si no existe.
+        """
+        if not path:
+            return None
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            blob = entry.blobs.get(path) if entry is not None else None
+        if blob is not None:
+            return blob
+        try:
+            artifact = StoredArtifact.from_file(path)
+        except FileNotFoundError:
+            return None
+        if artifact.size <= self.memory_max_bytes and entry is not None:
+            with open(path, "rb") as f:
+                data = f.read()
+            artifact = StoredArtifact(path, data, len(data), artifact.etag, artifact.modified_at)
+            self._keep_blob(task_id, artifact)
+        return artifact
+
+    def exists(self, task_id: str, path: Optional[str]) -> bool:
+        """El artefacto está en memoria o en disco."""
+        if not path:
+            return False
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is not None and path in entry.blobs:
+                return True
+        return os.path.exists(path)
+
+    def materialize(self, task_id: str, path: str) -> str:
+        """Escribe en disco un artefacto que solo está en memoria (p. ej. para MuseScore)."""
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            blob = entry.blobs.get(path) if entry is not None else None
+        if blob is not None and not os.path.exists(path):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(blob.data)
+            os.replace(tmp_path, path)
+        return path
+
+    def _keep_blob(self, task_id: str, blob: StoredArtifact):
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                return
+            previous = entry.blobs.get(blob.path)
+            if previous is not None:
+                self.memory_bytes -= previous.size
+            entry.blobs[blob.path] = blob
+            self.memory_bytes += blob.size
+            if blob.path not in entry.files:
+                self.total_files += 1
+            delta = blob.size - entry.files.get(blob.path, 0)
+            entry.files[blob.path] = blob.size
+            entry.bytes += delta
+            self.total_bytes += delta
+
+    def _drop_blob(self, task_id: str, path: str):
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            blob = entry.blobs.pop(path, None) if entry is not None else None
+            if blob is not None:
+                self.memory_bytes -= blob.size
+
+    def touch(self, task_id: str, ttl_seconds: Optional[float] = None):
+        """Vencimiento de la tarea en `ttl_seconds` desde ahora (por defecto el TTL completo)."""
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                return
+            entry.expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+            heapq.heappush(self._heap, (entry.expires_at, task_id))
+            # Cada touch deja una entrada vieja en el heap: compactarlo de vez en cuando
+            if len(self._heap) > 4 * len(self._tasks) + 64:
+                self._heap = [(e.expires_at, tid) for tid, e in self._tasks.items()]
+                heapq.heapify(self._heap)
+
+    def pin(self, task_id: str):
+        """Protege la tarea del desalojo mientras corre su trabajo."""
+        with self._lock:
+            self._pins[task_id] = self._pins.get(task_id, 0) + 1
+
+    def unpin(self, task_id: str):
+        with self._lock:
+            pins = self._pins.get(task_id, 0)
+            if not pins:
+                return
+            if pins > 1:
+                self._pins[task_id] = pins - 1
+            else:
+                del self._pins[task_id]
+            entry = self._tasks.get(task_id)
+            if entry is not None:
+                # El TTL cuenta desde que termina el trabajo
+                entry.expires_at = time.time() + self.ttl_seconds
+                heapq.heappush(self._heap, (entry.expires_at, task_id))
+
+    def evict(self, task_id: str) -> bool:
+        """
+        Elimina el directorio, la entrada del índice y el estado de la tarea.
+        Si la tarea pasó a otro proceso solo sale del índice. Retorna True si
+        se eliminaron sus archivos.
+        """
+        with self._lock:
+            entry = self._tasks.pop(task_id, None)
+            if entry is not None:
+                self.total_bytes -= entry.bytes
+                self.total_files -= len(entry.files)
+                self.memory_bytes -= sum(blob.size for blob in entry.blobs.values())
+        if self.on_evict is not None and self.on_evict(task_id) is False:
+            print(f"⚠️  La tarea {task_id} ahora es de otro worker: sale del índice sin borrar sus archivos")
+            return False
+        if self.root is not None:
+            shutil.rmtree(os.path.join(self.root, task_id), ignore_errors=True)
+        return entry is not None
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Desaloja las tareas vencidas. Solo mira el tope del heap: O(vencidas · log n)."""
+        now = now or time.time()
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, task_id = heapq.heappop(self._heap)
+                entry = self._tasks.get(task_id)
+                if entry is None or entry.expires_at != expires_at:
+                    continue  # Entrada vieja (tarea desalojada o extendida con touch)
+                if self._pins.get(task_id):
+                    entry.expires_at = now + self.ttl_seconds
+                    heapq.heappush(self._heap, (entry.expires_at, task_id))
+                    continue
+                expired.append(task_id)
+        for task_id in expired:
+            self.evict(task_id)
+        self.evicted_expired += len(expired)
+        return len(expired)
+
+    def _check_quota(self):
+        """
+        Aplica la cuota si se superó. Desde el event loop los desalojos corren
+        en un hilo: borran directorios y el estado de las tareas (SQLite).
+        """
+        if self.max_bytes <= 0 or self.total_bytes <= self.max_bytes:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.enforce_quota()
+            return
+        with self._lock:
+            if self._quota_scheduled:
+                return
+            self._quota_scheduled = True
+
+        def run():
+            try:
+                self.enforce_quota()
+            finally:
+                self._quota_scheduled = False
+
+        loop.run_in_executor(None, run)
+
+    def enforce_quota(self) -> int:
+        """Desaloja las tareas más antiguas (sin trabajo en curso) hasta respetar la cuota."""
+        if self.max_bytes <= 0:
+            return 0
+        evicted = 0
+        while True:
+            with self._lock:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                oldest = next((tid for tid in self._tasks if not self._pins.get(tid)), None)
+            if oldest is None:
+                print(f"⚠️  Artefactos sobre la cuota ({self.total_bytes / 1024 / 1024:.1f} MB) "
+                      f"y todas las tareas tienen un trabajo en curso")
+                break
+            self.evict(oldest)
+            evicted += 1
+        if evicted:
+            self.evicted_quota += evicted
+            print(f"🗑️  Cuota de artefactos: {evicted} tareas antiguas eliminadas")
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            # Tope del heap: puede ser una entrada vieja, pero nunca es posterior al próximo vencimiento
+            next_expiry = self._heap[0][0] if self._heap else None
+            return {
+                "enabled": self.enabled,
+                "root": self.root,
+                "tasks": len(self._tasks),
+                "files": self.total_files,
+                "total_mb": round(self.total_bytes / 1024 / 1024, 2),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+                "memory_mb": round(self.memory_bytes / 1024 / 1024, 2),
+                "ttl_seconds": self.ttl_seconds,
+                "next_expiry_in_seconds": round(next_expiry - time.time(), 1) if next_expiry else None,
+                "evicted_expired": self.evicted_expired,
+                "evicted_quota": self.evicted_quota,
+            }
+
+
+# Instancia compartida por todo el proceso
+artifact_manager = ArtifactManager()
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+# services/audio_processing.py
+#
+# Pre-procesamiento de audio (carga, filtro paso bajo y Mel + Delta + Delta-Delta).
+# No importa Keras/TensorFlow, de modo que puede ejecutarse en los procesos
+# del pool de workers sin cargar el runtime del modelo.
+
+import math
+import functools
+import numpy as np
+from typing import Tuple, Optional, Callable
+
+# Importamos librosa y scipy para el procesamiento de audio
+import librosa
+import scipy.signal as signal 
+import scipy.fft
+from scipy.ndimage import convolve1d
+from numpy.lib.stride_tricks import sliding_window_view
+import soundfile as sf
+import soxr
+
+from services.metrics import metrics
+from services.wav_io import WavFormatError, load_wav_mono
+
+# --- Parámetros de Audio ---
+N_MELS_FEATURE = 128  # Base para el cálculo de Mel
+SR = 22050
+HOP_LENGTH = 512
+N_FFT = 2048
+F_MIN = 25.0
+F_MAX = 6000.0
+N_FEATURES = 3 * N_MELS_FEATURE  # Mel + Delta + Delta-Delta
+
+# --- Parámetros del motor de características ---
+FEATURE_BLOCK_FRAMES = 2048  # Frames de STFT por bloque (acota el espectro complejo a ~8MB)
+DELTA_WIDTH = 9              # Ventana de librosa.feature.delta
+AMIN = 1e-10                 # Piso de potencia de librosa.power_to_db
+TOP_DB = 80.0
+
+# --- Parámetros del modo por bloques (streaming) ---
+STREAM_BLOCK_FRAMES = 2 ** 17   # Muestras (a la tasa original) leídas por bloque
+FILTER_CONTEXT = 4096           # Muestras de contexto a cada lado para el filtro de fase cero
+FILTER_MIN_BLOCK = 2 ** 16      # Muestras mínimas a filtrar por llamada (amortiza el contexto)
+
+
+# --- Funciones de Preprocesamiento ---
+
+def load_audio_mono(audio_path: str, sr: int = SR, fast_wav: bool = False) -> Tuple[np.ndarray, int]:
+    """
+    Carga un archivo de audio en mono y normaliza el peak.
+    Con `fast_wav` los WAV PCM/float se leen con el lector nativo (mapeado en
+    memoria + resample_poly); otros formatos siguen usando librosa.
+    """
+    if fast_wav:
+        try:
+            return load_wav_mono(audio_path, sr)
+        except WavFormatError as e:
+            print(f"⚠️  Lector WAV nativo no disponible ({e}), usando librosa")
+    y, sr_loaded = librosa.load(audio_path, sr=sr, mono=True)
+    peak = np.max(np.abs(y)) if y.size else 1.0
+    if peak > 0:
+        y = y / peak
+    return y.astype(np.float32), sr_loaded
+
+
+def aplicar_filtro_paso_bajo(y: np.ndarray, sr: int, corte_hz: int = 6000) -> np.ndarray:
+    """
+    Aplica un filtro paso bajo a un array de audio en memoria.
+    (Basado en 1limpiarAudio.py - Consistencia con entrenamiento)
+    """
+    b, a = butter_paso_bajo(sr, corte_hz)
+    
+    # Aplicar el filtro
+    audio_filtrado = signal.filtfilt(b, a, y)
+    return audio_filtrado.astype(np.float32)
+
+
+def butter_paso_bajo(sr: int, corte_hz: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Coeficientes del filtro Butterworth paso bajo (orden N=5)."""
+    nyquist = sr * 0.5
+    frecuencia_normalizada = corte_hz / nyquist
+    
+    return signal.butter(
+        N=5,
+        Wn=frecuencia_normalizada,
+        btype='low',
+        analog=False
+    )
+
+
+def extract_mel_spectrogram(y: np.ndarray, sr: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calcula el Mel Spectrogram logarítmico (en dB) + Delta + Delta-Delta.
+    Exactamente como en el pipeline de entrenamiento (ver MelFeatureEngine).
+    """
+    return get_feature_engine(sr).extract(y)
+
+
+def compute_frame_times(n_frames: int, sr: int = SR) -> np.ndarray:
+    """Tiempo (segundos) de inicio de cada frame del espectrograma."""
+    return librosa.frames_to_time(np.arange(n_frames), sr=sr, hop_length=HOP_LENGTH)
+
+
+def mel_power_to_features(S: np.ndarray, sr: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pasos 2-7 de extract_mel_spectrogram a partir del Mel Spectrogram de potencia
+    (n_mels, n_frames): dB, deltas, concatenación y normalización.
+    """
+    engine = get_feature_engine(sr)
+    X = engine.allocate(S.shape[1])
+    X[:, :N_MELS_FEATURE] = S.T
+    return engine.finish(X), compute_frame_times(X.shape[0], sr)
+
+
+class MelFeatureEngine:
+    """
+    Calcula las características del modelo (n_frames, 384) escribiendo
+    directamente en un único array float32 C-contiguo, sin las copias
+    intermedias de la versión con librosa (espectro completo, dB, dos deltas,
+    concatenación, transpuesta, normalización y astype):
+      1. STFT por bloques de FEATURE_BLOCK_FRAMES frames (ventana y banco Mel
+         calculados una sola vez) -> Mel de potencia en las columnas 0-127.
+      2. dB (power_to_db con ref=max y top_db=80) sobre esas mismas columnas.
+      3. Delta y Delta-Delta con los filtros de Savitzky-Golay de
+         librosa.feature.delta, escritos en las columnas 128-255 y 256-383.
+      4. Normalización (dB / 80 + 1) en el lugar.
+    Los pasos 2-4 dan exactamente lo mismo que librosa; la STFT en float32
+    difiere en el redondeo (ver benchmarks/bench_features.py).
+    """
+
+    def __init__(self, sr: int = SR):
+        self.sr = sr
+        self.window = librosa.filters.get_window("hann", N_FFT, fftbins=True).astype(np.float32)
+        self.mel_basis = librosa.filters.mel(
+            sr=sr,
+            n_fft=N_FFT,
+            n_mels=N_MELS_FEATURE,
+            fmin=F_MIN,
+            fmax=F_MAX
+        )
+        self._mel_basis_t = np.ascontiguousarray(self.mel_basis.T, dtype=np.float32)
+        # Coeficientes de savgol_filter(width=9, polyorder=orden, deriv=orden)
+        self._delta_coeffs = {
+            order: signal.savgol_coeffs(DELTA_WIDTH, order, deriv=order) for order in (1, 2)
+        }
+
+    @staticmethod
+    def allocate(n_frames: int) -> np.ndarray:
+        return np.empty((n_frames, N_FEATURES), dtype=np.float32)
+
+    def mel_power_frames(self, segment: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Mel de potencia (n_frames, n_mels) de los frames completos de `segment` (sin padding)."""
+        frames = sliding_window_view(segment, N_FFT)[::HOP_LENGTH]
+        D = scipy.fft.rfft(frames * self.window, axis=-1)
+        power = np.square(D.real)
+        power += np.square(D.imag)
+        return np.matmul(power, self._mel_basis_t, out=out)
+
+    def mel_power(self, y: np.ndarray, out: np.ndarray):
+        """
+        Mel de potencia de `y` (frames centrados, como librosa.stft(center=True))
+        escrito en `out` (n_frames, n_mels), bloque por bloque.
+        """
+        pad = N_FFT // 2
+        n_frames = len(out)
+        for a in range(0, n_frames, FEATURE_BLOCK_FRAMES):
+            b = min(a + FEATURE_BLOCK_FRAMES, n_frames)
+            # Muestras de los frames [a, b) en la señal con padding de ceros
+            start, stop = a * HOP_LENGTH - pad, (b - 1) * HOP_LENGTH + N_FFT - pad
+            if start >= 0 and stop <= len(y):
+                segment = y[start:stop]
+            else:
+                segment = np.zeros(stop - start, dtype=np.float32)
+                lo, hi = max(start, 0), min(stop, len(y))
+                segment[lo - start:hi - start] = y[lo:hi]
+            self.mel_power_frames(segment, out=out[a:b])
+
+    def finish(self, X: np.ndarray) -> np.ndarray:
+        """Completa en el lugar un array cuyas columnas 0-127 tienen el Mel de potencia."""
+        S_db = X[:, :N_MELS_FEATURE]
+        
+        # dB con ref=np.max y top_db=80, en el mismo orden de operaciones que power_to_db
+        ref_db = 10.0 * np.log10(np.maximum(AMIN, np.max(S_db)))
+        np.maximum(S_db, AMIN, out=S_db)
+        np.log10(S_db, out=S_db)
+        S_db *= 10.0
+        S_db -= ref_db
+        np.maximum(S_db, S_db.max() - TOP_DB, out=S_db)
+        
+        # Delta y Delta-Delta (savgol_filter con mode="interp")
+        for order in (1, 2):
+            self._delta(S_db, X[:, order * N_MELS_FEATURE:(order + 1) * N_MELS_FEATURE], order)
+        
+        X /= 80.0
+        X += 1.0
+        return X
+
+    def _delta(self, S_db: np.ndarray, out: np.ndarray, order: int):
+        if len(S_db) < DELTA_WIDTH:
+            raise ValueError(f"El audio es demasiado corto ({len(S_db)} frames, mínimo {DELTA_WIDTH})")
+        convolve1d(S_db, self._delta_coeffs[order], axis=0, output=out, mode="constant")
+        # En los bordes savgol_filter ajusta un polinomio a las primeras/últimas DELTA_WIDTH filas
+        half = DELTA_WIDTH // 2
+        for rows, keep in ((slice(0, DELTA_WIDTH), slice(0, half)),
+                           (slice(-DELTA_WIDTH, None), slice(-half, None))):
+            edge = signal.savgol_filter(S_db[rows], DELTA_WIDTH, order, deriv=order, axis=0, mode="interp")
+            out[keep] = edge[keep]
+
+    def extract(self, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Características normalizadas (n_frames, 384) y tiempos de frame de una señal mono."""
+        y = np.asarray(y, dtype=np.float32)
+        X = self.allocate(1 + len(y) // HOP_LENGTH)
+        self.mel_power(y, X[:, :N_MELS_FEATURE])
+        return self.finish(X), compute_frame_times(X.shape[0], self.sr)
+
+
+@functools.lru_cache(maxsize=None)
+def get_feature_engine(sr: int = SR) -> MelFeatureEngine:
+    """Motor de características por tasa de muestreo (uno por proceso)."""
+    return MelFeatureEngine(sr)
+
+
+def extract_features(
+    audio_path: str,
+    progress: Optional[Callable[[float, str], None]] = None,
+    fast_wav: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Carga el audio, aplica el filtro paso bajo y extrae las características
+    normalizadas (n_frames, 384) junto con los tiempos de cada frame.
+    `progress(fracción, paso)` informa el avance ("load", "filter", "features").
+    `fast_wav` usa el lector WAV nativo (ver load_audio_mono).
+    """
+    # 1. Cargar Audio
+    if progress:
+        progress(0.0, "load")
+    with metrics.stage("load_audio"):
+        y_mono, sr_loaded = load_audio_mono(audio_path, sr=SR, fast_wav=fast_wav)
+    
+    # 2. Aplicar filtro paso bajo (para consistencia con entrenamiento)
+    if progress:
+        progress(0.4, "filter")
+    with metrics.stage("lowpass_filter"):
+        y_filtrado = aplicar_filtro_paso_bajo(y_mono, sr_loaded, corte_hz=F_MAX)
+    del y_mono
+    
+    # 3. Extraer Características (Mel + Delta + Delta-Delta + NORMALIZADAS)
+    if progress:
+        progress(0.6, "features")
+    with metrics.stage("mel_features"):
+        return extract_mel_spectrogram(y_filtrado, sr_loaded)
+
+
+
+# --- Extracción por bloques (streaming) ---
+
+class StreamingFeatureExtractor:
+    """
+    Extrae las mismas características que `extract_features` recibiendo el
+    audio por bloques, sin tener nunca la forma de onda completa en memoria.
+    
+    Cada bloque (mono, a la tasa original) pasa por:
+      1. Remuestreo con estado (soxr, misma calidad que librosa.load).
+      2. Filtro paso bajo de fase cero: filtfilt sobre el bloque más
+         FILTER_CONTEXT muestras de contexto a cada lado.
+      3. STFT + Mel de los frames completos disponibles (con el mismo padding
+         de ceros de N_FFT // 2 que center=True en los extremos).
+    
+    La normalización de peak se aplica al final sobre la potencia Mel (es un
+    factor de escala), y el paso a dB necesita el máximo global, por lo que
+    las características se generan en `finish()`. Solo se acumula el Mel de
+    potencia: 128 valores por frame.
+    """
+
+    def __init__(self, native_sr: int, sr: int = SR, corte_hz: float = F_MAX):
+        self.native_sr = native_sr
+        self.sr = sr
+        self._resampler = None
+        if native_sr != sr:
+            self._resampler = soxr.ResampleStream(native_sr, sr, 1, dtype='float32', quality='HQ')
+        self._b, self._a = butter_paso_bajo(sr, corte_hz)
+        self._engine = get_feature_engine(sr)
+        
+        self._filter_history = np.zeros(0, dtype=np.float32)
+        self._filter_pending = np.zeros(0, dtype=np.float32)
+        self._stft_buffer = np.zeros(N_FFT // 2, dtype=np.float32)
+        self._mel_blocks = []
+        
+        self.peak = 0.0
+        self.input_samples = 0
+        self.resampled_samples = 0
+
+    def feed(self, block: np.ndarray):
+        """Procesa un bloque de audio mono (float32, tasa original)."""
+        block = np.asarray(block, dtype=np.float32)
+        self.input_samples += len(block)
+        self._push_resampled(self._resample(block, last=False))
+
+    def finish(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Procesa el audio restante y retorna (características, tiempos de frame)."""
+        # Vaciar el remuestreador y ajustar la longitud como librosa.resample(fix=True)
+        tail = self._resample(np.zeros(0, dtype=np.float32), last=True)
+        expected = math.ceil(self.input_samples * self.sr / self.native_sr)
+        missing = expected - self.resampled_samples - len(tail)
+        if missing > 0:
+            tail = np.concatenate([tail, np.zeros(missing, dtype=np.float32)])
+        elif missing < 0:
+            tail = tail[:max(0, len(tail) + missing)]
+        self._push_resampled(tail)
+        
+        # Vaciar el filtro (el final real del audio ya no necesita contexto)
+        self._filter(flush=True)
+        
+        # Padding final de la STFT (center=True) y últimos frames
+        self._push_filtered(np.zeros(N_FFT // 2, dtype=np.float32))
+        
+        # Los bloques de Mel se copian directo a las columnas 0-127 del resultado
+        X = self._engine.allocate(sum(len(block) for block in self._mel_blocks))
+        S = X[:, :N_MELS_FEATURE]
+        offset = 0
+        while self._mel_blocks:
+            block = self._mel_blocks.pop(0)
+            S[offset:offset + len(block)] = block
+            offset += len(block)
+        
+        # Normalización de peak (load_audio_mono) aplicada a la potencia
+        if self.peak > 0:
+            S /= np.float32(self.peak) ** 2
+        
+        return self._engine.finish(X), compute_frame_times(X.shape[0], self.sr)
+
+    def _resample(self, block: np.ndarray, last: bool) -> np.ndarray:
+        if self._resampler is None:
+            return block
+        return self._resampler.resample_chunk(block, last=last)
+
+    def _push_resampled(self, y: np.ndarray):
+        if len(y) == 0:
+            return
+        self.resampled_samples += len(y)
+        self.peak = max(self.peak, float(np.max(np.abs(y))))
+        self._filter_pending = np.concatenate([self._filter_pending, y])
+        self._filter(flush=False)
+
+    def _filter(self, flush: bool):
+        """Filtra las muestras pendientes que ya tienen contexto suficiente a la derecha."""
+        pending = self._filter_pending
+        if flush:
+            out_len = len(pending)
+        else:
+            if len(pending) < FILTER_CONTEXT + FILTER_MIN_BLOCK:
+                return
+            out_len = len(pending) - FILTER_CONTEXT
+        if out_len == 0:
+            return
+        
+        history = self._filter_history
+        segment = np.concatenate([history, pending])
+        filtered = signal.filtfilt(self._b, self._a, segment)
+        
+        self._filter_history = segment[:len(history) + out_len][-FILTER_CONTEXT:]
+        self._filter_pending = pending[out_len:]
+        self._push_filtered(filtered[len(history):len(history) + out_len].astype(np.float32))
+
+    def _push_filtered(self, y: np.ndarray):
+        """Calcula el Mel de potencia de todos los frames completos del buffer."""
+        buffer = np.concatenate([self._stft_buffer, y])
+        if len(buffer) < N_FFT:
+            self._stft_buffer = buffer
+            return
+        
+        n_frames = 1 + (len(buffer) - N_FFT) // HOP_LENGTH
+        self._mel_blocks.append(self._engine.mel_power_frames(buffer[:(n_frames - 1) * HOP_LENGTH + N_FFT]))
+        self._stft_buffer = buffer[n_frames * HOP_LENGTH:]
+
+
+def extract_features_streaming(
+    audio_path: str,
+    block_frames: int = STREAM_BLOCK_FRAMES,
+    progress: Optional[Callable[[float, str], None]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Equivalente a `extract_features` leyendo el WAV por bloques. La memoria
+    usada por la forma de onda no depende de la duración del archivo.
+    `progress(fracción, paso)` se llama después de cada bloque leído.
+    """
+    try:
+        audio_file = sf.SoundFile(audio_path)
+    except sf.SoundFileRuntimeError as e:
+        # Formato no soportado por soundfile: usar la ruta completa (audioread)
+        print(f"⚠️  Lectura por bloques no disponible ({e}), usando carga completa")
+        return extract_features(audio_path, progress=progress)
+    
+    with audio_file, metrics.stage("features_streaming"):
+        extractor = StreamingFeatureExtractor(audio_file.samplerate)
+        total = max(1, audio_file.frames)
+        read = 0
+        for block in audio_file.blocks(blocksize=block_frames, dtype='float32', always_2d=True):
+            # Mezcla a mono igual que librosa.to_mono (promedio de canales)
+            extractor.feed(block.mean(axis=1))
+            read += len(block)
+            if progress:
+                # Carga, filtro y Mel avanzan juntos; el cierre (dB y deltas) es el 10% final
+                progress(0.9 * read / total, "features")
+    
+    # dB, deltas y normalización sobre el Mel acumulado
+    with metrics.stage("features_finish"):
+        return extractor.finish()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# services/engraving.py
+#
+# Grabado de partituras en el mismo proceso, sin MuseScore ni Lilypond.
+# Lee las notas del MIDI con pretty_midi, las cuantiza a semicorcheas según el
+# tempo del archivo, las reparte en el pentagrama de sol (>= Do central) y el
+# de fa (PianoStaff), y dibuja el PDF directamente con fpdf2.
+#
+# Es una notación simplificada (compás de 4/4, sin silencios ni ligaduras: las
+# notas que cruzan la barra de compás se recortan), pensada como respaldo
+# rápido cuando MuseScore no está disponible o tarda demasiado.
+
+import numpy as np
+import pretty_midi as pm
+from fpdf import FPDF
+
+# --- Cuantización ---
+SLOTS_PER_MEASURE = 16      # semicorcheas por compás (4/4)
+# Duraciones dibujables en semicorcheas: redonda, blanca con puntillo, blanca,
+# negra con puntillo, negra, corchea con puntillo, corchea, semicorchea
+DRAWABLE_VALUES = (16, 12, 8, 6, 4, 3, 2, 1)
+MIDDLE_C = 60
+
+# Posición diatónica (letra) y alteración de cada clase de altura (con sostenidos)
+PITCH_CLASS_LETTER = np.array([0, 0, 1, 1, 2, 3, 3, 4, 4, 5, 5, 6])
+PITCH_CLASS_SHARP = np.array([0, 1, 0, 1, 0, 0, 1, 0, 1, 0, 1, 0], dtype=bool)
+
+# Paso diatónico de la línea inferior de cada pentagrama (Mi4 y Sol2)
+TREBLE_BOTTOM_STEP = 4 * 7 + 2
+BASS_BOTTOM_STEP = 2 * 7 + 4
+
+# --- Diseño de página (mm) ---
+PAGE_MARGIN = 15
+TITLE_HEIGHT = 22
+STAFF_SPACE = 2.0                   # distancia entre líneas
+STAFF_HEIGHT = 4 * STAFF_SPACE
+GRAND_STAFF_GAP = 12                # entre el pentagrama de sol y el de fa
+SYSTEM_HEIGHT = 2 * STAFF_HEIGHT + GRAND_STAFF_GAP
+SYSTEM_GAP = 14
+MEASURES_PER_SYSTEM = 4
+HEADER_WIDTH = 14                   # clave y compás al inicio de cada sistema
+MEASURE_PADDING = 2.5
+NOTEHEAD_WIDTH = 2.2
+NOTEHEAD_HEIGHT = 1.8
+STEM_LENGTH = 7.0
+
+
+def _latin1(text: str) -> str:
+    """Las fuentes base de PDF solo admiten latin-1."""
+    return text.encode("latin-1", "replace").decode("latin-1")
+
+
+def quantize_notes(midi: pm.PrettyMIDI):
+    """
+    Cuantiza las notas a una rejilla de semicorcheas.
+    Retorna arrays (measure, slot, value, pitch) ordenados por tiempo, donde
+    `value` es la duración dibujable en semicorcheas.
+    """
+    notes = [
+        note
+        for inst in midi.instruments if not inst.is_drum
+        for note in inst.notes
+    ]
+    if not notes:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty
+
+    _, tempi = midi.get_tempo_changes()
+    bpm = float(tempi[0]) if len(tempi) else 120.0
+    sixteenth = 60.0 / bpm / 4
+
+    starts = np.array([n.start for n in notes])
+    ends = np.array([n.end for n in notes])
+    pitches = np.array([n.pitch for n in notes], dtype=np.int64)
+
+    start_slot = np.rint(starts / sixteenth).astype(np.int64)
+    length = np.maximum(1, np.rint((ends - starts) / sixteenth).astype(np.int64))
+
+    measure = start_slot // SLOTS_PER_MEASURE
+    slot = start_slot % SLOTS_PER_MEASURE
+    # Recortar en la barra de compás y redondear hacia abajo a un valor dibujable
+    length = np.minimum(length, SLOTS_PER_MEASURE - slot)
+    drawable = np.array(DRAWABLE_VALUES)
+    value = drawable[np.argmax(drawable[None, :] <= length[:, None], axis=1)]
+
+    order = np.lexsort((pitches, slot, measure))
+    return measure[order], slot[order], value[order], pitches[order]
+
+
+def pitch_steps(pitches: np.ndarray):
+    """Paso diatónico (Do0 = 0) y si la nota lleva sostenido."""
+    octave = pitches // 12 - 1
+    pitch_class = pitches % 12
+    return octave * 7 + PITCH_CLASS_LETTER[pitch_class], PITCH_CLASS_SHARP[pitch_class]
+
+
+class ScoreRenderer:
+    """Dibuja un gran pentagrama por sistema, con MEASURES_PER_SYSTEM compases."""
+
+    def __init__(self, title: str, composer: str):
+        self.pdf = FPDF(orientation="P", unit="mm", format="A4")
+        self.pdf.set_auto_page_break(False)
+        self.pdf.set_line_width(0.15)
+        self.title = _latin1(title)
+        self.composer = _latin1(composer)
+        self.usable_width = self.pdf.w - 2 * PAGE_MARGIN
+        self.measure_width = (self.usable_width - HEADER_WIDTH) / MEASURES_PER_SYSTEM
+        self.slot_width = (self.measure_width - 2 * MEASURE_PADDING) / SLOTS_PER_MEASURE
+        self.y = 0.0
+
+    # --- Páginas y sistemas ---
+
+    def _new_page(self, first: bool):
+        self.pdf.add_page()
+        self.y = PAGE_MARGIN
+        if first:
+            self.pdf.set_font("Helvetica", "B", 16)
+            self.pdf.text(PAGE_MARGIN, self.y + 6, self.title)
+            self.pdf.set_font("Helvetica", "", 10)
+            width = self.pdf.get_string_width(self.composer)
+            self.pdf.text(self.pdf.w - PAGE_MARGIN - width, self.y + 13, self.composer)
+            self.y += TITLE_HEIGHT
+
+    def _staff_lines(self, top: float):
+        x0, x1 = PAGE_MARGIN, PAGE_MARGIN + self.usable_width
+        for i in range(5):
+            self.pdf.line(x0, top + i * STAFF_SPACE, x1, top + i * STAFF_SPACE)
+
+    def _system(self, first_measure: int, n_measures: int, with_time_signature: bool):
+        """Dibuja pentagramas, claves, barras y número de compás; retorna (treble_top, bass_top)."""
+        if self.y + SYSTEM_HEIGHT > self.pdf.h - PAGE_MARGIN:
+            self._new_page(first=False)
+
+        treble_top = self.y
+        bass_top = treble_top + STAFF_HEIGHT + GRAND_STAFF_GAP
+        bottom = bass_top + STAFF_HEIGHT
+        self._staff_lines(treble_top)
+        self._staff_lines(bass_top)
+
+        # Línea inicial del sistema, claves y compás
+        self.pdf.line(PAGE_MARGIN, treble_top, PAGE_MARGIN, bottom)
+        self.pdf.set_font("Helvetica", "B", 15)
+        self.pdf.text(PAGE_MARGIN + 1.5, treble_top + 6.8, "G")
+        self.pdf.text(PAGE_MARGIN + 1.5, bass_top + 5.2, "F")
+        if with_time_signature:
+            self.pdf.set_font("Helvetica", "B", 11)
+            for top in (treble_top, bass_top):
+                self.pdf.text(PAGE_MARGIN + 8, top + 3.7, "4")
+                self.pdf.text(PAGE_MARGIN + 8, top + 7.7, "4")
+
+        self.pdf.set_font("Helvetica", "", 7)
+        self.pdf.text(PAGE_MARGIN, treble_top - 2, str(first_measure + 1))
+
+        # Barras de compás
+        for i in range(1, n_measures + 1):
+            x = PAGE_MARGIN + HEADER_WIDTH + i * self.measure_width
+            self.pdf.line(x, treble_top, x, bottom)
+
+        self.y = bottom + SYSTEM_GAP
+        return treble_top, bass_top
+
+    # --- Notas ---
+
+    def _chord(self, x: float, staff_top: float, bottom_step: int, steps: np.ndarray,
+               sharps: np.ndarray, value: int):
+        """Dibuja un acorde (o nota) con plica, corchetes, puntillo y líneas adicionales."""
+        staff_bottom = staff_top + STAFF_HEIGHT
+        half = STAFF_SPACE / 2
+        ys = staff_bottom - (steps - bottom_step) * half
+        filled = value < 8
+        dotted = value in (12, 6, 3)
+
+        for step, y, sharp in zip(steps, ys, sharps):
+            # Líneas adicionales (pasos pares por fuera del pentagrama)
+            if step < bottom_step:
+                for ledger in range(bottom_step - 2, step - 1, -2):
+                    ly = staff_bottom - (ledger - bottom_step) * half
+                    self.pdf.line(x - 1.8, ly, x + 1.8, ly)
+            elif step > bottom_step + 8:
+                for ledger in range(bottom_step + 10, step + 1, 2):
+                    ly = staff_bottom - (ledger - bottom_step) * half
+                    self.pdf.line(x - 1.8, ly, x + 1.8, ly)
+
+            self.pdf.ellipse(
+                x - NOTEHEAD_WIDTH / 2, y - NOTEHEAD_HEIGHT / 2,
+                NOTEHEAD_WIDTH, NOTEHEAD_HEIGHT,
+                style="F" if filled else "D"
+            )
+            if sharp:
+                self.pdf.set_font("Helvetica", "", 7)
+                self.pdf.text(x - 3.0, y + 1.0, "#")
+            if dotted:
+                dot_y = y - half / 2 if (step - bottom_step) % 2 == 0 else y
+                self.pdf.ellipse(x + 1.7, dot_y - 0.3, 0.6, 0.6, style="F")
+
+        if value == 16:
+            return
+
+        # Plica: hacia arriba si el acorde está en la mitad inferior del pentagrama
+        stem_up = steps.mean() < bottom_step + 4
+        if stem_up:
+            sx = x + NOTEHEAD_WIDTH / 2 - 0.05
+            y_from, tip = ys.max(), ys.min() - STEM_LENGTH
+        else:
+            sx = x - NOTEHEAD_WIDTH / 2 + 0.05
+            y_from, tip = ys.min(), ys.max() + STEM_LENGTH
+        self.pdf.line(sx, y_from, sx, tip)
+
+        # Corchetes: uno para corcheas, dos para semicorcheas
+        n_flags = 2 if value == 1 else 1 if value in (2, 3) else 0
+        direction = 1 if stem_up else -1
+        for i in range(n_flags):
+            fy = tip + direction * i * 1.2
+            self.pdf.line(sx, fy, sx + 1.5, fy + direction * 2.5)
+
+    def render(self, measure, slot, value, pitches) -> FPDF:
+        steps, sharps = pitch_steps(pitches)
+        treble = pitches >= MIDDLE_C
+        n_measures = int(measure.max()) + 1 if len(measure) else 1
+
+        # Límites de cada compás en los arrays ordenados
+        bounds = np.searchsorted(measure, np.arange(n_measures + 1))
+
+        self._new_page(first=True)
+        for first in range(0, n_measures, MEASURES_PER_SYSTEM):
+            count = min(MEASURES_PER_SYSTEM, n_measures - first)
+            treble_top, bass_top = self._system(first, count, with_time_signature=first == 0)
+
+            lo, hi = bounds[first], bounds[first + count]
+            if lo == hi:
+                continue
+            m, s, v = measure[lo:hi], slot[lo:hi], value[lo:hi]
+            st, sh, tr = steps[lo:hi], sharps[lo:hi], treble[lo:hi]
+
+            # Un acorde = mismas notas de un pentagrama con igual posición y duración
+            keys = ((m * SLOTS_PER_MEASURE + s) * 2 + tr) * 32 + v
+            order = np.argsort(keys, kind="stable")
+            m, s, v, st, sh, tr, keys = (arr[order] for arr in (m, s, v, st, sh, tr, keys))
+            chord_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            chord_ends = np.r_[chord_starts[1:], len(keys)]
+
+            for a, b in zip(chord_starts, chord_ends):
+                x = (PAGE_MARGIN + HEADER_WIDTH + (m[a] - first) * self.measure_width
+                     + MEASURE_PADDING + (s[a] + 0.5) * self.slot_width)
+                if tr[a]:
+                    self._chord(x, treble_top, TREBLE_BOTTOM_STEP, st[a:b], sh[a:b], int(v[a]))
+                else:
+                    self._chord(x, bass_top, BASS_BOTTOM_STEP, st[a:b], sh[a:b], int(v[a]))
+
+        return self.pdf
+
+
+def engrave_pdf(
+    midi_path: str,
+    output_pdf_path: str,
+    title: str = "Transcripción de Piano",
+    composer: str = "Generado por IA"
+) -> str:
+    """
+    Genera la partitura PDF de un MIDI sin lanzar procesos externos.
+
+    Args:
+        midi_path: Ruta al archivo MIDI
+        output_pdf_path: Ruta donde guardar el PDF
+        title: Título de la partitura
+        composer: Compositor/autor
+
+    Returns:
+        Ruta al archivo PDF generado
+    """
+    midi = pm.PrettyMIDI(midi_path)
+    measure, slot, value, pitches = quantize_notes(midi)
+    pdf = ScoreRenderer(title, composer).render(measure, slot, value, pitches)
+    pdf.output(output_pdf_path)
+    return output_pdf_path
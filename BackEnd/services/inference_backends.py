@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+# services/inference_backends.py
+#
+# Backends de inferencia para el modelo CNN-LSTM.
+# `model.predict` sobre un dataset de tf.data arrastra bastante costo fijo por
+# llamada (y maquinaria de entrenamiento que aquí no se usa). Los backends
+# exponen una sola operación, `predict_on_batch(X) -> (P_onsets, P_frames)`,
+# y el resto del pipeline (predict_probabilities, la inferencia empaquetada y
+# el servidor de inferencia) los usa igual que a un keras.Model:
+#   - "keras":       el modelo de Keras tal cual (comportamiento original).
+#   - "tf_function": la llamada del modelo compilada con tf.function (sin tf.data).
+#   - "savedmodel":  SavedModel exportado; se carga sin deserializar Keras.
+#   - "onnx":        ONNX Runtime (requiere onnxruntime; la exportación, tf2onnx).
+#   - "tflite":      TFLite con batch fijo (el LSTM se convierte a operaciones nativas).
+#   - "tflite_int8": TFLite con cuantización INT8 de rango dinámico de los pesos.
+# Los formatos exportados se generan a partir del .keras (ver export_model.py)
+# y se regeneran solos si el .keras es más nuevo que la exportación. Con
+# varios workers sobre la misma carpeta, uno exporta (con un lock de archivo)
+# y los demás esperan y cargan su resultado.
+
+import os
+import shutil
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos
+    fcntl = None
+
+import numpy as np
+import keras
+
+from services.transcription import SEQ_LEN, N_MELS_MODELO, N_KEYS
+
+BACKENDS = ("keras", "tf_function", "savedmodel", "onnx", "tflite", "tflite_int8")
+# Formatos que se leen de un archivo exportado (y su extensión)
+EXPORT_SUFFIXES = {
+    "savedmodel": ".savedmodel",
+    "onnx": ".onnx",
+    "tflite": ".tflite",
+    "tflite_int8": ".int8.tflite",
+}
+# Batch fijo de TFLite: con formas estáticas el LSTM no necesita operaciones de TF (Flex)
+TFLITE_BATCH_SIZE = 64
+# Lock de la carpeta de exportación (compartida entre workers)
+EXPORT_LOCK_NAME = ".exportar.lock"
+
+
+class InferenceBackend(ABC):
+    """Interfaz común: un batch de ventanas (n, SEQ_LEN, 384) -> (P_onsets, P_frames)."""
+
+    name = "base"
+
+    @abstractmethod
+    def predict_on_batch(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        ...
+
+
+class TFFunctionBackend(InferenceBackend):
+    """Llamada directa del modelo compilada como grafo (batch variable, una sola traza)."""
+
+    name = "tf_function"
+
+    def __init__(self, model: keras.Model):
+        import tensorflow as tf
+
+        self._tf = tf
+        self._model = model
+        self._fn = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec([None, SEQ_LEN, N_MELS_MODELO], tf.float32)]
+        )
+
+    def predict_on_batch(self, X):
+        P_onsets, P_frames = self._fn(self._tf.convert_to_tensor(X, dtype=self._tf.float32))
+        return P_onsets.numpy(), P_frames.numpy()
+
+
+class SavedModelBackend(InferenceBackend):
+    """Endpoint `serve` de un SavedModel exportado con model.export."""
+
+    name = "savedmodel"
+
+    def __init__(self, path: str):
+        import tensorflow as tf
+
+        self._tf = tf
+        # Conservar el objeto cargado: sus variables se liberan junto con él
+        self._loaded = tf.saved_model.load(path)
+        self._serve = self._loaded.serve
+
+    def predict_on_batch(self, X):
+        P_onsets, P_frames = self._serve(self._tf.convert_to_tensor(X, dtype=self._tf.float32))
+        return P_onsets.numpy(), P_frames.numpy()
+
+
+class OnnxBackend(InferenceBackend):
+    """Sesión de ONNX Runtime (las sesiones admiten llamadas concurrentes)."""
+
+    name = "onnx"
+
+    def __init__(self, path: str, threads: int = 0):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("INFERENCE_BACKEND=onnx requiere el paquete onnxruntime")
+
+        options = onnxruntime.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self._session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self._input = self._session.get_inputs()[0].name
+
+    def predict_on_batch(self, X):
+        P_onsets, P_frames = self._session.run(None, {self._input: np.asarray(X, dtype=np.float32)})
+        return P_onsets, P_frames
+
+
+class TFLiteBackend(InferenceBackend):
+    """
+    Intérprete de TFLite con batch fijo de TFLITE_BATCH_SIZE: los batches se
+    parten (y el último se rellena con ceros). El intérprete no admite
+    llamadas concurrentes, así que se protege con un lock.
+    """
+
+    name = "tflite"
+
+    def __init__(self, path: str, threads: int = 0, name: str = "tflite"):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.name = name
+        self._interpreter = Interpreter(model_path=path, num_threads=threads or None)
+        self._interpreter.allocate_tensors()
+        signature = self._interpreter.get_signature_list()["serving_default"]
+        self._input = signature["inputs"][0]
+        # model.export nombra las salidas en orden: output_0 (onsets), output_1 (frames)
+        self._outputs = sorted(signature["outputs"])
+        self._runner = self._interpreter.get_signature_runner()
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        n = len(X)
+        P_onsets = np.empty((n, SEQ_LEN, N_KEYS), dtype=np.float32)
+        P_frames = np.empty((n, SEQ_LEN, N_KEYS), dtype=np.float32)
+        with self._lock:
+            for start in range(0, n, TFLITE_BATCH_SIZE):
+                block = X[start:start + TFLITE_BATCH_SIZE]
+                k = len(block)
+                if k < TFLITE_BATCH_SIZE:
+                    block = np.concatenate([block, np.zeros((TFLITE_BATCH_SIZE - k,) + block.shape[1:], np.float32)])
+                outputs = self._runner(**{self._input: block})
+                P_onsets[start:start + k] = outputs[self._outputs[0]][:k]
+                P_frames[start:start + k] = outputs[self._outputs[1]][:k]
+        return P_onsets, P_frames
+
+
+# --- Exportación ---
+
+def export_path(model_path: str, export_folder: str, kind: str) -> str:
+    """Ruta del archivo exportado de `kind` para un .keras (p. ej. modelos/exportados/modelo.onnx)."""
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(export_folder, stem + EXPORT_SUFFIXES[kind])
+
+
+def is_export_stale(model_path: str, path: str) -> bool:
+    """True si la exportación no existe o es más vieja que el .keras."""
+    return not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(model_path)
+
+
+def export_model(
+    model_path: str,
+    export_folder: str,
+    kinds: Iterable[str],
+    model: Optional[keras.Model] = None
+) -> Dict[str, str]:
+    """
+    Convierte el .keras a los formatos indicados y retorna {formato: ruta}.
+    Cada formato se escribe con un nombre temporal propio de este proceso y se
+    renombra al terminar, para que un proceso que lo esté cargando nunca vea
+    una exportación a medias.
+    """
+    os.makedirs(export_folder, exist_ok=True)
+    if model is None:
+        model = keras.models.load_model(model_path)
+    # La exportación a ONNX exige que el modelo se haya llamado al menos una vez
+    model.predict_on_batch(np.zeros((1, SEQ_LEN, N_MELS_MODELO), dtype=np.float32))
+
+    paths = {}
+    for kind in kinds:
+        if kind not in EXPORT_SUFFIXES:
+            raise ValueError(f"Formato de exportación desconocido: {kind}")
+        path = export_path(model_path, export_folder, kind)
+        tmp_path = os.path.join(
+            export_folder, f"tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}-{os.path.basename(path)}"
+        )
+
+        try:
+            if kind == "savedmodel":
+                model.export(tmp_path, format="tf_saved_model", verbose=False)
+            elif kind == "onnx":
+                model.export(tmp_path, format="onnx", verbose=False)
+            else:
+                _export_tflite(model, tmp_path, quantize=(kind == "tflite_int8"))
+
+            _remove(path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        paths[kind] = path
+        print(f"📦 Modelo exportado ({kind}): {path}")
+    return paths
+
+
+@contextmanager
+def export_lock(export_folder: str) -> Iterator[None]:
+    """Lock exclusivo entre procesos sobre la carpeta de exportación."""
+    os.makedirs(export_folder, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(export_folder, EXPORT_LOCK_NAME), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _export_tflite(model: keras.Model, path: str, quantize: bool = False):
+    """SavedModel temporal con batch fijo -> TFLite (opcionalmente INT8 de rango dinámico)."""
+    import tensorflow as tf
+
+    saved_model_dir = path + ".savedmodel"
+    try:
+        model.export(
+            saved_model_dir, format="tf_saved_model", verbose=False,
+            input_signature=[keras.InputSpec(shape=(TFLITE_BATCH_SIZE, SEQ_LEN, N_MELS_MODELO), dtype="float32")]
+        )
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        if quantize:
+            # Pesos en INT8, activaciones en float: no necesita datos de calibración
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        with open(path, "wb") as f:
+            f.write(converter.convert())
+    finally:
+        shutil.rmtree(saved_model_dir, ignore_errors=True)
+
+
+# --- Carga ---
+
+def load_backend(
+    kind: str,
+    model_path: str,
+    export_folder: str,
+    threads: int = 0
+) -> Union[keras.Model, InferenceBackend]:
+    """
+    Carga el modelo con el backend indicado. Los formatos exportados se
+    generan (o regeneran) a partir del .keras si hace falta.
+    """
+    if kind not in BACKENDS:
+        raise ValueError(f"INFERENCE_BACKEND desconocido: {kind} (opciones: {', '.join(BACKENDS)})")
+
+    if kind == "keras":
+        return keras.models.load_model(model_path)
+    if kind == "tf_function":
+        return TFFunctionBackend(keras.models.load_model(model_path))
+
+    path = export_path(model_path, export_folder, kind)
+    if is_export_stale(model_path, path):
+        # Otro worker pudo exportarlo mientras se esperaba el lock
+        with export_lock(export_folder):
+            if is_export_stale(model_path, path):
+                export_model(model_path, export_folder, [kind])
+
+    if kind == "savedmodel":
+        return SavedModelBackend(path)
+    if kind == "onnx":
+        return OnnxBackend(path, threads)
+    return TFLiteBackend(path, threads, name=kind)
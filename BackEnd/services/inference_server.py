@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# services/inference_server.py
+#
+# Servidor de inferencia con micro-batching dinámico dentro del proceso.
+# Antes cada transcripción ejecutaba su propio model.predict (batches de 64
+# ventanas), una tras otra en el worker de inferencia. Ahora las tareas
+# envían bloques de ventanas a una cola común y un único hilo dueño del
+# modelo forma micro-batches:
+#   - Toma bloques de todas las tareas activas por turnos (round-robin), para
+#     que una tarea larga no retrase a las demás.
+#   - Ejecuta el batch en cuanto junta `max_batch` ventanas, o cuando pasan
+#     `max_wait` segundos sin que lleguen más.
+#   - Reparte las predicciones a cada tarea a través de su Future.
+# El tamaño del batch se redondea a múltiplos de `bucket` (con ceros) para
+# que el modelo solo vea unas pocas formas distintas.
+
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, List, Optional
+
+import numpy as np
+
+# Mediciones recientes usadas para las métricas
+STATS_WINDOW = 500
+
+
+class InferenceRequest:
+    """Un bloque de ventanas (n, SEQ_LEN, n_mels) de una tarea."""
+
+    __slots__ = ("client_id", "windows", "future", "enqueued_at")
+
+    def __init__(self, client_id: str, windows: np.ndarray):
+        self.client_id = client_id
+        self.windows = windows
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceServer:
+    """Cola de bloques de ventanas atendida por un hilo que agrupa y ejecuta el modelo."""
+
+    def __init__(self):
+        self.max_batch = 256
+        self.max_wait = 0.005
+        self.bucket = 64
+        self._model_getter: Optional[Callable] = None
+        self._queue: "queue.Queue[Optional[InferenceRequest]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        # Métricas
+        self.batches = 0
+        self.windows = 0
+        self.requests = 0
+        self.errors = 0
+        self._batch_windows = deque(maxlen=STATS_WINDOW)
+        self._batch_clients = deque(maxlen=STATS_WINDOW)
+        self._queue_waits = deque(maxlen=STATS_WINDOW)
+        self._batch_seconds = deque(maxlen=STATS_WINDOW)
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, model_getter: Callable, max_batch: int, max_wait: float, bucket: int = 64):
+        """
+        Inicia el hilo del servidor. `model_getter()` se llama en cada batch,
+        así que una recarga del modelo se aplica sin reiniciar el servidor.
+        `bucket` es también el tamaño de los bloques que envían las tareas:
+        un `max_batch` menor se sube a `bucket` para que todo bloque quepa.
+        """
+        self._model_getter = model_getter
+        self.bucket = max(1, bucket)
+        if max_batch < self.bucket:
+            print(f"⚠️  INFERENCE_MAX_BATCH={max_batch} es menor que el bloque de {self.bucket} ventanas; "
+                  f"se usa {self.bucket}")
+        self.max_batch = max(max_batch, self.bucket)
+        self.max_wait = max(0.0, max_wait)
+        self._thread = threading.Thread(target=self._serve, name="servidor-inferencia", daemon=True)
+        self._thread.start()
+        print(f"🧮 Servidor de inferencia: batches de hasta {self.max_batch} ventanas, "
+              f"espera máxima {self.max_wait * 1000:.0f} ms")
+
+    def shutdown(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    def submit(self, client_id: str, windows: np.ndarray) -> Future:
+        """
+        Encola un bloque de ventanas de una tarea. El Future se resuelve con
+        (P_onsets, P_frames) de forma (n, SEQ_LEN, 88).
+        """
+        if not self.enabled:
+            raise RuntimeError("El servidor de inferencia no está activo")
+        if len(windows) > self.max_batch:
+            raise ValueError(f"Bloque de {len(windows)} ventanas mayor que el batch máximo ({self.max_batch})")
+        request = InferenceRequest(client_id, windows)
+        self._queue.put(request)
+        return request.future
+
+    # --- Hilo del servidor ---
+
+    def _serve(self):
+        pending: "OrderedDict[str, Deque[InferenceRequest]]" = OrderedDict()
+        stopping = False
+        while not stopping or pending:
+            if not pending:
+                item = self._queue.get()
+                if item is None:
+                    break
+                pending.setdefault(item.client_id, deque()).append(item)
+            stopping = self._drain(pending, timeout=None) or stopping
+
+            batch = self._take(pending, self.max_batch)
+            n_windows = sum(len(r.windows) for r in batch)
+
+            # Batch incompleto: esperar un poco a que lleguen bloques de otras tareas
+            deadline = time.perf_counter() + self.max_wait
+            while n_windows < self.max_batch and not stopping:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                stopping = self._drain(pending, timeout=remaining)
+                extra = self._take(pending, self.max_batch - n_windows)
+                batch.extend(extra)
+                n_windows += sum(len(r.windows) for r in extra)
+
+            if batch:
+                self._run_batch(batch, n_windows)
+
+        # Apagado: fallar lo que quede en la cola
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item.future.set_exception(RuntimeError("El servidor de inferencia se detuvo"))
+
+    def _drain(self, pending: Dict[str, Deque[InferenceRequest]], timeout: Optional[float]) -> bool:
+        """
+        Pasa los pedidos de la cola a `pending` sin bloquear (o esperando hasta
+        `timeout` por el primero). Retorna True si llegó la señal de apagado.
+        """
+        block = timeout is not None
+        while True:
+            try:
+                item = self._queue.get(timeout=timeout) if block else self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            if item is None:
+                return True
+            pending.setdefault(item.client_id, deque()).append(item)
+            block = False
+
+    @staticmethod
+    def _take(pending: Dict[str, Deque[InferenceRequest]], capacity: int) -> List[InferenceRequest]:
+        """Toma bloques por turnos, uno por tarea en cada vuelta, hasta llenar `capacity`."""
+        taken = []
+        progress = True
+        while capacity > 0 and progress:
+            progress = False
+            for client_id in list(pending):
+                requests = pending[client_id]
+                if len(requests[0].windows) > capacity:
+                    continue
+                request = requests.popleft()
+                taken.append(request)
+                capacity -= len(request.windows)
+                progress = True
+                # La tarea atendida pasa al final del turno
+                if requests:
+                    pending.move_to_end(client_id)
+                else:
+                    del pending[client_id]
+        return taken
+
+    def _run_batch(self, batch: List[InferenceRequest], n_windows: int):
+        started = time.perf_counter()
+        try:
+            X = np.concatenate([r.windows for r in batch]) if len(batch) > 1 else batch[0].windows
+            padded = -(-n_windows // self.bucket) * self.bucket
+            if padded > n_windows:
+                X = np.concatenate([X, np.zeros((padded - n_windows,) + X.shape[1:], dtype=X.dtype)])
+
+            P_onsets, P_frames = self._model_getter().predict_on_batch(X)
+            P_onsets, P_frames = np.asarray(P_onsets), np.asarray(P_frames)
+        except Exception as e:
+            self.errors += 1
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        offset = 0
+        for request in batch:
+            k = len(request.windows)
+            request.future.set_result((P_onsets[offset:offset + k], P_frames[offset:offset + k]))
+            offset += k
+            self._queue_waits.append(started - request.enqueued_at)
+
+        self.batches += 1
+        self.windows += n_windows
+        self.requests += len(batch)
+        self._batch_windows.append(n_windows)
+        self._batch_clients.append(len({r.client_id for r in batch}))
+        self._batch_seconds.append(time.perf_counter() - started)
+
+    # --- Métricas ---
+
+    @staticmethod
+    def _percentile(values, q: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_batch": self.max_batch,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "windows": self.windows,
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_batch_windows": round(float(np.mean(self._batch_windows)), 1) if self._batch_windows else None,
+            "avg_batch_tasks": round(float(np.mean(self._batch_clients)), 2) if self._batch_clients else None,
+            "queue_wait_p50_s": self._percentile(self._queue_waits, 0.5),
+            "queue_wait_p95_s": self._percentile(self._queue_waits, 0.95),
+            "batch_p50_s": self._percentile(self._batch_seconds, 0.5),
+        }
+
+
+# Instancia compartida por todo el proceso
+inference_server = InferenceServer()
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+# services/ingest.py
+#
+# Ingesta en paralelo con la subida: el audio se decodifica y pasa por el
+# remuestreo, el filtro y el Mel (StreamingFeatureExtractor) a medida que
+# llegan los bytes, en lugar de esperar a tener el WAV completo en disco y
+# volver a leerlo. Con subidas lentas el cálculo de características queda
+# oculto detrás del tiempo de red y la tarea puede pasar directo a la
+# inferencia cuando llega el último byte.
+#
+# Piezas:
+#   - MultipartFileStream: lee una parte de un multipart/form-data a medida
+#     que llega (Starlette guarda el cuerpo completo antes de llamar al endpoint).
+#   - WavStreamDecoder: parser incremental de WAV (RIFF/RF64) a PCM mono float32.
+#   - PipelinedFeatureIngest: agrupa el PCM en bloques de STREAM_BLOCK_FRAMES
+#     (los mismos que extract_features_streaming, así que el resultado es
+#     idéntico) y los procesa en un hilo mientras sigue la subida.
+# No importa Keras/TensorFlow.
+
+import asyncio
+import struct
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+import numpy as np
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from services.audio_processing import StreamingFeatureExtractor, STREAM_BLOCK_FRAMES
+from services.wav_io import WavFormatError, parse_fmt_chunk, pcm_dtype, pcm_to_mono
+from utils.file_handling import UploadError, UPLOAD_CHUNK_SIZE
+
+
+class WavStreamDecoder:
+    """
+    Decodifica un WAV recibido por partes. `feed(bytes)` retorna las muestras
+    mono (float32, promedio de canales como librosa.to_mono) de los frames
+    completos recibidos hasta el momento. Escala igual que soundfile al leer
+    en float32: PCM entero dividido por 2^(bits-1), 8 bits sin signo centrado.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._state = "riff"
+        self._chunk_left = 0
+        self._data_left: Optional[int] = None
+        self.samplerate: Optional[int] = None
+        self.channels = 0
+        self.bits = 0
+        self.format_tag = 0
+
+    @property
+    def ready(self) -> bool:
+        """True cuando ya se leyó el chunk "fmt " (se conoce la tasa de muestreo)."""
+        return self.samplerate is not None
+
+    def feed(self, data: bytes) -> np.ndarray:
+        self._buffer += data
+        blocks = []
+        while True:
+            if self._state == "riff":
+                if len(self._buffer) < 12:
+                    break
+                if self._buffer[:4] not in (b"RIFF", b"RF64") or self._buffer[8:12] != b"WAVE":
+                    raise WavFormatError("Cabecera RIFF/WAVE no encontrada")
+                del self._buffer[:12]
+                self._state = "chunk"
+            elif self._state == "chunk":
+                if len(self._buffer) < 8:
+                    break
+                chunk_id = bytes(self._buffer[:4])
+                size = struct.unpack("<I", self._buffer[4:8])[0]
+                if chunk_id == b"fmt ":
+                    if len(self._buffer) < 8 + size:
+                        break
+                    self._parse_fmt(bytes(self._buffer[8:8 + size]))
+                    del self._buffer[:8 + size + (size & 1)]
+                elif chunk_id == b"data":
+                    if not self.ready:
+                        raise WavFormatError("Chunk de datos antes del formato")
+                    del self._buffer[:8]
+                    # Tamaño 0 o 0xFFFFFFFF (RF64 / escritura en vivo): hasta el final del archivo
+                    self._data_left = None if size in (0, 0xFFFFFFFF) else size
+                    self._state = "data"
+                else:
+                    # Otros chunks (LIST, ds64, fact...) se saltan
+                    self._chunk_left = size + (size & 1)
+                    del self._buffer[:8]
+                    self._state = "skip"
+            elif self._state == "skip":
+                skipped = min(self._chunk_left, len(self._buffer))
+                del self._buffer[:skipped]
+                self._chunk_left -= skipped
+                if self._chunk_left:
+                    break
+                self._state = "chunk"
+            elif self._state == "data":
+                frame_bytes = self.channels * self.bits // 8
+                available = len(self._buffer)
+                if self._data_left is not None:
+                    available = min(available, self._data_left)
+                usable = available - available % frame_bytes
+                if usable:
+                    blocks.append(self._decode(bytes(self._buffer[:usable])))
+                    del self._buffer[:usable]
+                    if self._data_left is not None:
+                        self._data_left -= usable
+                if self._data_left is not None and self._data_left < frame_bytes:
+                    self._state = "done"
+                break
+            else:
+                # Después de los datos solo quedan chunks de metadatos
+                self._buffer.clear()
+                break
+
+        if not blocks:
+            return np.zeros(0, dtype=np.float32)
+        return blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+
+    def _parse_fmt(self, fmt: bytes):
+        self.format_tag, self.channels, self.samplerate, self.bits = parse_fmt_chunk(fmt)
+
+    def _decode(self, raw: bytes) -> np.ndarray:
+        # Mezcla a mono igual que extract_features_streaming (promedio de canales)
+        samples = np.frombuffer(raw, dtype=pcm_dtype(self.format_tag, self.bits))
+        return pcm_to_mono(samples, self.format_tag, self.bits, self.channels)
+
+
+class PipelinedFeatureIngest:
+    """
+    Extrae las características de un WAV mientras se recibe. `feed` se llama
+    con cada bloque de bytes de la subida; el trabajo de cada bloque de audio
+    corre en un hilo (`run(fn, *args)`, p. ej. worker_pool.run_ingest) y
+    solo hay uno pendiente a la vez: mientras se procesa un bloque, la subida
+    sigue recibiendo el siguiente.
+    Si el WAV no se puede decodificar por partes, `failed` explica por qué y
+    `finish` retorna None (la tarea extrae las características de la forma normal).
+    """
+
+    def __init__(self, run: Callable[..., Awaitable], block_frames: int = STREAM_BLOCK_FRAMES):
+        self._run = run
+        self.block_frames = block_frames
+        self.decoder = WavStreamDecoder()
+        self.extractor: Optional[StreamingFeatureExtractor] = None
+        self.failed: Optional[str] = None
+        self._pending: List[np.ndarray] = []
+        self._pending_frames = 0
+        self._in_flight: Optional[asyncio.Future] = None
+
+    async def feed(self, data: bytes):
+        if self.failed:
+            return
+        try:
+            samples = self.decoder.feed(data)
+        except WavFormatError as e:
+            await self._abort(str(e))
+            return
+        if not len(samples):
+            return
+        if self.extractor is None:
+            self.extractor = StreamingFeatureExtractor(self.decoder.samplerate)
+
+        self._pending.append(samples)
+        self._pending_frames += len(samples)
+        while self._pending_frames >= self.block_frames and not self.failed:
+            await self._submit(self._take(self.block_frames))
+
+    async def finish(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Procesa el resto del audio y retorna (características, tiempos de frame), o None."""
+        if not self.failed and self._pending_frames:
+            await self._submit(self._take(self._pending_frames))
+        await self._wait()
+        if self.failed:
+            return None
+        if self.extractor is None:
+            self.failed = "El WAV no contiene audio"
+            return None
+        try:
+            return await self._run(self.extractor.finish)
+        except Exception as e:
+            self.failed = str(e) or type(e).__name__
+            return None
+
+    async def close(self):
+        """Espera el bloque en curso (p. ej. si la subida se cortó)."""
+        self.failed = self.failed or "Subida interrumpida"
+        try:
+            await self._wait()
+        finally:
+            self._pending = []
+            self.extractor = None
+
+    def _take(self, n_frames: int) -> np.ndarray:
+        samples = np.concatenate(self._pending) if len(self._pending) > 1 else self._pending[0]
+        rest = samples[n_frames:]
+        self._pending = [rest] if len(rest) else []
+        self._pending_frames = len(rest)
+        return samples[:n_frames]
+
+    async def _submit(self, block: np.ndarray):
+        await self._wait()
+        if not self.failed:
+            self._in_flight = asyncio.ensure_future(self._run(self.extractor.feed, block))
+
+    async def _wait(self):
+        if self._in_flight is None:
+            return
+        try:
+            await self._in_flight
+        except Exception as e:
+            self.failed = self.failed or str(e) or type(e).__name__
+        finally:
+            self._in_flight = None
+
+    async def _abort(self, reason: str):
+        self.failed = reason
+        await self._wait()
+        self._pending = []
+        print(f"⚠️  Ingesta en paralelo desactivada para esta subida: {reason}")
+
+
+class MultipartFileStream:
+    """
+    Lee la parte `field_name` de un multipart/form-data directamente del
+    cuerpo de la petición, sin esperar a que llegue completo.
+        stream = MultipartFileStream(request, "file")
+        filename = await stream.open()
+        async for chunk in stream.chunks(): ...
+    """
+
+    def __init__(self, request, field_name: str = "file", chunk_size: int = UPLOAD_CHUNK_SIZE):
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise UploadError("Se esperaba un formulario multipart/form-data")
+        self.request = request
+        self.field_name = field_name.encode()
+        self.chunk_size = chunk_size
+        self.filename: Optional[str] = None
+        self._events: List[tuple] = []
+        self._headers: List[Tuple[bytes, bytes]] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": lambda: self._events.append(("end",)),
+        })
+        self._event_iter = self._iter_events()
+
+    # --- Callbacks del parser (síncronos, durante parser.write) ---
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers.append((self._header_field.lower(), self._header_value))
+        self._header_field, self._header_value = b"", b""
+
+    def _on_headers_finished(self):
+        disposition = dict(self._headers).get(b"content-disposition", b"")
+        _, options = parse_options_header(disposition)
+        self._events.append(("part", options.get(b"name"), options.get(b"filename")))
+        self._headers = []
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        self._events.append(("data", bytes(data[start:end])))
+
+    async def _iter_events(self) -> AsyncIterator[tuple]:
+        async for body in self.request.stream():
+            self._parser.write(body)
+            events, self._events = self._events, []
+            for event in events:
+                yield event
+        self._parser.finalize()
+        for event in self._events:
+            yield event
+
+    async def open(self) -> str:
+        """Avanza hasta la parte del archivo y retorna su nombre."""
+        async for event in self._event_iter:
+            if event[0] == "part" and event[1] == self.field_name:
+                if not event[2]:
+                    raise UploadError(f"El campo '{self.field_name.decode()}' no contiene un archivo")
+                self.filename = event[2].decode("utf-8", errors="replace")
+                return self.filename
+        raise UploadError(f"Falta el campo '{self.field_name.decode()}' en el formulario")
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Bytes del archivo en bloques de al menos `chunk_size` (el último puede ser menor)."""
+        buffer = bytearray()
+        async for event in self._event_iter:
+            if event[0] == "data":
+                buffer += event[1]
+                if len(buffer) >= self.chunk_size:
+                    yield bytes(buffer)
+                    buffer.clear()
+            elif event[0] in ("end", "part"):
+                break
+        if buffer:
+            yield bytes(buffer)
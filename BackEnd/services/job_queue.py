@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+# services/job_queue.py
+#
+# Cola persistente de trabajos de transcripción (SQLite en modo WAL).
+# Antes cada transcripción era un asyncio.create_task sin registro: un
+# reinicio del contenedor perdía los trabajos en cola y en ejecución y dejaba
+# los WAV huérfanos en temp_uploads. Ahora cada trabajo tiene una fila con:
+#   - state: "queued" -> "running" -> "done", o "dead" si agotó los reintentos.
+#   - checkpoints: salida de cada etapa terminada (características,
+#     probabilidades, MIDI), para reanudar desde la última etapa completa.
+#   - owner/lease_expires: el proceso que lo ejecuta renueva el lease; si el
+#     proceso muere, el lease vence y otro proceso (o el mismo al reiniciar)
+#     retoma el trabajo.
+#   - attempts/available_at: reintentos acotados con espera exponencial.
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Etapas del pipeline en orden (el PDF y el MusicXML se generan bajo demanda)
+JOB_STAGES = ("features", "inference", "decoding")
+
+
+class LeaseLostError(Exception):
+    """El trabajo ya no es de este proceso: su lease venció y otro lo reclamó."""
+
+
+class JobQueue:
+    """
+    Tabla `jobs` compartida por todos los procesos que usan la misma base:
+        jobs(task_id PRIMARY KEY, state, attempts, owner, lease_expires,
+             available_at, checkpoints JSON, payload JSON, last_error, ...)
+    Reclamar un trabajo es una única sentencia UPDATE condicional, así que
+    solo un proceso lo ejecuta aunque varios intenten tomarlo a la vez.
+    """
+
+    def __init__(self):
+        self.path: Optional[str] = None
+        self.checkpoint_folder = "checkpoints"
+        self.max_attempts = 3
+        self.lease_seconds = 60
+        self.retry_backoff = 5.0
+        # Identifica a este proceso como dueño de sus trabajos
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def start(
+        self,
+        path: str,
+        checkpoint_folder: str,
+        max_attempts: int,
+        lease_seconds: int,
+        retry_backoff: float
+    ):
+        """Abre (o crea) la base de trabajos. Se llama desde el lifespan."""
+        self.path = path
+        self.checkpoint_folder = checkpoint_folder
+        self.max_attempts = max(1, max_attempts)
+        self.lease_seconds = lease_seconds
+        self.retry_backoff = retry_backoff
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                task_id       TEXT PRIMARY KEY,
+                state         TEXT NOT NULL,
+                attempts      INTEGER NOT NULL DEFAULT 0,
+                owner         TEXT,
+                lease_expires REAL,
+                available_at  REAL NOT NULL,
+                checkpoints   TEXT NOT NULL DEFAULT '{}',
+                payload       TEXT NOT NULL,
+                last_error    TEXT,
+                created_at    REAL NOT NULL,
+                updated_at    REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, available_at);
+            CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner);
+        """)
+        stats = self.stats()
+        print(f"📋 Cola de trabajos: {path} ({stats['queued']} en cola, {stats['running']} en ejecución, "
+              f"{stats['dead']} fallidos)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def shutdown(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["checkpoints"] = json.loads(job["checkpoints"])
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    # --- Ciclo de vida de un trabajo ---
+
+    def enqueue(self, task_id: str, payload: dict, checkpoints: Optional[dict] = None):
+        """
+        Registra un trabajo nuevo. `payload` permite recrear la tarea al reanudar;
+        `checkpoints` marca etapas ya hechas (p. ej. características calculadas
+        durante la subida).
+        """
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO jobs (task_id, state, available_at, checkpoints, payload, created_at, updated_at) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+            (task_id, now, json.dumps(checkpoints or {}), json.dumps(payload), now, now)
+        )
+
+    def claim(self, task_id: str) -> Optional[dict]:
+        """
+        Toma un trabajo en cola (o uno cuyo dueño dejó vencer el lease).
+        Retorna el trabajo con sus checkpoints, o None si otro proceso lo tiene.
+        """
+        now = time.time()
+        connection = self._connection()
+        cursor = connection.execute(
+            "UPDATE jobs SET state = 'running', owner = ?, lease_expires = ?, updated_at = ? "
+            "WHERE task_id = ? AND ((state = 'queued' AND available_at <= ?) "
+            "OR (state = 'running' AND lease_expires < ?))",
+            (self.owner, now + self.lease_seconds, now, task_id, now, now)
+        )
+        if cursor.rowcount != 1:
+            return None
+        row = connection.execute("SELECT * FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+        return self._to_dict(row)
+
+    def checkpoint(self, task_id: str, stage: str, outputs: dict):
+        """Registra la salida de una etapa terminada."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT checkpoints FROM jobs WHERE task_id = ? AND owner = ?", (task_id, self.owner)
+            ).fetchone()
+            if row is not None:
+                checkpoints = json.loads(row["checkpoints"])
+                checkpoints[stage] = outputs
+                connection.execute(
+                    "UPDATE jobs SET checkpoints = ?, updated_at = ? WHERE task_id = ?",
+                    (json.dumps(checkpoints), time.time(), task_id)
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def complete(self, task_id: str) -> bool:
+        """
+        Marca el trabajo como terminado. Retorna False si ya no es de este
+        proceso (otro lo reclamó tras vencer el lease): el otro lo terminará.
+        """
+        cursor = self._connection().execute(
+            "UPDATE jobs SET state = 'done', owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE task_id = ? AND owner = ?",
+            (time.time(), task_id, self.owner)
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, task_id: str, error: str) -> Optional[float]:
+        """
+        Registra un intento fallido. Retorna los segundos hasta el próximo
+        intento, o None si el trabajo agotó sus intentos (pasa a "dead").
+        Lanza LeaseLostError si el trabajo ya no es de este proceso.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT attempts, owner FROM jobs WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            if row["owner"] != self.owner:
+                connection.execute("COMMIT")
+                raise LeaseLostError(f"El trabajo {task_id} lo tomó otro proceso")
+
+            attempts = row["attempts"] + 1
+            now = time.time()
+            if attempts >= self.max_attempts:
+                retry_in = None
+                connection.execute(
+                    "UPDATE jobs SET state = 'dead', attempts = ?, owner = NULL, lease_expires = NULL, "
+                    "last_error = ?, updated_at = ? WHERE task_id = ? AND owner = ?",
+                    (attempts, error, now, task_id, self.owner)
+                )
+            else:
+                retry_in = self.retry_backoff * 2 ** (attempts - 1)
+                connection.execute(
+                    "UPDATE jobs SET state = 'queued', attempts = ?, owner = NULL, lease_expires = NULL, "
+                    "available_at = ?, last_error = ?, updated_at = ? WHERE task_id = ? AND owner = ?",
+                    (attempts, now + retry_in, error, now, task_id, self.owner)
+                )
+            connection.execute("COMMIT")
+            return retry_in
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+
+    def remove(self, task_id: str):
+        self._connection().execute("DELETE FROM jobs WHERE task_id = ?", (task_id,))
+        self.discard_checkpoints(task_id)
+
+    # --- Archivos de checkpoint ---
+
+    def save_arrays(self, task_id: str, **arrays: np.ndarray) -> Dict[str, str]:
+        """Guarda arrays de una etapa en <checkpoint_folder>/<task_id>/ y retorna sus rutas."""
+        directory = os.path.join(self.checkpoint_folder, task_id)
+        os.makedirs(directory, exist_ok=True)
+        outputs = {}
+        for name, array in arrays.items():
+            path = os.path.join(directory, f"{name}.npy")
+            # Escribir aparte y renombrar: un checkpoint nunca queda a medias
+            tmp_path = os.path.join(directory, f"{name}.tmp.npy")
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+            outputs[name] = path
+        return outputs
+
+    @staticmethod
+    def load_arrays(outputs: Dict[str, str]) -> Dict[str, np.ndarray]:
+        return {name: np.load(path) for name, path in outputs.items()}
+
+    def discard_checkpoints(self, task_id: str):
+        shutil.rmtree(os.path.join(self.checkpoint_folder, task_id), ignore_errors=True)
+
+    # --- Supervisión ---
+
+    def heartbeat(self) -> int:
+        """Renueva el lease de los trabajos de este proceso."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET lease_expires = ? WHERE owner = ? AND state = 'running'",
+            (time.time() + self.lease_seconds, self.owner)
+        )
+        return cursor.rowcount
+
+    def recoverable(self) -> List[dict]:
+        """Trabajos sin dueño activo: en cola (y listos para reintentar) o con el lease vencido."""
+        now = time.time()
+        rows = self._connection().execute(
+            "SELECT * FROM jobs WHERE (state = 'queued' AND available_at <= ?) "
+            "OR (state = 'running' AND lease_expires < ?) ORDER BY created_at",
+            (now, now)
+        ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def active_audio_paths(self) -> List[str]:
+        """Audios que todavía necesita algún trabajo sin terminar."""
+        rows = self._connection().execute(
+            "SELECT payload FROM jobs WHERE state IN ('queued', 'running')"
+        ).fetchall()
+        return [json.loads(row["payload"]).get("audio_path") for row in rows]
+
+    def dead_letters(self, limit: int = 50) -> List[dict]:
+        rows = self._connection().execute(
+            "SELECT task_id, attempts, last_error, created_at, updated_at, payload FROM jobs "
+            "WHERE state = 'dead' ORDER BY updated_at DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [
+            {
+                "task_id": row["task_id"],
+                "filename": json.loads(row["payload"]).get("filename"),
+                "attempts": row["attempts"],
+                "last_error": row["last_error"],
+                "created_at": row["created_at"],
+                "failed_at": row["updated_at"],
+            }
+            for row in rows
+        ]
+
+    def purge_finished(self, ttl_seconds: float) -> int:
+        """Elimina los trabajos terminados (o muertos) hace más de `ttl_seconds`."""
+        cursor = self._connection().execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'dead') AND updated_at < ?",
+            (time.time() - ttl_seconds,)
+        )
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        counts = {state: 0 for state in ("queued", "running", "done", "dead")}
+        if not self.enabled:
+            return {"enabled": False, **counts}
+        rows = self._connection().execute(
+            "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+        ).fetchall()
+        counts.update({row[0]: row[1] for row in rows})
+        return {"enabled": True, **counts}
+
+
+# Instancia compartida por todo el proceso
+job_queue = JobQueue()
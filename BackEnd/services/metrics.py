@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+# services/metrics.py
+#
+# Instrumentación de las etapas de una transcripción (tiempo y memoria) y
+# exportación en formato de texto de Prometheus (GET /metrics).
+#
+#   with metrics.stage("inference", task_id):
+#       ...
+#
+# Cada etapa registra su duración, el pico de RSS del proceso mientras corrió
+# y cuánto creció respecto al inicio. El pico se obtiene con un hilo que lee
+# /proc/self/statm cada METRICS_SAMPLE_INTERVAL_MS solo mientras hay etapas
+# abiertas; con varias tareas a la vez el RSS es del proceso completo, así que
+# la memoria de etapas simultáneas se solapa.
+# Las etapas que corren en el pool de procesos se juntan en el worker
+# (`collect`) y se devuelven con el resultado al proceso principal (`merge`).
+# El colector es una ContextVar: una subida que junta sus etapas no captura
+# las de otras tareas que corren a la vez en otros hilos o corrutinas.
+# Desactivado, `stage()` retorna un contexto vacío compartido.
+
+import os
+import threading
+import time
+from contextvars import ContextVar
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Límites de los histogramas (Prometheus: segundos y bytes)
+STAGE_SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+STAGE_MEMORY_BUCKETS = tuple(2 ** k * 1024 * 1024 for k in range(2, 14))  # 4MB ... 8GB
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_NULL_STAGE = nullcontext()
+_collector: ContextVar[Optional[list]] = ContextVar("metrics_collector", default=None)
+MB = 1024 * 1024
+
+
+def current_rss_bytes() -> Optional[int]:
+    """RSS actual del proceso (None si /proc no está disponible)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemorySampler:
+    """Hilo que actualiza el pico de RSS de las etapas abiertas (duerme si no hay ninguna)."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self._active: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def track(self) -> Optional[List[int]]:
+        """Empieza a seguir una etapa; retorna [rss_inicial, pico] o None sin /proc."""
+        rss = current_rss_bytes()
+        if rss is None:
+            return None
+        tracker = [rss, rss]
+        with self._lock:
+            self._active[id(tracker)] = tracker
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="metricas-memoria", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return tracker
+
+    def untrack(self, tracker: Optional[List[int]]) -> Tuple[Optional[int], Optional[int]]:
+        """Deja de seguir la etapa y retorna (rss_inicial, pico)."""
+        if tracker is None:
+            return None, None
+        rss = current_rss_bytes() or 0
+        with self._lock:
+            self._active.pop(id(tracker), None)
+            tracker[1] = max(tracker[1], rss)
+        return tracker[0], tracker[1]
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            rss = current_rss_bytes()
+            if rss is not None:
+                with self._lock:
+                    for tracker in self._active.values():
+                        if rss > tracker[1]:
+                            tracker[1] = rss
+            time.sleep(self.interval)
+
+
+class Histogram:
+    """Histograma acumulativo con una serie por etiqueta (formato de Prometheus)."""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...], label: str):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        # etiqueta -> [conteos por bucket..., +Inf], suma
+        self._counts: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+
+    def observe(self, label_value: str, value: float):
+        counts = self._counts.setdefault(label_value, [0] * (len(self.buckets) + 1))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        self._sums[label_value] = self._sums.get(label_value, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value in sorted(self._counts):
+            counts = self._counts[label_value]
+            labels = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{_format_value(bound)}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {_format_value(self._sums[label_value])}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class _Stage:
+    """Contexto de una etapa medida (ver Metrics.stage)."""
+
+    __slots__ = ("_metrics", "name", "task_id", "_started", "_tracker")
+
+    def __init__(self, metrics: "Metrics", name: str, task_id: Optional[str]):
+        self._metrics = metrics
+        self.name = name
+        self.task_id = task_id
+
+    def __enter__(self):
+        self._tracker = self._metrics.sampler.track()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._started
+        start_rss, peak_rss = self._metrics.sampler.untrack(self._tracker)
+        # Las etapas que fallan no entran en los histogramas
+        if exc_type is None:
+            self._metrics.record(self.name, seconds, start_rss, peak_rss, self.task_id)
+        return False
+
+
+class Metrics:
+    """Histogramas por etapa, contadores y desglose de etapas por tarea."""
+
+    def __init__(self):
+        self.enabled = False
+        self.sampler = MemorySampler()
+        self._lock = threading.Lock()
+        self._stage_seconds = Histogram(
+            "transcription_stage_seconds", "Duración de cada etapa de la transcripción", STAGE_SECONDS_BUCKETS, "stage"
+        )
+        self._stage_memory = Histogram(
+            "transcription_stage_memory_bytes",
+            "Crecimiento del RSS del proceso durante cada etapa (pico - inicio)", STAGE_MEMORY_BUCKETS, "stage"
+        )
+        self._counters: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+        # Recibe (task_id, etapa, registro) de cada etapa asociada a una tarea
+        self.stage_listener: Optional[Callable[[str, str, dict], None]] = None
+
+    def start(self, enabled: bool = True, sample_interval: float = 0.01):
+        """Activa la instrumentación. Se llama desde el lifespan y en cada worker del pool."""
+        self.enabled = enabled
+        self.sampler.interval = max(0.001, sample_interval)
+        if enabled and current_rss_bytes() is None:
+            print("⚠️  Métricas sin memoria por etapa (/proc/self/statm no disponible)")
+
+    def stage(self, name: str, task_id: Optional[str] = None):
+        """Contexto que mide una etapa; sin métricas no hace nada."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, task_id)
+
+    def record(self, name: str, seconds: float, start_rss: Optional[int] = None,
+               peak_rss: Optional[int] = None, task_id: Optional[str] = None):
+        entry = {"seconds": round(seconds, 4)}
+        if peak_rss is not None:
+            entry["peak_rss_mb"] = round(peak_rss / MB, 1)
+            entry["rss_delta_mb"] = round((peak_rss - start_rss) / MB, 1)
+        collector = _collector.get()
+        if collector is not None:
+            # Dentro de collect (p. ej. en un worker del pool): se publica al salir
+            collector.append((name, entry, seconds, start_rss, peak_rss))
+            return
+        self._observe(name, seconds, start_rss, peak_rss)
+        if task_id is not None and self.stage_listener is not None:
+            self.stage_listener(task_id, name, entry)
+
+    def _observe(self, name: str, seconds: float, start_rss: Optional[int], peak_rss: Optional[int]):
+        with self._lock:
+            self._stage_seconds.observe(name, seconds)
+            if peak_rss is not None:
+                self._stage_memory.observe(name, peak_rss - start_rss)
+
+    @contextmanager
+    def collect(self, publish: bool = True):
+        """
+        Junta en una lista las etapas registradas dentro del bloque. Al salir
+        pasan al colector exterior, o se publican; con publish=False solo quedan
+        en la lista (un worker del pool las devuelve al proceso principal).
+        """
+        previous = _collector.get()
+        records = []
+        token = _collector.set(records)
+        try:
+            yield records
+        finally:
+            _collector.reset(token)
+            if previous is not None:
+                previous.extend(records)
+            elif publish:
+                self.merge(records)
+
+    def merge(self, records: Iterable[tuple], task_id: Optional[str] = None):
+        """Publica las etapas devueltas por un worker del pool (o juntadas con collect)."""
+        for name, _, seconds, start_rss, peak_rss in records:
+            self.record(name, seconds, start_rss, peak_rss, task_id)
+
+    @staticmethod
+    def breakdown(records: Iterable[tuple]) -> Dict[str, dict]:
+        """Desglose {etapa: registro} de las etapas juntadas con collect."""
+        return {name: entry for name, entry, *_ in records}
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def render(self, gauges: Iterable[Tuple[str, str, List[Tuple[Dict[str, str], float]]]] = ()) -> str:
+        """
+        Texto de Prometheus con los histogramas, los contadores y los `gauges`
+        recibidos como (nombre, ayuda, [(etiquetas, valor), ...]).
+        """
+        with self._lock:
+            lines = self._stage_seconds.render() + self._stage_memory.render()
+            for name in sorted(self._counters):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(dict(key))} {_format_value(value)}")
+        for name, help_text, samples in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Instancia compartida por todo el proceso (y una por cada worker del pool)
+metrics = Metrics()
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+# services/midi_decoding.py
+#
+# Decodificación de los piano rolls binarios (onsets y frames) a MIDI.
+# Igual que audio_processing.py, no depende de Keras para poder ejecutarse
+# en el pool de procesos. Las notas se decodifican a una NoteTable (columnas
+# de NumPy) que escribe el MIDI directamente, sin un pm.Note por nota.
+
+import numpy as np
+import pretty_midi as pm
+from typing import Optional, Tuple
+
+from services.audio_processing import SR, HOP_LENGTH, compute_frame_times
+from services.metrics import metrics
+from services.note_table import NoteTable, INSTRUMENT_NAME
+
+N_KEYS = 88
+LOW_MIDI = 21
+
+# Las probabilidades crudas se guardan como (2, n_frames, 88): [onsets, frames]
+PROBABILITIES_DTYPE = np.float16
+# Frames por chunk al re-decodificar las probabilidades guardadas
+REDECODE_CHUNK_FRAMES = 10000
+
+
+# --- Decodificación a MIDI ---
+
+def decode_note_indices(
+    P_onsets_binary: np.ndarray,
+    P_frames_binary: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decodifica los piano rolls binarios en notas, de forma vectorizada.
+    
+    Equivale a la máquina de estados de `piano_roll_to_midi_loop`: cada racha
+    de frames activos de una tecla produce como máximo una nota, que empieza en
+    el primer onset dentro de la racha (los onsets con la nota ya activa se
+    ignoran) y termina en el primer frame inactivo.
+    
+    Returns:
+        (keys, start_idx, end_idx) en orden tecla -> tiempo. `end_idx == n_frames`
+        indica que la nota sigue activa al final del audio.
+    """
+    n_frames, n_keys = P_frames_binary.shape
+    active = (P_frames_binary == 1).T
+    onset_in_run = (P_onsets_binary == 1).T & active
+    
+    # 1. Bordes de las rachas de frames activos (np.diff sobre el roll con ceros a los lados)
+    padded = np.zeros((n_keys, n_frames + 2), dtype=np.int8)
+    padded[:, 1:-1] = active
+    edges = np.diff(padded, axis=1)
+    run_keys, run_starts = np.nonzero(edges == 1)
+    _, run_ends = np.nonzero(edges == -1)
+    
+    # 2. Índice del siguiente onset (dentro de una racha) a partir de cada frame
+    frame_idx = np.arange(n_frames, dtype=np.int64)
+    candidates = np.where(onset_in_run, frame_idx, n_frames)
+    next_onset = np.minimum.accumulate(candidates[:, ::-1], axis=1)[:, ::-1]
+    
+    # 3. La nota de cada racha empieza en su primer onset, si lo hay
+    note_starts = next_onset[run_keys, run_starts]
+    has_note = note_starts < run_ends
+    
+    return run_keys[has_note], note_starts[has_note], run_ends[has_note]
+
+
+def piano_roll_to_notes(
+    P_onsets_binary: np.ndarray,
+    P_frames_binary: np.ndarray,
+    frame_times: np.ndarray
+) -> NoteTable:
+    """
+    Convierte los piano rolls binarios (Onsets y Frames) en una tabla de notas.
+    Usa Onsets para INICIAR notas y Frames para SOSTENER/TERMINAR notas.
+    Produce las mismas notas que 6inferencia.py, pero sin recorrer cada frame en Python.
+    """
+    keys, start_idx, end_idx = decode_note_indices(P_onsets_binary, P_frames_binary)
+    return notes_from_indices(keys, start_idx, end_idx, frame_times)
+
+
+def piano_roll_to_midi(
+    P_onsets_binary: np.ndarray,
+    P_frames_binary: np.ndarray,
+    frame_times: np.ndarray
+) -> pm.PrettyMIDI:
+    """`piano_roll_to_notes` como objeto PrettyMIDI (para comparar con la versión de referencia)."""
+    return piano_roll_to_notes(P_onsets_binary, P_frames_binary, frame_times).to_pretty_midi()
+
+
+def notes_from_indices(
+    keys: np.ndarray,
+    start_idx: np.ndarray,
+    end_idx: np.ndarray,
+    frame_times: np.ndarray
+) -> NoteTable:
+    """
+    Tabla de notas a partir de notas en índices de frame.
+    `end_idx == len(frame_times)` indica una nota activa hasta el final del audio.
+    Las notas se ordenan por tecla y tiempo, igual que la máquina de estados.
+    """
+    n_frames = len(frame_times)
+    hop_duration_s = HOP_LENGTH / SR
+    
+    order = np.lexsort((start_idx, keys))
+    keys, start_idx, end_idx = keys[order], start_idx[order], end_idx[order]
+    
+    # Tiempo final: el frame donde termina la nota, o el final del audio
+    start_times = frame_times[start_idx]
+    end_times = np.empty(len(end_idx), dtype=np.float64)
+    open_notes = end_idx >= n_frames
+    end_times[~open_notes] = frame_times[end_idx[~open_notes]]
+    if np.any(open_notes):
+        end_times[open_notes] = frame_times[-1] + hop_duration_s
+    
+    # Evitar notas de duración cero
+    valid = end_times > start_times
+    return NoteTable(LOW_MIDI + keys[valid], start_times[valid], end_times[valid])
+
+
+def notes_to_midi(
+    keys: np.ndarray,
+    start_idx: np.ndarray,
+    end_idx: np.ndarray,
+    frame_times: np.ndarray
+) -> pm.PrettyMIDI:
+    """`notes_from_indices` como objeto PrettyMIDI."""
+    return notes_from_indices(keys, start_idx, end_idx, frame_times).to_pretty_midi()
+
+
+class IncrementalNoteDecoder:
+    """
+    Decodifica los piano rolls por chunks consecutivos, con el mismo resultado
+    que `decode_note_indices` sobre el roll completo.
+    
+    Entre chunks se conserva, por tecla, si el último frame estaba activo y el
+    frame de inicio de la nota en curso. Cada chunk se decodifica con una fila
+    virtual al inicio que reproduce ese estado.
+    """
+
+    def __init__(self, n_keys: int = N_KEYS):
+        self.n_keys = n_keys
+        self.frames_seen = 0
+        self._prev_active = np.zeros(n_keys, dtype=np.uint8)
+        self._open_start = np.full(n_keys, -1, dtype=np.int64)
+
+    def feed(
+        self,
+        P_onsets_binary: np.ndarray,
+        P_frames_binary: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Procesa el siguiente chunk y retorna las notas que terminan dentro de él
+        (keys, start_idx, end_idx) en índices de frame globales.
+        """
+        n_chunk = P_frames_binary.shape[0]
+        
+        # Fila virtual: frame anterior activo y "onset" donde hay una nota en curso
+        onsets = np.vstack([(self._open_start >= 0).astype(np.uint8), P_onsets_binary])
+        frames = np.vstack([self._prev_active, P_frames_binary])
+        keys, start_idx, end_idx = decode_note_indices(onsets, frames)
+        
+        # Índices locales -> globales (la fila 0 es el frame anterior al chunk)
+        offset = self.frames_seen - 1
+        starts = np.where(start_idx == 0, self._open_start[keys], start_idx + offset)
+        ends = end_idx + offset
+        
+        # Las notas que llegan al final del chunk siguen abiertas
+        still_open = end_idx == n_chunk + 1
+        self._open_start = np.full(self.n_keys, -1, dtype=np.int64)
+        self._open_start[keys[still_open]] = starts[still_open]
+        
+        if n_chunk:
+            self._prev_active = (P_frames_binary[-1] == 1).astype(np.uint8)
+        self.frames_seen += n_chunk
+        
+        closed = ~still_open
+        return keys[closed], starts[closed], ends[closed]
+
+    def finish(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Retorna las notas activas hasta el final del audio (end_idx == frames totales)."""
+        keys = np.nonzero(self._open_start >= 0)[0]
+        starts = self._open_start[keys]
+        ends = np.full(len(keys), self.frames_seen, dtype=np.int64)
+        self._open_start[:] = -1
+        return keys, starts, ends
+
+
+def piano_roll_to_midi_loop(
+    P_onsets_binary: np.ndarray,
+    P_frames_binary: np.ndarray,
+    frame_times: np.ndarray
+) -> pm.PrettyMIDI:
+    """
+    Versión de referencia de `piano_roll_to_midi`: máquina de estados por tecla
+    y por frame, exactamente como en 6inferencia.py. Es lenta en audios largos;
+    se conserva para verificar el decodificador vectorizado.
+    """
+    n_frames, n_keys = P_frames_binary.shape
+    hop_duration_s = HOP_LENGTH / SR
+    
+    pm_obj = pm.PrettyMIDI()
+    instrument = pm.Instrument(program=0, name=INSTRUMENT_NAME)
+    
+    for k in range(n_keys):
+        pitch = LOW_MIDI + k
+        note_active = False
+        start_time = 0.0
+        
+        for frame_idx in range(n_frames):
+            frame_time = frame_times[frame_idx]
+            is_onset = P_onsets_binary[frame_idx, k] == 1
+            is_active = P_frames_binary[frame_idx, k] == 1
+            
+            # Caso 1: Inicia una nota (Hay onset y no hay nota activa)
+            if is_onset and not note_active:
+                note_active = True
+                start_time = frame_time
+            
+            # Caso 2: Termina una nota (No hay frame activo y SÍ había nota activa)
+            if not is_active and note_active:
+                note_active = False
+                end_time = frame_time
+                # Evitar notas de duración cero
+                if end_time > start_time:
+                    note = pm.Note(velocity=100, pitch=pitch, start=start_time, end=end_time)
+                    instrument.notes.append(note)
+
+        # Caso 3: La nota estaba activa hasta el final del audio
+        if note_active:
+            end_time = frame_times[-1] + hop_duration_s
+            if end_time > start_time:
+                note = pm.Note(velocity=100, pitch=pitch, start=start_time, end=end_time)
+                instrument.notes.append(note)
+                
+    pm_obj.instruments.append(instrument)
+    return pm_obj
+
+
+def write_midi_from_rolls(
+    Y_onsets: np.ndarray,
+    Y_frames: np.ndarray,
+    frame_times: np.ndarray,
+    output_midi_path: Optional[str]
+) -> dict:
+    """
+    Decodifica los piano rolls binarios, guarda el MIDI y retorna la
+    información de la transcripción. Sin `output_midi_path` el MIDI no se
+    escribe a disco: vuelve como bytes en `midi_bytes`, junto con la lista
+    de notas en formato binario (`notes_bytes`, ver services/note_table.py).
+    """
+    with metrics.stage("piano_roll_to_midi"):
+        notes = piano_roll_to_notes(Y_onsets, Y_frames, frame_times)
+    return _midi_result(notes, frame_times, output_midi_path)
+
+
+def write_midi_from_notes(
+    keys: np.ndarray,
+    start_idx: np.ndarray,
+    end_idx: np.ndarray,
+    frame_times: np.ndarray,
+    output_midi_path: Optional[str]
+) -> dict:
+    """
+    Igual que `write_midi_from_rolls`, a partir de notas ya decodificadas en
+    índices de frame (p. ej. por IncrementalNoteDecoder durante la inferencia).
+    """
+    with metrics.stage("piano_roll_to_midi"):
+        notes = notes_from_indices(keys, start_idx, end_idx, frame_times)
+    return _midi_result(notes, frame_times, output_midi_path)
+
+
+def _midi_result(notes: NoteTable, frame_times: np.ndarray, output_midi_path: Optional[str]) -> dict:
+    with metrics.stage("midi_write"):
+        midi_bytes = notes.to_midi_bytes()
+        if output_midi_path:
+            with open(output_midi_path, "wb") as f:
+                f.write(midi_bytes)
+    
+    result = {
+        "success": True,
+        "midi_path": output_midi_path,
+        "total_frames": len(frame_times),
+        "duration_seconds": float(frame_times[-1]),
+        "total_notes": len(notes)
+    }
+    if not output_midi_path:
+        result["midi_bytes"] = midi_bytes
+        result["notes_bytes"] = notes.by_start().to_bytes()
+    return result
+
+
+# --- Probabilidades crudas (re-decodificación con otros umbrales) ---
+
+def open_probabilities_for_write(path: str, total_frames: int) -> np.memmap:
+    """Crea el archivo .npy (2, n_frames, 88) en float16 y lo abre mapeado en memoria."""
+    return np.lib.format.open_memmap(
+        path, mode="w+", dtype=PROBABILITIES_DTYPE, shape=(2, total_frames, N_KEYS)
+    )
+
+
+def load_probabilities(path: str) -> np.ndarray:
+    """Abre las probabilidades guardadas sin cargarlas completas en memoria."""
+    return np.load(path, mmap_mode="r")
+
+
+def redecode_probabilities(
+    probabilities_path: str,
+    output_midi_path: Optional[str],
+    t_onsets: float,
+    t_frames: float
+) -> dict:
+    """
+    Aplica nuevos umbrales a las probabilidades guardadas de una tarea y
+    reescribe su MIDI (o lo retorna en `midi_bytes`), sin volver a ejecutar el modelo.
+    Se leen y decodifican por chunks, sin armar los piano rolls completos.
+    """
+    probabilities = load_probabilities(probabilities_path)
+    n_frames = probabilities.shape[1]
+    frame_times = compute_frame_times(n_frames)
+    
+    decoder = IncrementalNoteDecoder()
+    parts = []
+    for start in range(0, n_frames, REDECODE_CHUNK_FRAMES):
+        stop = start + REDECODE_CHUNK_FRAMES
+        parts.append(decoder.feed(
+            (probabilities[0, start:stop] > t_onsets).astype(np.uint8),
+            (probabilities[1, start:stop] > t_frames).astype(np.uint8)
+        ))
+    parts.append(decoder.finish())
+    keys, start_idx, end_idx = (np.concatenate(columns) for columns in zip(*parts))
+    
+    result = write_midi_from_notes(keys, start_idx, end_idx, frame_times, output_midi_path)
+    result["t_onsets"] = t_onsets
+    result["t_frames"] = t_frames
+    return result
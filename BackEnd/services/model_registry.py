@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# services/model_registry.py
+#
+# Registro del modelo CNN-LSTM compartido por todo el proceso.
+# El modelo se carga una sola vez (desde el lifespan de FastAPI), se "calienta"
+# con un batch ficticio y se reutiliza en todas las transcripciones.
+# Permite reemplazar el archivo .keras en caliente sin reiniciar el servidor.
+
+import os
+import time
+import hashlib
+import threading
+from typing import Optional, Union
+
+import numpy as np
+import keras
+
+from services.transcription import SEQ_LEN, N_MELS_MODELO, MODELO_CAMPEON_PATH
+from services.inference_backends import InferenceBackend, load_backend
+from services.metrics import metrics
+
+# Tamaño del batch de calentamiento (mismo batch_size que la inferencia)
+WARMUP_BATCH_SIZE = 64
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Huella SHA-256 del archivo del modelo (identifica la versión de los pesos)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Mantiene una única instancia del modelo cargada en memoria.
+    La carga y el calentamiento de un modelo nuevo se hacen fuera del lock,
+    de modo que las tareas en curso siguen usando el modelo anterior hasta
+    que el reemplazo está listo.
+    """
+
+    def __init__(self, model_path: str = MODELO_CAMPEON_PATH):
+        self.model_path = model_path
+        self._model: Optional[Union[keras.Model, InferenceBackend]] = None
+        # Backend de inferencia (ver services/inference_backends.py)
+        self.backend = "keras"
+        self.export_folder = os.path.join("modelos", "exportados")
+        self.threads = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+        self.model_mtime: Optional[float] = None
+        self.fingerprint: Optional[str] = None
+        self.version = 0
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._model is not None
+
+    def configure(self, backend: str, export_folder: str, threads: int = 0):
+        """Elige el backend de inferencia. Se aplica en la próxima carga."""
+        self.backend = backend
+        self.export_folder = export_folder
+        self.threads = threads
+
+    def load(self, model_path: Optional[str] = None) -> Union[keras.Model, InferenceBackend]:
+        """
+        Carga (o recarga) el modelo desde disco, lo calienta y lo publica.
+        Si la carga falla, el modelo anterior se mantiene.
+        """
+        path = model_path or self.model_path
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No se encontró el modelo en: {path}")
+
+        # Evitar dos cargas simultáneas del mismo archivo
+        with self._load_lock:
+            mtime = os.path.getmtime(path)
+            fingerprint = file_sha256(path)
+
+            t0 = time.perf_counter()
+            with metrics.stage("model_load"):
+                model = load_backend(self.backend, path, self.export_folder, self.threads)
+            load_seconds = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            with metrics.stage("model_warmup"):
+                warmup_batch = np.zeros((WARMUP_BATCH_SIZE, SEQ_LEN, N_MELS_MODELO), dtype=np.float32)
+                if isinstance(model, keras.Model):
+                    model.predict(warmup_batch, verbose=0)
+                else:
+                    model.predict_on_batch(warmup_batch)
+            warmup_seconds = time.perf_counter() - t0
+
+            with self._lock:
+                self._model = model
+                self.model_path = path
+                self.model_mtime = mtime
+                self.fingerprint = fingerprint
+                self.load_seconds = load_seconds
+                self.warmup_seconds = warmup_seconds
+                self.loaded_at = time.time()
+                self.version += 1
+
+        print(f"🧠 Modelo cargado: {path} [{self.backend}] (carga {load_seconds:.2f}s, calentamiento {warmup_seconds:.2f}s)")
+        return model
+
+    def get_model(self) -> Union[keras.Model, InferenceBackend]:
+        """
+        Devuelve el modelo compartido. Lo carga bajo demanda si aún no se
+        cargó (por ejemplo, cuando se usa fuera del servidor).
+        """
+        with self._lock:
+            model = self._model
+        if model is None:
+            model = self.load()
+        return model
+
+    def reload_if_changed(self) -> bool:
+        """
+        Recarga el modelo si el archivo en disco cambió desde la última carga.
+        Retorna True si hubo recarga.
+        """
+        if not os.path.exists(self.model_path):
+            return False
+        if self.model_mtime is not None and os.path.getmtime(self.model_path) == self.model_mtime:
+            return False
+        self.load()
+        return True
+
+    def info(self) -> dict:
+        """Información del modelo cargado para endpoints de salud."""
+        return {
+            "loaded": self.is_loaded,
+            "model_path": self.model_path,
+            "backend": self.backend,
+            "version": self.version,
+            "fingerprint": self.fingerprint[:16] if self.fingerprint else None,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "warmup_seconds": round(self.warmup_seconds, 3) if self.warmup_seconds is not None else None,
+            "loaded_at": self.loaded_at,
+        }
+
+
+# Instancia compartida por todo el proceso
+model_registry = ModelRegistry()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# services/note_table.py
+#
+# Tabla de notas compacta (una columna de NumPy por campo) y escritor SMF
+# directo. El decodificador produce una NoteTable en lugar de un pm.Note por
+# nota, y `to_midi_bytes` arma el archivo MIDI con operaciones sobre arrays:
+# los ticks, el orden de los eventos y los delta-times (cantidades de
+# longitud variable) se calculan para todas las notas a la vez.
+# La salida es idéntica byte a byte a PrettyMIDI.write para un piano sin
+# cambios de tempo: formato 1, 220 ticks por negra, 120 BPM, 4/4, pista de
+# tempo + pista del piano (canal 0, running status, note-off como note-on
+# con velocidad 0).
+#
+# Formato binario de la lista de notas (`to_bytes`, little-endian):
+#     b"NTB1" | uint32 n | float32 inicio[n] | float32 fin[n] | uint8 tono[n] | uint8 velocidad[n]
+# (segundos; los float32 quedan alineados a 4 bytes para leerlos con Float32Array).
+
+import io
+import struct
+from typing import Optional
+
+import numpy as np
+
+# Parámetros del MIDI (los valores por defecto de pretty_midi)
+MIDI_RESOLUTION = 220
+MIDI_TEMPO_BPM = 120.0
+INSTRUMENT_NAME = "Piano (Transcripción)"
+DEFAULT_VELOCITY = 100
+
+NOTES_MAGIC = b"NTB1"
+END_OF_TRACK = b"\x01\xff\x2f\x00"
+
+# Delta-times de hasta 4 bytes (2^28 ticks, unas 169 horas a 120 BPM)
+_MAX_TICK = 2 ** 28 - 1
+
+
+class NoteTable:
+    """Notas como columnas: tono (MIDI), inicio y fin (segundos) y velocidad."""
+
+    __slots__ = ("pitch", "start", "end", "velocity")
+
+    def __init__(self, pitch: np.ndarray, start: np.ndarray, end: np.ndarray,
+                 velocity: Optional[np.ndarray] = None):
+        self.pitch = np.asarray(pitch, dtype=np.uint8)
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        if velocity is None:
+            velocity = np.full(len(self.pitch), DEFAULT_VELOCITY, dtype=np.uint8)
+        self.velocity = np.asarray(velocity, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.pitch)
+
+    @property
+    def duration(self) -> float:
+        return float(self.end.max()) if len(self) else 0.0
+
+    def by_start(self) -> "NoteTable":
+        """Copia ordenada por inicio y tono (el decodificador ordena por tecla y tiempo)."""
+        order = np.lexsort((self.pitch, self.start))
+        return NoteTable(self.pitch[order], self.start[order], self.end[order], self.velocity[order])
+
+    # --- MIDI ---
+
+    def to_midi_bytes(self, resolution: int = MIDI_RESOLUTION, tempo_bpm: float = MIDI_TEMPO_BPM,
+                      program: int = 0, name: str = INSTRUMENT_NAME) -> bytes:
+        """Archivo MIDI estándar con las notas (igual al que escribe PrettyMIDI)."""
+        # Misma conversión que PrettyMIDI.time_to_tick con un único tempo
+        tick_scale = 60.0 / (tempo_bpm * resolution)
+        tempo = int(6e7 / (60. / (tick_scale * resolution)))
+
+        n = len(self)
+        ticks = np.empty(2 * n, dtype=np.int64)
+        ticks[:n] = np.rint(self.start / tick_scale)
+        ticks[n:] = np.rint(self.end / tick_scale)
+        notes = np.concatenate((self.pitch, self.pitch))
+        velocities = np.concatenate((self.velocity, np.zeros(n, dtype=np.uint8)))
+        if n and ticks.max() > _MAX_TICK:
+            raise ValueError("Transcripción demasiado larga para el MIDI")
+
+        # Orden de PrettyMIDI en un mismo tick: por tono y luego velocidad (note-off primero)
+        order = np.lexsort((velocities, notes, ticks))
+        ticks, notes, velocities = ticks[order], notes[order], velocities[order]
+        deltas = np.diff(ticks, prepend=0)
+
+        # Pistas: tempo y compás (4/4); nombre, programa y notas del piano.
+        # Cada una termina con end_of_track un tick después de su último evento
+        track_name = name.encode("latin-1")
+        tempo_track = (
+            b"\x00\xff\x51\x03" + tempo.to_bytes(3, "big")
+            + b"\x00\xff\x58\x04\x04\x02\x18\x08"
+            + END_OF_TRACK
+        )
+        piano_track = (
+            b"\x00\xff\x03" + _vlq(len(track_name)) + track_name
+            + bytes((0x00, 0xC0, program))
+            + _encode_note_events(deltas, notes, velocities)
+            + END_OF_TRACK
+        )
+        out = io.BytesIO()
+        out.write(b"MThd" + struct.pack(">Ihhh", 6, 1, 2, resolution))
+        for track in (tempo_track, piano_track):
+            out.write(b"MTrk" + struct.pack(">I", len(track)) + track)
+        return out.getvalue()
+
+    def write_midi(self, path: str):
+        with open(path, "wb") as f:
+            f.write(self.to_midi_bytes())
+
+    def to_pretty_midi(self):
+        """PrettyMIDI equivalente (un pm.Note por nota; solo para compatibilidad)."""
+        import pretty_midi as pm
+        pm_obj = pm.PrettyMIDI()
+        instrument = pm.Instrument(program=0, name=INSTRUMENT_NAME)
+        instrument.notes = [
+            pm.Note(velocity=velocity, pitch=pitch, start=start, end=end)
+            for pitch, start, end, velocity in zip(
+                self.pitch.tolist(), self.start.tolist(), self.end.tolist(), self.velocity.tolist()
+            )
+        ]
+        pm_obj.instruments.append(instrument)
+        return pm_obj
+
+    @classmethod
+    def from_midi_bytes(cls, data: bytes) -> "NoteTable":
+        """Lee las notas de un MIDI (p. ej. uno restaurado de la caché)."""
+        import pretty_midi as pm
+        midi = pm.PrettyMIDI(io.BytesIO(data))
+        notes = [note for instrument in midi.instruments for note in instrument.notes]
+        return cls(
+            np.array([note.pitch for note in notes], dtype=np.uint8),
+            np.array([note.start for note in notes], dtype=np.float64),
+            np.array([note.end for note in notes], dtype=np.float64),
+            np.array([note.velocity for note in notes], dtype=np.uint8),
+        )
+
+    # --- Lista de notas para los clientes ---
+
+    def to_bytes(self) -> bytes:
+        """Formato binario compacto (10 bytes por nota, ver el encabezado del módulo)."""
+        return b"".join((
+            NOTES_MAGIC, struct.pack("<I", len(self)),
+            self.start.astype("<f4").tobytes(), self.end.astype("<f4").tobytes(),
+            self.pitch.tobytes(), self.velocity.tobytes(),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "NoteTable":
+        if data[:4] != NOTES_MAGIC:
+            raise ValueError("Lista de notas con formato desconocido")
+        n = struct.unpack("<I", data[4:8])[0]
+        start = np.frombuffer(data, dtype="<f4", count=n, offset=8)
+        end = np.frombuffer(data, dtype="<f4", count=n, offset=8 + 4 * n)
+        pitch = np.frombuffer(data, dtype=np.uint8, count=n, offset=8 + 8 * n)
+        velocity = np.frombuffer(data, dtype=np.uint8, count=n, offset=8 + 9 * n)
+        return cls(pitch, start, end, velocity)
+
+    def to_dict(self, decimals: int = 4) -> dict:
+        """Columnas para JSON (segundos redondeados a `decimals`)."""
+        return {
+            "count": len(self),
+            "pitch": self.pitch.tolist(),
+            "start": np.round(self.start, decimals).tolist(),
+            "end": np.round(self.end, decimals).tolist(),
+            "velocity": self.velocity.tolist(),
+        }
+
+
+def _vlq(value: int) -> bytes:
+    """Cantidad de longitud variable de un solo valor."""
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def _encode_note_events(deltas: np.ndarray, notes: np.ndarray, velocities: np.ndarray) -> bytes:
+    """
+    Eventos note-on (canal 0) con sus delta-times, codificados en bloque. Solo
+    el primero lleva el byte de estado 0x90; el resto usa running status.
+    """
+    n = len(deltas)
+    if n == 0:
+        return b""
+    # Bytes del delta-time de cada evento (1 a 4) y largo total de cada evento
+    vlq_len = 1 + (deltas >= 1 << 7).astype(np.int64) + (deltas >= 1 << 14) + (deltas >= 1 << 21)
+    event_len = vlq_len + 2
+    event_len[0] += 1
+    offsets = np.zeros(n, dtype=np.int64)
+    np.cumsum(event_len[:-1], out=offsets[1:])
+
+    out = np.empty(int(offsets[-1] + event_len[-1]), dtype=np.uint8)
+    # Delta-time: 7 bits por byte, el más significativo primero, bit alto en todos menos el último
+    for j in range(4):
+        has_byte = vlq_len > j
+        shift = 7 * (vlq_len[has_byte] - 1 - j)
+        byte = (deltas[has_byte] >> shift) & 0x7F
+        byte |= np.where(j < vlq_len[has_byte] - 1, 0x80, 0)
+        out[offsets[has_byte] + j] = byte
+    data_at = offsets + vlq_len
+    out[data_at[0]] = 0x90
+    data_at[0] += 1
+    out[data_at] = notes
+    out[data_at + 1] = velocities
+    return out.tobytes()
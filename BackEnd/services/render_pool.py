@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+# services/render_pool.py
+#
+# Servicio de renderizado de partituras con MuseScore de larga duración.
+# En lugar de lanzar `xvfb-run -a mscore3 ...` por cada PDF (arrancar un
+# servidor X y cargar Qt/MuseScore en cada trabajo), se mantiene:
+#   - Un display virtual Xvfb persistente compartido por todos los renders.
+#   - Un pool de workers que agrupan los trabajos pendientes en lotes y los
+#     convierten con una sola ejecución de MuseScore en modo lote (`-j job.json`).
+# Un monitor reinicia el display si muere, y cada lote tiene un timeout: si
+# MuseScore se cuelga, el proceso se mata y el worker continúa con el siguiente.
+
+import os
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+from collections import deque
+from typing import List, Optional
+
+from services.sheet_music import find_musescore
+
+# Latencias recientes usadas para las métricas
+LATENCY_WINDOW = 200
+# Primer número de display que se intenta usar para Xvfb
+FIRST_DISPLAY = 99
+
+
+class RenderError(Exception):
+    """MuseScore no pudo generar el PDF de un trabajo."""
+
+
+class RenderJob:
+    """Un MIDI pendiente de convertir a PDF."""
+
+    def __init__(self, midi_path: str, pdf_path: str, future: asyncio.Future):
+        self.midi_path = midi_path
+        self.pdf_path = pdf_path
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class RenderPool:
+    """
+    Cola de trabajos MIDI -> PDF atendida por `pool_size` workers.
+    Cada worker toma hasta `batch_size` trabajos (esperando como mucho
+    `batch_wait` segundos a que lleguen más) y los renderiza con un único
+    proceso de MuseScore.
+    """
+
+    def __init__(self):
+        self.musescore_path: Optional[str] = None
+        self.pool_size = 0
+        self.batch_size = 4
+        self.batch_wait = 0.2
+        self.job_timeout = 30
+        self.health_interval = 30
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._monitor: Optional[asyncio.Task] = None
+        self._xvfb: Optional[asyncio.subprocess.Process] = None
+        self.display: Optional[str] = None
+        # Métricas
+        self.in_flight = 0
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.batches = 0
+        self.timeouts = 0
+        self.worker_restarts = 0
+        self.display_restarts = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._render_seconds = deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._workers)
+
+    async def start(
+        self,
+        pool_size: int,
+        batch_size: int,
+        batch_wait: float,
+        job_timeout: int,
+        health_interval: int
+    ):
+        """Inicia el display virtual y los workers. Se llama desde el lifespan."""
+        self.musescore_path = find_musescore()
+        if pool_size <= 0 or not self.musescore_path:
+            print("⚠️  Pool de MuseScore desactivado (MuseScore no encontrado o RENDER_POOL_SIZE=0)")
+            return
+
+        self.pool_size = pool_size
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = max(0.0, batch_wait)
+        self.job_timeout = job_timeout
+        self.health_interval = health_interval
+        self._queue = asyncio.Queue()
+
+        await self._start_display()
+        self._workers = [asyncio.create_task(self._worker_loop(i)) for i in range(pool_size)]
+        self._monitor = asyncio.create_task(self._monitor_loop())
+        print(f"🎼 Pool de MuseScore iniciado: {pool_size} workers, lotes de hasta {self.batch_size} "
+              f"(display {self.display or 'offscreen'})")
+
+    async def shutdown(self):
+        """Detiene los workers, falla los trabajos pendientes y cierra Xvfb."""
+        tasks = self._workers + ([self._monitor] if self._monitor else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._monitor = None
+
+        if self._queue is not None:
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+                if not job.future.done():
+                    job.future.set_exception(RenderError("El servicio de renderizado se detuvo"))
+        await self._stop_display()
+
+    # --- Display virtual ---
+
+    async def _start_display(self):
+        """Arranca Xvfb en el primer display libre; sin Xvfb se usa Qt offscreen."""
+        xvfb_path = shutil.which('Xvfb')
+        if not xvfb_path:
+            print("⚠️  Xvfb no disponible, MuseScore usará QT_QPA_PLATFORM=offscreen")
+            self.display = None
+            return
+
+        number = FIRST_DISPLAY
+        while os.path.exists(f"/tmp/.X{number}-lock"):
+            number += 1
+
+        self._xvfb = await asyncio.create_subprocess_exec(
+            xvfb_path, f":{number}", "-nolisten", "tcp", "-screen", "0", "1280x1024x24",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        # Esperar a que el socket del display esté listo
+        for _ in range(50):
+            if os.path.exists(f"/tmp/.X11-unix/X{number}") or self._xvfb.returncode is not None:
+                break
+            await asyncio.sleep(0.1)
+
+        if self._xvfb.returncode is not None:
+            print(f"⚠️  Xvfb terminó al iniciar (código {self._xvfb.returncode}), usando offscreen")
+            self._xvfb = None
+            self.display = None
+            return
+        self.display = f":{number}"
+        print(f"🖥️  Display virtual persistente en {self.display}")
+
+    async def _stop_display(self):
+        if self._xvfb and self._xvfb.returncode is None:
+            self._xvfb.terminate()
+            try:
+                await asyncio.wait_for(self._xvfb.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self._xvfb.kill()
+        self._xvfb = None
+
+    def _display_alive(self) -> bool:
+        return self.display is None or (self._xvfb is not None and self._xvfb.returncode is None)
+
+    async def _monitor_loop(self):
+        """Revisa el display y los workers; reinicia lo que haya muerto."""
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                if not self._display_alive():
+                    print("🔁 Xvfb no responde, reiniciando display virtual")
+                    await self._stop_display()
+                    await self._start_display()
+                    self.display_restarts += 1
+
+                for i, task in enumerate(self._workers):
+                    if task.done():
+                        error = None if task.cancelled() else task.exception()
+                        print(f"🔁 Worker de MuseScore {i} terminó ({error}), reiniciando")
+                        self._workers[i] = asyncio.create_task(self._worker_loop(i))
+                        self.worker_restarts += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Error en el monitor de MuseScore: {e}")
+
+    # --- Trabajos ---
+
+    async def render(self, midi_path: str, pdf_path: str) -> str:
+        """Encola un MIDI y espera su PDF. Lanza RenderError si MuseScore falla."""
+        if not self.enabled:
+            raise RenderError("El pool de MuseScore no está activo")
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(RenderJob(os.path.abspath(midi_path), os.path.abspath(pdf_path), future))
+        await future
+        return pdf_path
+
+    async def _next_batch(self) -> List[RenderJob]:
+        """Espera un trabajo y junta los que lleguen durante `batch_wait` segundos."""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    async def _worker_loop(self, worker_id: int):
+        while True:
+            batch = await self._next_batch()
+            self.in_flight += len(batch)
+            try:
+                await self._render_batch(batch)
+            except asyncio.CancelledError:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(RenderError("El servicio de renderizado se detuvo"))
+                raise
+            except Exception as e:
+                print(f"❌ Worker de MuseScore {worker_id}: {e}")
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(RenderError(str(e)))
+            finally:
+                self.in_flight -= len(batch)
+
+    async def _render_batch(self, batch: List[RenderJob]):
+        """Convierte un lote de MIDIs con una sola ejecución de MuseScore (`-j`)."""
+        for job in batch:
+            if os.path.exists(job.pdf_path):
+                os.remove(job.pdf_path)
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump([{"in": job.midi_path, "out": job.pdf_path} for job in batch], f)
+            job_file = f.name
+
+        env = os.environ.copy()
+        if self.display:
+            env["DISPLAY"] = self.display
+        else:
+            env["QT_QPA_PLATFORM"] = "offscreen"
+
+        t0 = time.perf_counter()
+        stderr = b""
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.musescore_path, "-j", job_file,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                env=env
+            )
+            try:
+                _, stderr = await asyncio.wait_for(
+                    process.communicate(), timeout=self.job_timeout * len(batch)
+                )
+            except asyncio.TimeoutError:
+                # MuseScore colgado: matar el proceso; los PDFs ya escritos se conservan
+                process.kill()
+                await process.wait()
+                self.timeouts += 1
+                stderr = f"MuseScore tardó demasiado tiempo (timeout {self.job_timeout * len(batch)}s)".encode()
+        finally:
+            os.remove(job_file)
+
+        self.batches += 1
+        self._render_seconds.append(time.perf_counter() - t0)
+
+        # MuseScore escribe warnings de Qt en stderr aunque funcione: solo importa el PDF
+        real_errors = [line for line in stderr.decode(errors="replace").split('\n')
+                       if line and not line.startswith('qt.qml')]
+        error_msg = '\n'.join(real_errors) or "MuseScore no generó el PDF"
+
+        now = time.perf_counter()
+        for job in batch:
+            if job.future.done():
+                # El solicitante canceló la espera
+                continue
+            if os.path.exists(job.pdf_path) and os.path.getsize(job.pdf_path) > 0:
+                self.jobs_completed += 1
+                self._latencies.append(now - job.enqueued_at)
+                job.future.set_result(job.pdf_path)
+            else:
+                self.jobs_failed += 1
+                job.future.set_exception(RenderError(f"MuseScore falló: {error_msg}"))
+
+    # --- Métricas ---
+
+    @staticmethod
+    def _percentile(values, q: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "workers": len(self._workers),
+            "display": self.display,
+            "display_alive": self._display_alive() if self.enabled else None,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": self.in_flight,
+            "jobs_completed": self.jobs_completed,
+            "jobs_failed": self.jobs_failed,
+            "batches": self.batches,
+            "avg_batch_size": round(
+                (self.jobs_completed + self.jobs_failed) / self.batches, 2
+            ) if self.batches else None,
+            "timeouts": self.timeouts,
+            "worker_restarts": self.worker_restarts,
+            "display_restarts": self.display_restarts,
+            "latency_p50_s": self._percentile(self._latencies, 0.5),
+            "latency_p95_s": self._percentile(self._latencies, 0.95),
+            "render_p50_s": self._percentile(self._render_seconds, 0.5),
+        }
+
+
+# Instancia compartida por todo el proceso
+render_pool = RenderPool()
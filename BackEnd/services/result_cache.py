@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# services/result_cache.py
+#
+# Caché en disco de resultados de transcripción, direccionada por contenido.
+# La clave combina el hash del audio subido, la huella del modelo y los
+# parámetros de decodificación, de modo que volver a subir la misma grabación
+# devuelve el MIDI, el PDF y la información sin repetir el pipeline. También
+# se guardan las probabilidades crudas del modelo para poder re-decodificar.
+# Las entradas se desalojan por LRU cuando el tamaño total supera el límite.
+
+import os
+import json
+import shutil
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from services.artifacts import newest_mtime
+
+MIDI_NAME = "resultado.mid"
+PDF_NAME = "partitura.pdf"
+PROBABILITIES_NAME = "probabilidades.npy"
+INFO_NAME = "info.json"
+
+# Un directorio temporal (<clave>.tmp-<pid>-<hilo>) sin cambios en este tiempo
+# es una escritura interrumpida; uno más reciente puede ser un put() en curso
+# de otro worker (el pid no sirve con varios contenedores sobre el volumen).
+TMP_GRACE_SECONDS = 15 * 60
+
+
+def make_cache_key(audio_digest: str, model_fingerprint: str, **params) -> str:
+    """Clave de caché a partir del hash del audio, el modelo y los parámetros."""
+    payload = json.dumps(
+        {"audio": audio_digest, "model": model_fingerprint, "params": params},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Índice LRU en memoria sobre un directorio por entrada:
+        <cache_dir>/<clave>/{resultado.mid, partitura.pdf, probabilidades.npy, info.json}
+    El índice se reconstruye una sola vez al iniciar, ordenado por la última
+    fecha de acceso (mtime de info.json). Con varios workers sobre el mismo
+    directorio cada uno tiene su índice: una clave que no está en el índice
+    se busca en el disco (la pudo guardar otro worker), y una entrada del
+    índice que otro worker desalojó se descarta al no encontrar sus archivos.
+    """
+
+    def __init__(self):
+        self.cache_dir: Optional[str] = None
+        self.max_bytes = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # clave -> bytes
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache_dir is not None
+
+    def start(self, cache_dir: str, max_bytes: int):
+        """Activa la caché y carga el índice. Se llama desde el lifespan de la aplicación."""
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries.clear()
+        self.total_bytes = 0
+        self._load_index()
+        print(f"💾 Caché de resultados: {len(self._entries)} entradas, "
+              f"{self.total_bytes / 1024 / 1024:.1f} MB en {cache_dir}")
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _load_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        now = time.time()
+        found = []
+        for key in os.listdir(self.cache_dir):
+            info_path = os.path.join(self._entry_dir(key), INFO_NAME)
+            if ".tmp-" in key:
+                try:
+                    stale = now - newest_mtime(self._entry_dir(key)) > TMP_GRACE_SECONDS
+                except FileNotFoundError:
+                    continue  # el put() de otro worker ya lo renombró o lo borró
+                if stale:
+                    shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                continue
+            if not os.path.isfile(info_path):
+                # Entradas incompletas (p. ej. una escritura interrumpida)
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                continue
+            found.append((os.path.getmtime(info_path), key, self._dir_size(self._entry_dir(key))))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.total_bytes += size
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        return sum(
+            os.path.getsize(os.path.join(path, name))
+            for name in os.listdir(path)
+            if os.path.isfile(os.path.join(path, name))
+        )
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Busca una entrada. Retorna {"midi_path", "pdf_path", "probabilities_path", "info"} con rutas
+        dentro de la caché (copiarlas antes de entregarlas a una tarea).
+        """
+        if not self.enabled:
+            return None
+        
+        entry_dir = self._entry_dir(key)
+        info_path = os.path.join(entry_dir, INFO_NAME)
+        midi_path = os.path.join(entry_dir, MIDI_NAME)
+        with self._lock:
+            indexed = key in self._entries
+        if not indexed and not self._adopt(key):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            with open(info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            if not os.path.isfile(midi_path):
+                raise FileNotFoundError(midi_path)
+            # Registrar el acceso para conservar el orden LRU entre reinicios
+            os.utime(info_path, None)
+        except (OSError, ValueError):
+            # Desalojada por otro worker (o incompleta)
+            self.discard(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+
+        pdf_path = os.path.join(entry_dir, PDF_NAME)
+        probabilities_path = os.path.join(entry_dir, PROBABILITIES_NAME)
+        return {
+            "midi_path": midi_path,
+            "pdf_path": pdf_path if os.path.exists(pdf_path) else None,
+            "probabilities_path": probabilities_path if os.path.exists(probabilities_path) else None,
+            "info": info
+        }
+
+    def put(
+        self,
+        key: str,
+        midi_path: Optional[str],
+        pdf_path: Optional[str],
+        info: dict,
+        probabilities_path: Optional[str] = None,
+        midi_data: Optional[bytes] = None
+    ):
+        """
+        Guarda un resultado (copia los archivos) y desaloja entradas antiguas si hace falta.
+        Con `midi_data` el MIDI se escribe desde memoria en lugar de copiar `midi_path`.
+        """
+        if not self.enabled:
+            return
+        
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            if midi_data is not None:
+                with open(os.path.join(tmp_dir, MIDI_NAME), "wb") as f:
+                    f.write(midi_data)
+            else:
+                shutil.copyfile(midi_path, os.path.join(tmp_dir, MIDI_NAME))
+            if pdf_path and os.path.exists(pdf_path):
+                shutil.copyfile(pdf_path, os.path.join(tmp_dir, PDF_NAME))
+            if probabilities_path and os.path.exists(probabilities_path):
+                shutil.copyfile(probabilities_path, os.path.join(tmp_dir, PROBABILITIES_NAME))
+            # info.json al final: su presencia marca la entrada como completa
+            with open(os.path.join(tmp_dir, INFO_NAME), "w", encoding="utf-8") as f:
+                json.dump(info, f)
+
+            size = self._dir_size(tmp_dir)
+            with self._lock:
+                if key in self._entries:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    return
+                try:
+                    os.replace(tmp_dir, entry_dir)
+                except OSError:
+                    if not os.path.isfile(os.path.join(entry_dir, INFO_NAME)):
+                        raise
+                    # Otro worker guardó la misma entrada primero: usar la suya
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    size = self._dir_size(entry_dir)
+                self._entries[key] = size
+                self.total_bytes += size
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        self._evict()
+
+    def add_pdf(self, key: str, pdf_path: str):
+        """Agrega la partitura a una entrada existente (el PDF se genera bajo demanda)."""
+        if not self.enabled:
+            return
+        
+        with self._lock:
+            if key not in self._entries:
+                return
+        target = os.path.join(self._entry_dir(key), PDF_NAME)
+        if os.path.exists(target):
+            return
+        
+        tmp_path = f"{target}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            shutil.copyfile(pdf_path, tmp_path)
+            os.replace(tmp_path, target)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        size = os.path.getsize(target)
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] += size
+                self.total_bytes += size
+        self._evict()
+
+    def _adopt(self, key: str) -> bool:
+        """Agrega al índice una entrada completa que está en disco (guardada por otro worker)."""
+        entry_dir = self._entry_dir(key)
+        if not os.path.isfile(os.path.join(entry_dir, INFO_NAME)):
+            return False
+        try:
+            size = self._dir_size(entry_dir)
+        except OSError:
+            return False
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = size
+                self.total_bytes += size
+        self._evict()
+        return True
+
+    def discard(self, key: str):
+        """Elimina una entrada (p. ej. una cuyos archivos ya no se pueden leer)."""
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self.total_bytes -= size
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _evict(self):
+        """Elimina las entradas usadas hace más tiempo hasta respetar max_bytes."""
+        evicted = 0
+        while True:
+            with self._lock:
+                if self.total_bytes <= self.max_bytes or len(self._entries) <= 1:
+                    break
+                key, size = self._entries.popitem(last=False)
+                self.total_bytes -= size
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            evicted += 1
+        if evicted:
+            print(f"🗑️  Caché: {evicted} entradas antiguas eliminadas")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "total_mb": round(self.total_bytes / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+# Instancia compartida por todo el proceso
+result_cache = ResultCache()
@@ -8,6 +8,17 @@ import pretty_midi as pm
 from music21 import converter, stream, note, chord, instrument, meter, tempo
 from typing import Optional
 
+from services.engraving import engrave_pdf
+
+
+def find_musescore() -> Optional[str]:
+    """Ruta del ejecutable de MuseScore, o None si no está instalado."""
+    import shutil
+    path = shutil.which('mscore3') or shutil.which('mscore') or shutil.which('musescore')
+    if path:
+        return path
+    return '/usr/bin/mscore3' if os.path.exists('/usr/bin/mscore3') else None
+
 
 def midi_to_pdf_sheet_music(
     midi_path: str,
@@ -34,10 +45,10 @@ def midi_to_pdf_sheet_music(
         print(f"🎵 Convirtiendo MIDI a PDF con MuseScore...")
         # Detectar ruta de MuseScore según el sistema operativo
         import shutil
-        musescore_path = shutil.which('mscore3') or shutil.which('mscore') or shutil.which('musescore') or '/usr/bin/mscore3'
+        musescore_path = find_musescore()
         
-        if not os.path.exists(musescore_path) and not shutil.which('mscore3'):
-            raise FileNotFoundError(f"MuseScore no encontrado. Buscado en: {musescore_path}")
+        if not musescore_path:
+            raise FileNotFoundError("MuseScore no encontrado. Buscado en: /usr/bin/mscore3")
         
         print(f"📍 Usando MuseScore en: {musescore_path}")
         
@@ -116,7 +127,7 @@ def create_simple_pdf_with_lilypond(
     output_pdf_path: str
 ) -> str:
     """
-    Método alternativo usando Lilypond directamente si music21 falla.
+    Método alternativo usando Lilypond directamente (method="lilypond").
     Requiere tener Lilypond instalado en el sistema.
     
     Args:
@@ -132,27 +143,6 @@ def create_simple_pdf_with_lilypond(
         # Generar archivo .ly temporal
         ly_path = output_pdf_path.replace('.pdf', '.ly')
         
-        # Crear archivo Lilypond básico
-        ly_content = f'''
-\\version "2.24.0"
-\\score {{
-  \\new PianoStaff <<
-    \\new Staff {{
-      \\clef treble
-      \\articulate
-      \\midi2ly "{os.path.abspath(midi_path)}"
-    }}
-    \\new Staff {{
-      \\clef bass
-      \\articulate
-      \\midi2ly "{os.path.abspath(midi_path)}"
-    }}
-  >>
-  \\layout {{ }}
-  \\midi {{ }}
-}}
-'''
-        
         # Usar midi2ly para convertir
         subprocess.run([
             'midi2ly',
@@ -189,14 +179,14 @@ def generate_sheet_music_pdf(
 ) -> str:
     """
     Función principal para generar partituras en PDF.
-    Intenta múltiples métodos automáticamente.
+    Si el método preferido falla, usa el grabado en proceso (sin programas externos).
     
     Args:
         midi_path: Ruta al archivo MIDI
         output_pdf_path: Ruta donde guardar el PDF
         title: Título de la partitura
         composer: Compositor/autor
-        method: Método preferido ("music21" o "lilypond")
+        method: Método preferido ("music21" = MuseScore, "lilypond" o "native")
         
     Returns:
         Ruta al archivo PDF generado
@@ -208,6 +198,12 @@ def generate_sheet_music_pdf(
     # Crear directorio si no existe
     os.makedirs(os.path.dirname(output_pdf_path), exist_ok=True)
     
+    # Grabado en proceso, sin lanzar procesos externos
+    if method == "native":
+        result = engrave_pdf(midi_path, output_pdf_path, title, composer)
+        print(f"✅ PDF generado exitosamente (grabado nativo): {output_pdf_path}")
+        return result
+    
     # Intentar método preferido primero
     if method == "music21":
         try:
@@ -219,13 +215,13 @@ def generate_sheet_music_pdf(
             else:
                 raise Exception("El PDF no se generó correctamente")
         except Exception as e:
-            # Solo intentar Lilypond si realmente falló (no se creó el PDF)
+            # Solo usar el respaldo si realmente falló (no se creó el PDF)
             if not (os.path.exists(output_pdf_path) and os.path.getsize(output_pdf_path) > 0):
-                print(f"Falló music21, intentando Lilypond: {e}")
+                print(f"Falló music21, usando el grabado nativo: {e}")
                 try:
-                    return create_simple_pdf_with_lilypond(midi_path, output_pdf_path)
+                    return engrave_pdf(midi_path, output_pdf_path, title, composer)
                 except Exception as e2:
-                    raise Exception(f"Todos los métodos fallaron. music21: {e}, Lilypond: {e2}")
+                    raise Exception(f"Todos los métodos fallaron. music21: {e}, nativo: {e2}")
             else:
                 # Si el PDF se creó a pesar del error, retornarlo
                 print(f"✅ PDF generado exitosamente con music21 (con warnings ignorados)")
@@ -234,12 +230,8 @@ def generate_sheet_music_pdf(
         try:
             return create_simple_pdf_with_lilypond(midi_path, output_pdf_path)
         except Exception as e:
-            print(f"Falló Lilypond, intentando music21: {e}")
+            print(f"Falló Lilypond, usando el grabado nativo: {e}")
             try:
-                return midi_to_pdf_sheet_music(midi_path, output_pdf_path, title, composer)
+                return engrave_pdf(midi_path, output_pdf_path, title, composer)
             except Exception as e2:
-                # Verificar si el PDF se creó de todas formas
-                if os.path.exists(output_pdf_path) and os.path.getsize(output_pdf_path) > 0:
-                    print(f"✅ PDF generado exitosamente con music21 (con warnings ignorados)")
-                    return output_pdf_path
-                raise Exception(f"Todos los métodos fallaron. Lilypond: {e}, music21: {e2}")
+                raise Exception(f"Todos los métodos fallaron. Lilypond: {e}, nativo: {e2}")
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# services/task_events.py
+#
+# Notificaciones por tarea para enviar el progreso a los clientes (SSE) en el
+# momento en que cambia, sin que cada conexión consulte el estado en un bucle.
+# Cada tarea tiene un contador de versión; publicar incrementa la versión y
+# despierta a quienes esperan. Los clientes leen el estado actual de la tarea,
+# así que varias actualizaciones seguidas se entregan como una sola.
+#
+# Solo se usa desde el event loop: desde otros hilos hay que pasar por
+# loop.call_soon_threadsafe (ver WorkerPool.publish_progress).
+
+import asyncio
+from typing import Dict
+
+
+class TaskEventHub:
+    """Versión y evento de cambio por tarea."""
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._changed: Dict[str, asyncio.Event] = {}
+
+    def version(self, task_id: str) -> int:
+        return self._versions.get(task_id, 0)
+
+    def notify(self, task_id: str):
+        """Marca que el estado de la tarea cambió y despierta a los suscriptores."""
+        self._versions[task_id] = self._versions.get(task_id, 0) + 1
+        event = self._changed.pop(task_id, None)
+        if event is not None:
+            event.set()
+
+    async def wait(self, task_id: str, version: int, timeout: float) -> bool:
+        """
+        Espera a que la versión de la tarea sea distinta de `version`.
+        Retorna False si pasó `timeout` sin cambios.
+        """
+        if self.version(task_id) != version:
+            return True
+        event = self._changed.setdefault(task_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def discard(self, task_id: str):
+        """Olvida una tarea eliminada (despierta a los suscriptores para que cierren)."""
+        self._versions.pop(task_id, None)
+        event = self._changed.pop(task_id, None)
+        if event is not None:
+            event.set()
+
+
+# Instancia compartida por todo el proceso
+task_events = TaskEventHub()
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+# services/task_store.py
+#
+# Almacén del estado de las tareas de transcripción.
+# Antes el estado vivía en un diccionario del módulo routers/upload.py, por lo
+# que solo podía haber un proceso de uvicorn y un reinicio perdía las tareas.
+# Ahora el router usa la instancia `task_store`, que delega en un backend:
+#   - "memory": diccionario en memoria (comportamiento original, un proceso).
+#   - "sqlite": base SQLite en modo WAL. Varios workers de uvicorn (o
+#     contenedores con un volumen compartido) ven las mismas tareas: cualquiera
+#     puede recibir una subida y responder el estado o las descargas.
+# Las tareas son diccionarios serializables a JSON. Las lecturas devuelven
+# copias: para modificar una tarea hay que usar update/transition/mutate, que
+# son atómicas también entre procesos.
+# Desde el event loop se usan las variantes async (aget, aupdate, amutate...):
+# con SQLite una escritura puede esperar el lock de otro worker hasta 10 s, así
+# que corren en un hilo; en memoria se llaman directo.
+
+import os
+import copy
+import asyncio
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class TaskBackend(ABC):
+    """Interfaz de los backends de tareas."""
+
+    # True si otros procesos pueden modificar las tareas (hay que consultar periódicamente)
+    shared = False
+
+    @abstractmethod
+    def create(self, task_id: str, data: dict):
+        ...
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def mutate(self, task_id: str, fn: Callable[[dict], Optional[bool]]) -> Optional[dict]:
+        """
+        Aplica `fn` a la tarea de forma atómica. Si `fn` retorna False no se
+        guarda nada. Retorna la tarea modificada, o None si no existe o no se aplicó.
+        """
+
+    @abstractmethod
+    def delete(self, task_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def purge_expired(self, ttl_seconds: float) -> List[dict]:
+        """Elimina las tareas sin cambios en `ttl_seconds` y las retorna."""
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+    @abstractmethod
+    def count_by_status(self) -> Dict[str, int]:
+        ...
+
+    def close(self):
+        pass
+
+
+class MemoryTaskBackend(TaskBackend):
+    """Tareas en un diccionario del proceso."""
+
+    def __init__(self):
+        self._tasks: Dict[str, dict] = {}
+        self._updated_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def create(self, task_id: str, data: dict):
+        with self._lock:
+            self._tasks[task_id] = copy.deepcopy(data)
+            self._updated_at[task_id] = time.time()
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return copy.deepcopy(task) if task is not None else None
+
+    def mutate(self, task_id: str, fn: Callable[[dict], Optional[bool]]) -> Optional[dict]:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            updated = copy.deepcopy(task)
+            if fn(updated) is False:
+                return None
+            self._tasks[task_id] = updated
+            self._updated_at[task_id] = time.time()
+            return copy.deepcopy(updated)
+
+    def delete(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            self._updated_at.pop(task_id, None)
+            return self._tasks.pop(task_id, None)
+
+    def purge_expired(self, ttl_seconds: float) -> List[dict]:
+        limit = time.time() - ttl_seconds
+        with self._lock:
+            expired = [task_id for task_id, updated in self._updated_at.items() if updated < limit]
+            for task_id in expired:
+                del self._updated_at[task_id]
+            return [self._tasks.pop(task_id) for task_id in expired]
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._tasks)
+
+    def count_by_status(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for task in self._tasks.values():
+                counts[task["status"]] = counts.get(task["status"], 0) + 1
+        return counts
+
+
+class SqliteTaskBackend(TaskBackend):
+    """
+    Tareas en una tabla SQLite (modo WAL) compartida entre procesos:
+        tasks(task_id PRIMARY KEY, status, created_at, updated_at, data JSON)
+    Con índices por estado y por fecha de actualización (expiración por TTL).
+    Cada hilo usa su propia conexión; las modificaciones se hacen dentro de
+    una transacción BEGIN IMMEDIATE, que bloquea a los demás escritores.
+    """
+
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        connection = self._connection()
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id    TEXT PRIMARY KEY,
+                status     TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                data       TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+            CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks(updated_at);
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # isolation_level=None: las transacciones se abren explícitamente
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def create(self, task_id: str, data: dict):
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO tasks (task_id, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?)",
+            (task_id, data["status"], data.get("created_at", now), now, json.dumps(data))
+        )
+
+    def get(self, task_id: str) -> Optional[dict]:
+        row = self._connection().execute(
+            "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def mutate(self, task_id: str, fn: Callable[[dict], Optional[bool]]) -> Optional[dict]:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if row is None:
+                connection.execute("ROLLBACK")
+                return None
+            task = json.loads(row[0])
+            if fn(task) is False:
+                connection.execute("ROLLBACK")
+                return None
+            connection.execute(
+                "UPDATE tasks SET status = ?, updated_at = ?, data = ? WHERE task_id = ?",
+                (task["status"], time.time(), json.dumps(task), task_id)
+            )
+            connection.execute("COMMIT")
+            return task
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def delete(self, task_id: str) -> Optional[dict]:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            connection.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return json.loads(row[0]) if row else None
+
+    def purge_expired(self, ttl_seconds: float) -> List[dict]:
+        limit = time.time() - ttl_seconds
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                "SELECT data FROM tasks WHERE updated_at < ?", (limit,)
+            ).fetchall()
+            connection.execute("DELETE FROM tasks WHERE updated_at < ?", (limit,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def count_by_status(self) -> Dict[str, int]:
+        rows = self._connection().execute(
+            "SELECT status, COUNT(*) FROM tasks GROUP BY status"
+        ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class TaskStore:
+    """
+    Punto de acceso único al estado de las tareas. Empieza en memoria (así
+    funciona sin el lifespan) y `start` elige el backend configurado.
+    """
+
+    def __init__(self):
+        self.backend: TaskBackend = MemoryTaskBackend()
+        self.kind = "memory"
+
+    def start(self, kind: str, path: Optional[str] = None):
+        """Elige el backend ("memory" o "sqlite"). Se llama desde el lifespan."""
+        if kind == "sqlite":
+            self.backend = SqliteTaskBackend(path)
+            print(f"🗂️  Estado de tareas en SQLite: {path} ({self.backend.count()} tareas)")
+        elif kind == "memory":
+            self.backend = MemoryTaskBackend()
+        else:
+            raise ValueError(f"TASK_STORE desconocido: {kind}")
+        self.kind = kind
+
+    def shutdown(self):
+        self.backend.close()
+
+    @property
+    def shared(self) -> bool:
+        return self.backend.shared
+
+    def create(self, task_id: str, data: dict):
+        self.backend.create(task_id, data)
+
+    def get(self, task_id: str) -> Optional[dict]:
+        return self.backend.get(task_id)
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.backend.get(task_id) is not None
+
+    def mutate(self, task_id: str, fn: Callable[[dict], Optional[bool]]) -> Optional[dict]:
+        return self.backend.mutate(task_id, fn)
+
+    def update(self, task_id: str, **fields) -> bool:
+        """Actualiza campos de una tarea. Retorna False si la tarea ya no existe."""
+        return self.backend.mutate(task_id, lambda task: task.update(fields)) is not None
+
+    def transition(self, task_id: str, field: str, allowed: Iterable, **fields) -> bool:
+        """
+        Actualiza `fields` solo si `task[field]` está en `allowed` (p. ej. pasar
+        un artefacto de "pending" a "rendering" en un único worker).
+        """
+        allowed = tuple(allowed)
+
+        def apply(task: dict):
+            if task.get(field) not in allowed:
+                return False
+            task.update(fields)
+
+        return self.backend.mutate(task_id, apply) is not None
+
+    def delete(self, task_id: str) -> Optional[dict]:
+        return self.backend.delete(task_id)
+
+    def purge_expired(self, ttl_seconds: float) -> List[dict]:
+        return self.backend.purge_expired(ttl_seconds)
+
+    def count(self) -> int:
+        return self.backend.count()
+
+    # --- Desde el event loop ---
+
+    async def _offload(self, fn: Callable, *args, **kwargs):
+        """Ejecuta una operación en un hilo si el backend es compartido (SQLite)."""
+        if not self.shared:
+            return fn(*args, **kwargs)
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def acreate(self, task_id: str, data: dict):
+        await self._offload(self.create, task_id, data)
+
+    async def aget(self, task_id: str) -> Optional[dict]:
+        return await self._offload(self.get, task_id)
+
+    async def amutate(self, task_id: str, fn: Callable[[dict], Optional[bool]]) -> Optional[dict]:
+        return await self._offload(self.mutate, task_id, fn)
+
+    async def aupdate(self, task_id: str, **fields) -> bool:
+        return await self._offload(self.update, task_id, **fields)
+
+    async def atransition(self, task_id: str, field: str, allowed: Iterable, **fields) -> bool:
+        return await self._offload(self.transition, task_id, field, allowed, **fields)
+
+    async def adelete(self, task_id: str) -> Optional[dict]:
+        return await self._offload(self.delete, task_id)
+
+    async def acount(self) -> int:
+        return await self._offload(self.count)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.kind,
+            "shared": self.shared,
+            "tasks": self.count(),
+            "by_status": self.backend.count_by_status(),
+        }
+
+
+# Instancia compartida por todo el proceso
+task_store = TaskStore()
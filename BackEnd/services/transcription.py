@@ -3,32 +3,62 @@
 #
 # Objetivo: Garantizar la coherencia de pre-procesamiento (normalización) 
 # y la carga del modelo para igualar el rendimiento de la consola.
+#
+# El pre-procesamiento vive en audio_processing.py y la decodificación en
+# midi_decoding.py; aquí se re-exportan para mantener la interfaz del módulo.
 
 import os
 import numpy as np
 import keras
-import pretty_midi as pm
 import math
-from typing import Tuple, List
+from collections import deque
+from concurrent.futures import Future
+from typing import Tuple, Optional, Iterator, Callable, List
 
-# Importamos librosa y scipy para el procesamiento de audio
-import librosa
-import scipy.signal as signal 
+from services.audio_processing import (
+    N_MELS_FEATURE,
+    SR,
+    HOP_LENGTH,
+    N_FFT,
+    F_MIN,
+    F_MAX,
+    load_audio_mono,
+    aplicar_filtro_paso_bajo,
+    extract_mel_spectrogram,
+    extract_features,
+    extract_features_streaming,
+)
+from services.metrics import metrics
+from services.midi_decoding import (
+    N_KEYS,
+    LOW_MIDI,
+    decode_note_indices,
+    piano_roll_to_midi,
+    piano_roll_to_midi_loop,
+    notes_to_midi,
+    notes_from_indices,
+    piano_roll_to_notes,
+    IncrementalNoteDecoder,
+    write_midi_from_rolls,
+    write_midi_from_notes,
+    open_probabilities_for_write,
+    load_probabilities,
+    redecode_probabilities,
+)
 
 # --- Parámetros del Modelo ---
 SEQ_LEN = 100
-N_MELS_FEATURE = 128  # Base para el cálculo de Mel
 N_MELS_MODELO = 384   # 128 * 3 (Mel + Delta + Delta-Delta)
-N_KEYS = 88
-LOW_MIDI = 21
-SR = 22050
-HOP_LENGTH = 512
-N_FFT = 2048
-F_MIN = 25.0
-F_MAX = 6000.0
 
 # Parámetros para Chunking
 CHUNK_SIZE_FRAMES = 10000
+MAX_WINDOWS_PER_CHUNK = 2048  # (2048, 100, 88) float32 x 2 salidas ≈ 144MB por chunk
+# Ventanas por llamada al modelo cuando se empaquetan varios archivos
+PACKED_BATCH_SIZE = 256
+# Envío de ventanas al servidor de inferencia (services/inference_server.py):
+# bloques de este tamaño, con a lo sumo INFERENCE_MAX_INFLIGHT pendientes por tarea
+INFERENCE_BLOCK_SIZE = 64
+INFERENCE_MAX_INFLIGHT = 4
 pad_width = SEQ_LEN // 2
 
 # Umbrales de detección (Óptimos según tu último entrenamiento)
@@ -40,220 +70,442 @@ NOMBRE_MODELO_CAMPEON = "modelo.keras"
 MODELO_CAMPEON_PATH = os.path.join("modelos", NOMBRE_MODELO_CAMPEON)
 
 
-# --- Funciones de Preprocesamiento ---
-
-def load_audio_mono(audio_path: str, sr: int = SR) -> Tuple[np.ndarray, int]:
-    """Carga un archivo de audio en mono y normaliza el peak."""
-    y, sr_loaded = librosa.load(audio_path, sr=sr, mono=True)
-    peak = np.max(np.abs(y)) if y.size else 1.0
-    if peak > 0:
-        y = y / peak
-    return y.astype(np.float32), sr_loaded
-
+# --- Función de Predicción con Ventanas Deslizantes ---
 
-def aplicar_filtro_paso_bajo(y: np.ndarray, sr: int, corte_hz: int = 6000) -> np.ndarray:
+def predict_probabilities(
+    model: keras.Model,
+    input_features: np.ndarray,
+    stride: int = 1,
+    start: int = 0,
+    stop: Optional[int] = None,
+    progress: Optional[Callable[[float], None]] = None,
+    predict_fn: Optional[Callable[[np.ndarray], Future]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Aplica un filtro paso bajo a un array de audio en memoria.
-    (Basado en 1limpiarAudio.py - Consistencia con entrenamiento)
+    Calcula las probabilidades de onsets y frames con ventanas deslizantes
+    para los frames [start, stop) (por defecto, todos): (stop - start, 88).
+    `progress(fracción)` se llama al terminar cada batch del modelo.
+    
+    Si se indica `predict_fn(ventanas) -> Future`, el modelo no se llama aquí:
+    las ventanas se envían en bloques (p. ej. al servidor de inferencia, que
+    las agrupa con las de otras tareas) y `model` puede ser None. Los backends
+    de services/inference_backends.py también se usan por bloques, con
+    `predict_on_batch` y sin tf.data.
+    
+    Con stride=1 se genera una ventana por frame y se conserva solo su frame
+    central (índice 50), igual que en 6inferencia.py. Con stride > 1 cada ventana
+    aporta los `stride` frames centrales, de modo que el modelo se ejecuta
+    ~stride veces menos y el resultado se une sin huecos ni solapes.
+    
+    Las ventanas usan los frames vecinos reales como contexto (ceros solo fuera
+    del audio), así que calcular por rangos da lo mismo que de una sola vez
+    cuando `start` es múltiplo de `stride`.
     """
-    nyquist = sr * 0.5
-    frecuencia_normalizada = corte_hz / nyquist
+    if not 1 <= stride <= SEQ_LEN:
+        raise ValueError(f"El stride debe estar entre 1 y {SEQ_LEN} (recibido: {stride})")
+    
+    total_frames = input_features.shape[0]
+    stop = total_frames if stop is None else min(stop, total_frames)
+    n_out = stop - start
+    if n_out <= 0:
+        empty = np.zeros((0, N_KEYS), dtype=np.float32)
+        return empty, empty.copy()
     
-    # Crear filtro Butterworth (orden N=5)
-    b, a = signal.butter(
-        N=5,
-        Wn=frecuencia_normalizada,
-        btype='low',
-        analog=False
+    # 1. Posición dentro de la ventana donde empieza la región central que se conserva
+    #    (con stride=1 es exactamente pad_width)
+    keep_start = pad_width - stride // 2
+    n_windows = math.ceil(n_out / stride)
+    padded_len = (n_windows - 1) * stride + SEQ_LEN
+    
+    # 2. Segmento con contexto para que la región central de la primera ventana
+    #    caiga en `start` (padding de ceros fuera del audio)
+    lo = start - keep_start
+    src_lo, src_hi = max(lo, 0), min(lo + padded_len, total_frames)
+    X_padded = np.zeros((padded_len, input_features.shape[1]), dtype=input_features.dtype)
+    X_padded[src_lo - lo:src_hi - lo] = input_features[src_lo:src_hi]
+    
+    keep = slice(keep_start, keep_start + stride)
+    if predict_fn is None and model is not None and not isinstance(model, keras.Model):
+        predict_fn = lambda windows: _completed(model.predict_on_batch(windows))
+    if predict_fn is not None:
+        return _predict_blocks(X_padded, n_windows, n_out, stride, keep, predict_fn, progress)
+    
+    # 3. Crear el dataset de ventanas deslizantes usando Keras
+    dataset = keras.utils.timeseries_dataset_from_array(
+        data=X_padded,
+        targets=None,
+        sequence_length=SEQ_LEN,
+        sequence_stride=stride,
+        batch_size=64           # Ajusta según memoria disponible
     )
     
-    # Aplicar el filtro
-    audio_filtrado = signal.filtfilt(b, a, y)
-    return audio_filtrado.astype(np.float32)
+    # 4. Obtener predicciones, de forma (n_windows, 100, 88)
+    callbacks = []
+    if progress is not None:
+        n_batches = math.ceil(n_windows / 64)
+        callbacks.append(keras.callbacks.LambdaCallback(
+            on_predict_batch_end=lambda batch, logs: progress((batch + 1) / n_batches)
+        ))
+    P_onsets_full, P_frames_full = model.predict(dataset, verbose=0, callbacks=callbacks)
+    
+    # 5. Conservar la región central de cada ventana y unirlas en orden
+    P_onsets = P_onsets_full[:, keep, :].reshape(-1, N_KEYS)[:n_out]
+    P_frames = P_frames_full[:, keep, :].reshape(-1, N_KEYS)[:n_out]
+    
+    return P_onsets, P_frames
+
 
+def _completed(result) -> Future:
+    """Future ya resuelto (llamadas síncronas con la interfaz de predict_fn)."""
+    future = Future()
+    future.set_result(result)
+    return future
 
-def extract_mel_spectrogram(y: np.ndarray, sr: int) -> Tuple[np.ndarray, np.ndarray]:
+
+def _predict_blocks(
+    X_padded: np.ndarray,
+    n_windows: int,
+    n_out: int,
+    stride: int,
+    keep: slice,
+    predict_fn: Callable[[np.ndarray], Future],
+    progress: Optional[Callable[[float], None]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Calcula el Mel Spectrogram logarítmico (en dB) + Delta + Delta-Delta.
-    Exactamente como en el pipeline de entrenamiento.
+    Variante de predict_probabilities que envía las ventanas en bloques de
+    INFERENCE_BLOCK_SIZE a `predict_fn`. Mantiene hasta INFERENCE_MAX_INFLIGHT
+    bloques pendientes, para que el servidor pueda llenar sus batches sin que
+    una tarea encole todo su audio de golpe.
     """
-    # 1. Calcular el Mel Spectrogram (Potencia)
-    S = librosa.feature.melspectrogram(
-        y=y,
-        sr=sr,
-        n_fft=N_FFT,
-        hop_length=HOP_LENGTH,
-        n_mels=N_MELS_FEATURE,
-        fmin=F_MIN,
-        fmax=F_MAX
-    )
+    # (n_windows, SEQ_LEN, n_mels), las mismas ventanas que el dataset de Keras
+    windows = np.lib.stride_tricks.sliding_window_view(X_padded, SEQ_LEN, axis=0)[::stride]
+    windows = windows.transpose(0, 2, 1)
+    P_onsets = np.empty((n_windows * stride, N_KEYS), dtype=np.float32)
+    P_frames = np.empty((n_windows * stride, N_KEYS), dtype=np.float32)
     
-    # 2. Convertir a Decibelios
-    S_db = librosa.power_to_db(S, ref=np.max)
+    in_flight = deque()
     
-    # 3. Calcular Delta (Velocidad) y Delta-Delta (Aceleración)
-    S_delta = librosa.feature.delta(S_db)
-    S_delta2 = librosa.feature.delta(S_db, order=2)
+    def collect():
+        w0, future = in_flight.popleft()
+        P_onsets_block, P_frames_block = future.result()
+        w1 = w0 + len(P_onsets_block)
+        P_onsets[w0 * stride:w1 * stride] = P_onsets_block[:, keep, :].reshape(-1, N_KEYS)
+        P_frames[w0 * stride:w1 * stride] = P_frames_block[:, keep, :].reshape(-1, N_KEYS)
+        if progress is not None:
+            progress(w1 / n_windows)
     
-    # 4. Concatenar las 3 matrices
-    S_full = np.concatenate((S_db, S_delta, S_delta2), axis=0)
-
-    # 5. Transponer a (n_frames, 3 * n_mels) = (n_frames, 384)
-    X = S_full.T
-    
-    # 6. Generar los tiempos de frame
-    frame_times = librosa.frames_to_time(
-        np.arange(X.shape[0]), 
-        sr=sr, 
-        hop_length=HOP_LENGTH
-    )
+    for w0 in range(0, n_windows, INFERENCE_BLOCK_SIZE):
+        block = np.ascontiguousarray(windows[w0:w0 + INFERENCE_BLOCK_SIZE])
+        in_flight.append((w0, predict_fn(block)))
+        if len(in_flight) >= INFERENCE_MAX_INFLIGHT:
+            collect()
+    while in_flight:
+        collect()
     
-    # 7. Normalizar los datos
-    X = (X / 80.0) + 1.0 
-    
-    return X.astype(np.float32), frame_times
+    return P_onsets[:n_out], P_frames[:n_out]
 
 
-# --- Función de Predicción con Ventanas Deslizantes ---
+def chunk_bounds(
+    total_frames: int,
+    stride: int = 1,
+    chunk_frames: int = CHUNK_SIZE_FRAMES
+) -> Iterator[Tuple[int, int]]:
+    """
+    Rangos [start, stop) para la inferencia por chunks. El tamaño es múltiplo
+    del stride (mismas ventanas que sin chunks) y se limita a
+    MAX_WINDOWS_PER_CHUNK ventanas para acotar la memoria de las predicciones.
+    """
+    chunk = min(chunk_frames, MAX_WINDOWS_PER_CHUNK * stride)
+    chunk = max(stride, chunk - chunk % stride)
+    for start in range(0, total_frames, chunk):
+        yield start, min(start + chunk, total_frames)
+
+
+def iter_probability_chunks(
+    model: keras.Model,
+    input_features: np.ndarray,
+    stride: int = 1,
+    chunk_frames: int = CHUNK_SIZE_FRAMES,
+    progress: Optional[Callable[[float], None]] = None,
+    predict_fn: Optional[Callable[[np.ndarray], Future]] = None
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Genera (start, P_onsets, P_frames) chunk por chunk. `progress` recibe la
+    fracción de frames ya procesados del total (se actualiza por batch).
+    """
+    total_frames = input_features.shape[0]
+    for start, stop in chunk_bounds(total_frames, stride, chunk_frames):
+        chunk_progress = None
+        if progress is not None:
+            chunk_progress = lambda f, a=start, b=stop: progress((a + f * (b - a)) / total_frames)
+        P_onsets, P_frames = predict_probabilities(
+            model, input_features, stride, start, stop,
+            progress=chunk_progress, predict_fn=predict_fn
+        )
+        yield start, P_onsets, P_frames
+
 
 def run_inference_with_sliding_window(
     model: keras.Model,
-    input_features: np.ndarray
+    input_features: np.ndarray,
+    stride: int = 1,
+    probabilities_path: Optional[str] = None,
+    progress: Optional[Callable[[float], None]] = None,
+    predict_fn: Optional[Callable[[np.ndarray], Future]] = None
 ) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Realiza la inferencia usando ventanas deslizantes, igual que en 6inferencia.py.
+    Realiza la inferencia usando ventanas deslizantes, igual que en 6inferencia.py,
+    y aplica los umbrales de detección. Se procesa por chunks para que la memoria
+    de las predicciones no dependa de la duración del audio.
+    Si se indica `probabilities_path`, también guarda las probabilidades crudas
+    (float16) para poder re-decodificar con otros umbrales sin repetir la inferencia.
+    `progress(fracción)` informa el avance por batch del modelo y `predict_fn`
+    delega las llamadas al modelo (ver predict_probabilities).
     """
     total_frames = input_features.shape[0]
+    Y_onsets_binary = np.zeros((total_frames, N_KEYS), dtype=np.uint8)
+    Y_frames_binary = np.zeros((total_frames, N_KEYS), dtype=np.uint8)
     
-    # 1. Añadir padding al inicio y fin para centrar las ventanas
-    X_padded = np.pad(input_features, ((pad_width, pad_width), (0, 0)), 'constant')
-    
-    # 2. Crear el dataset de ventanas deslizantes usando Keras
-    dataset = keras.utils.timeseries_dataset_from_array(
-        data=X_padded,
-        targets=None,
-        sequence_length=SEQ_LEN,
-        sequence_stride=1,      # Una ventana por cada frame
-        batch_size=64           # Ajusta según memoria disponible
-    )
-    
-    # 3. Obtener predicciones
-    # La salida tendrá forma (total_frames + padding, 100, 88)
-    P_onsets_full, P_frames_full = model.predict(dataset, verbose=0)
+    probabilities = None
+    if probabilities_path:
+        probabilities = open_probabilities_for_write(probabilities_path, total_frames)
     
-    # 4. Extraer solo la predicción del frame central (índice 50)
-    P_onsets_all = P_onsets_full[:, pad_width, :]
-    P_frames_all = P_frames_full[:, pad_width, :]
-
-    # 5. Truncar predicciones al tamaño original de frames
-    P_onsets_flat = P_onsets_all[:total_frames]
-    P_frames_flat = P_frames_all[:total_frames]
+    for start, P_onsets, P_frames in iter_probability_chunks(
+        model, input_features, stride, progress=progress, predict_fn=predict_fn
+    ):
+        stop = start + len(P_onsets)
+        # Aplicar Umbrales
+        Y_onsets_binary[start:stop] = P_onsets > T_ONSETS
+        Y_frames_binary[start:stop] = P_frames > T_FRAMES
+        if probabilities is not None:
+            probabilities[0, start:stop] = P_onsets
+            probabilities[1, start:stop] = P_frames
     
-    # 6. Aplicar Umbrales
-    Y_onsets_binary = (P_onsets_flat > T_ONSETS).astype(np.uint8)
-    Y_frames_binary = (P_frames_flat > T_FRAMES).astype(np.uint8)
+    if probabilities is not None:
+        probabilities.flush()
+        del probabilities
     
     return Y_onsets_binary, Y_frames_binary
 
 
-# --- Decodificación a MIDI ---
-
-def piano_roll_to_midi(
-    P_onsets_binary: np.ndarray,
-    P_frames_binary: np.ndarray,
-    frame_times: np.ndarray
-) -> pm.PrettyMIDI:
+def run_packed_inference(
+    model: keras.Model,
+    features_list: List[np.ndarray],
+    stride: int = 1,
+    batch_size: int = PACKED_BATCH_SIZE,
+    probabilities_paths: Optional[List[Optional[str]]] = None
+) -> List[Tuple[np.ndarray, np.ndarray]]:
     """
-    Convierte los piano rolls binarios (Onsets y Frames) en un objeto PrettyMIDI.
-    Usa Onsets para INICIAR notas y Frames para SOSTENER/TERMINAR notas.
-    Exactamente como en 6inferencia.py
+    Inferencia de varios archivos a la vez: las ventanas deslizantes de todos
+    se empaquetan en batches grandes y compartidos (un clip corto ya no ocupa
+    un model.predict propio con batches a medio llenar), y las predicciones se
+    reparten de vuelta en los piano rolls de cada archivo.
+    
+    Las ventanas son las mismas que en predict_probabilities (mismo padding y
+    región central), así que cada archivo obtiene el mismo resultado que con
+    run_inference_with_sliding_window. Retorna [(Y_onsets, Y_frames), ...] en
+    el orden de `features_list`.
     """
-    n_frames, n_keys = P_frames_binary.shape
-    hop_duration_s = HOP_LENGTH / SR
+    if not 1 <= stride <= SEQ_LEN:
+        raise ValueError(f"El stride debe estar entre 1 y {SEQ_LEN} (recibido: {stride})")
     
-    pm_obj = pm.PrettyMIDI()
-    instrument = pm.Instrument(program=0, name="Piano (Transcripción)")
+    keep_start = pad_width - stride // 2
+    keep = slice(keep_start, keep_start + stride)
     
-    for k in range(n_keys):
-        pitch = LOW_MIDI + k
-        note_active = False
-        start_time = 0.0
+    # 1. Vistas de las ventanas de cada archivo (sin copiar) y su índice global
+    windows, outputs, index = [], [], []
+    for i, features in enumerate(features_list):
+        n_out = features.shape[0]
+        n_windows = math.ceil(n_out / stride)
+        padded_len = (n_windows - 1) * stride + SEQ_LEN
+        X_padded = np.zeros((padded_len, features.shape[1]), dtype=np.float32)
+        n_copy = min(n_out, padded_len - keep_start)
+        X_padded[keep_start:keep_start + n_copy] = features[:n_copy]
         
-        for frame_idx in range(n_frames):
-            frame_time = frame_times[frame_idx]
-            is_onset = P_onsets_binary[frame_idx, k] == 1
-            is_active = P_frames_binary[frame_idx, k] == 1
-            
-            # Caso 1: Inicia una nota (Hay onset y no hay nota activa)
-            if is_onset and not note_active:
-                note_active = True
-                start_time = frame_time
-            
-            # Caso 2: Termina una nota (No hay frame activo y SÍ había nota activa)
-            if not is_active and note_active:
-                note_active = False
-                end_time = frame_time
-                # Evitar notas de duración cero
-                if end_time > start_time:
-                    note = pm.Note(velocity=100, pitch=pitch, start=start_time, end=end_time)
-                    instrument.notes.append(note)
+        # (n_windows, SEQ_LEN, n_mels) con el mismo stride que el dataset de Keras
+        view = np.lib.stride_tricks.sliding_window_view(X_padded, SEQ_LEN, axis=0)[::stride]
+        windows.append(view.transpose(0, 2, 1))
+        outputs.append((
+            np.zeros((n_windows * stride, N_KEYS), dtype=np.float32),
+            np.zeros((n_windows * stride, N_KEYS), dtype=np.float32)
+        ))
+        index.extend((i, w) for w in range(n_windows))
+    
+    # 2. Batches compartidos: juntar ventanas de distintos archivos y repartir la salida
+    for batch_start in range(0, len(index), batch_size):
+        batch = index[batch_start:batch_start + batch_size]
+        X_batch = np.stack([windows[i][w] for i, w in batch])
+        P_onsets_full, P_frames_full = model.predict_on_batch(X_batch)
+        P_onsets_keep = np.asarray(P_onsets_full)[:, keep, :]
+        P_frames_keep = np.asarray(P_frames_full)[:, keep, :]
+        for j, (i, w) in enumerate(batch):
+            outputs[i][0][w * stride:(w + 1) * stride] = P_onsets_keep[j]
+            outputs[i][1][w * stride:(w + 1) * stride] = P_frames_keep[j]
+    
+    # 3. Recortar, aplicar umbrales y guardar las probabilidades de cada archivo
+    results = []
+    for i, features in enumerate(features_list):
+        n_out = features.shape[0]
+        P_onsets, P_frames = outputs[i][0][:n_out], outputs[i][1][:n_out]
+        path = probabilities_paths[i] if probabilities_paths else None
+        if path:
+            probabilities = open_probabilities_for_write(path, n_out)
+            probabilities[0] = P_onsets
+            probabilities[1] = P_frames
+            probabilities.flush()
+            del probabilities
+        results.append((
+            (P_onsets > T_ONSETS).astype(np.uint8),
+            (P_frames > T_FRAMES).astype(np.uint8)
+        ))
+    return results
 
-        # Caso 3: La nota estaba activa hasta el final del audio
-        if note_active:
-            end_time = frame_times[-1] + hop_duration_s
-            if end_time > start_time:
-                note = pm.Note(velocity=100, pitch=pitch, start=start_time, end=end_time)
-                instrument.notes.append(note)
-                
-    pm_obj.instruments.append(instrument)
-    return pm_obj
+
+def iter_streaming_notes(
+    model: keras.Model,
+    input_features: np.ndarray,
+    stride: int = 1,
+    chunk_frames: int = CHUNK_SIZE_FRAMES,
+    probabilities_path: Optional[str] = None,
+    progress: Optional[Callable[[float], None]] = None,
+    predict_fn: Optional[Callable[[np.ndarray], Future]] = None
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Inferencia y decodificación por chunks: genera las notas (keys, start_idx,
+    end_idx) a medida que terminan, sin guardar los piano rolls completos.
+    Con `probabilities_path` también guarda las probabilidades crudas, como
+    run_inference_with_sliding_window.
+    """
+    probabilities = None
+    if probabilities_path:
+        probabilities = open_probabilities_for_write(probabilities_path, input_features.shape[0])
+    
+    decoder = IncrementalNoteDecoder()
+    try:
+        for start, P_onsets, P_frames in iter_probability_chunks(
+            model, input_features, stride, chunk_frames, progress=progress, predict_fn=predict_fn
+        ):
+            if probabilities is not None:
+                probabilities[0, start:start + len(P_onsets)] = P_onsets
+                probabilities[1, start:start + len(P_frames)] = P_frames
+            yield decoder.feed(
+                (P_onsets > T_ONSETS).astype(np.uint8),
+                (P_frames > T_FRAMES).astype(np.uint8)
+            )
+        yield decoder.finish()
+    finally:
+        if probabilities is not None:
+            probabilities.flush()
+            del probabilities
+
+
+def run_streaming_inference(
+    model: keras.Model,
+    input_features: np.ndarray,
+    stride: int = 1,
+    probabilities_path: Optional[str] = None,
+    progress: Optional[Callable[[float], None]] = None,
+    predict_fn: Optional[Callable[[np.ndarray], Future]] = None,
+    chunk_frames: int = CHUNK_SIZE_FRAMES
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Variante de run_inference_with_sliding_window que decodifica cada chunk al
+    salir del modelo y retorna directamente las notas (keys, start_idx,
+    end_idx) para write_midi_from_notes: los piano rolls binarios nunca se
+    arman completos. Mismas notas que decodificar los rolls de una sola vez.
+    """
+    chunks = list(iter_streaming_notes(
+        model, input_features, stride, chunk_frames,
+        probabilities_path=probabilities_path, progress=progress, predict_fn=predict_fn
+    ))
+    keys, start_idx, end_idx = (np.concatenate(parts) for parts in zip(*chunks))
+    return keys, start_idx, end_idx
 
 
 # --- Función Principal de Transcripción (Síncrona) ---
 
 def transcribe_piano_audio(
     audio_path: str,
-    output_midi_path: str
+    output_midi_path: str,
+    model: Optional[keras.Model] = None,
+    stride: int = 1
 ) -> dict:
     """
     Transcribe un archivo de audio de piano a MIDI.
+    Si se pasa `model` (el del registro compartido) no se vuelve a cargar desde disco.
+    `stride` controla cuántos frames aporta cada ventana de inferencia (1 = modo original).
     """
     
-    if not os.path.exists(MODELO_CAMPEON_PATH):
+    if model is None and not os.path.exists(MODELO_CAMPEON_PATH):
         # NOTA: En la web, esto puede fallar si la ruta es relativa.
         raise FileNotFoundError(f"No se encontró el modelo en: {MODELO_CAMPEON_PATH}")
     
     try:
-        # 1. Cargar Audio
-        y_mono, sr_loaded = load_audio_mono(audio_path, sr=SR)
-        
-        # 2. Aplicar filtro paso bajo (para consistencia con entrenamiento)
-        y_filtrado = aplicar_filtro_paso_bajo(y_mono, sr_loaded, corte_hz=F_MAX)
-        
-        # 3. Extraer Características (Mel + Delta + Delta-Delta + NORMALIZADAS)
-        X_features, frame_times = extract_mel_spectrogram(y_filtrado, sr_loaded)
-        total_frames = X_features.shape[0]
+        # Etapas medidas (con METRICS_ENABLED) para el desglose del resultado
+        with metrics.collect() as stages:
+            # 1. Cargar Audio
+            with metrics.stage("load_audio"):
+                y_mono, sr_loaded = load_audio_mono(audio_path, sr=SR)
+            
+            # 2. Aplicar filtro paso bajo (para consistencia con entrenamiento)
+            with metrics.stage("lowpass_filter"):
+                y_filtrado = aplicar_filtro_paso_bajo(y_mono, sr_loaded, corte_hz=F_MAX)
+            
+            # 3. Extraer Características (Mel + Delta + Delta-Delta + NORMALIZADAS)
+            with metrics.stage("mel_features"):
+                X_features, frame_times = extract_mel_spectrogram(y_filtrado, sr_loaded)
+            
+            # 4. Cargar Modelo (solo si no viene del registro compartido)
+            if model is None:
+                with metrics.stage("model_load"):
+                    model = keras.models.load_model(MODELO_CAMPEON_PATH)
+            
+            # 5. Inferencia (usando ventanas deslizantes, como en 6inferencia.py)
+            with metrics.stage("inference"):
+                Y_onsets, Y_frames = run_inference_with_sliding_window(model, X_features, stride=stride)
+            
+            # 6. Decodificación a MIDI y guardado
+            result = write_midi_from_rolls(Y_onsets, Y_frames, frame_times, output_midi_path)
         
-        # 4. Cargar Modelo
-        model = keras.models.load_model(MODELO_CAMPEON_PATH)
+        if stages:
+            result["stages"] = metrics.breakdown(stages)
+        return result
         
-        # 5. Inferencia (usando ventanas deslizantes, como en 6inferencia.py)
-        Y_onsets, Y_frames = run_inference_with_sliding_window(model, X_features)
+    except Exception as e:
+        # En producción, usa logging.error(e)
+        raise Exception(f"Error en la transcripción: {str(e)}")
+
+
+def transcribe_piano_audio_streaming(
+    audio_path: str,
+    output_midi_path: str,
+    model: Optional[keras.Model] = None,
+    stride: int = 1
+) -> dict:
+    """
+    Versión por bloques de `transcribe_piano_audio` para grabaciones largas:
+    el audio se lee, filtra y convierte a Mel por bloques, y la inferencia y
+    la decodificación se hacen por chunks, emitiendo las notas a medida que
+    terminan. El resultado coincide con la versión completa (dentro de la
+    tolerancia numérica del remuestreo y el filtro por bloques).
+    """
+    
+    if model is None and not os.path.exists(MODELO_CAMPEON_PATH):
+        raise FileNotFoundError(f"No se encontró el modelo en: {MODELO_CAMPEON_PATH}")
+    
+    try:
+        # 1-3. Cargar, filtrar y extraer características por bloques
+        X_features, frame_times = extract_features_streaming(audio_path)
         
-        # 6. Decodificación a MIDI
-        midi_predicho = piano_roll_to_midi(Y_onsets, Y_frames, frame_times)
+        # 4. Cargar Modelo (solo si no viene del registro compartido)
+        if model is None:
+            model = keras.models.load_model(MODELO_CAMPEON_PATH)
         
-        # 7. Guardar MIDI
-        midi_predicho.write(output_midi_path)
+        # 5. Inferencia y decodificación por chunks
+        keys, start_idx, end_idx = run_streaming_inference(model, X_features, stride=stride)
         
-        return {
-            "success": True,
-            "midi_path": output_midi_path,
-            "total_frames": total_frames,
-            "duration_seconds": float(frame_times[-1]),
-            "total_notes": len(midi_predicho.instruments[0].notes)
-        }
+        # 6. Guardar MIDI
+        return write_midi_from_notes(keys, start_idx, end_idx, frame_times, output_midi_path)
         
     except Exception as e:
-        # En producción, usa logging.error(e)
-        raise Exception(f"Error en la transcripción: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error en la transcripción: {str(e)}")
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# services/wav_io.py
+#
+# Lectura nativa de WAV sin pasar por audioread/soundfile.
+# librosa.load(sr=22050) genera varias copias del audio completo en float
+# (lectura, mezcla a mono, remuestreo, normalización y astype). Como solo
+# aceptamos .wav, `load_wav_mono` mapea en memoria los datos PCM y:
+#   1. Convierte y mezcla a mono por bloques, escribiendo directamente en un
+#      único array float32 (las páginas ya leídas del archivo se liberan).
+#   2. Remuestrea con un filtro polifásico racional (resample_poly,
+#      p. ej. 44100 -> 22050 es 1/2).
+#   3. Normaliza el peak en el mismo array.
+# También lo usa el decodificador incremental de la ingesta en paralelo
+# (services/ingest.py) para interpretar el chunk "fmt " y las muestras.
+
+import math
+import mmap
+import os
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+import scipy.signal as signal
+
+# Formatos de muestra del chunk "fmt "
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Escala de los enteros a [-1, 1) (24 bits se arma en los bytes altos de un int32)
+PCM_SCALE = {8: 2.0 ** -7, 16: 2.0 ** -15, 24: 2.0 ** -31, 32: 2.0 ** -31}
+
+# Frames convertidos a mono por bloque (acota los temporales a unos pocos MB)
+WAV_BLOCK_FRAMES = 2 ** 18
+
+
+class WavFormatError(ValueError):
+    """WAV que el lector nativo no soporta (se usa la ruta de librosa/soundfile)."""
+
+
+def parse_fmt_chunk(fmt: bytes) -> Tuple[int, int, int, int]:
+    """Retorna (formato, canales, tasa de muestreo, bits) de un chunk "fmt " soportado."""
+    if len(fmt) < 16:
+        raise WavFormatError("Chunk fmt incompleto")
+    format_tag, channels, samplerate = struct.unpack("<HHI", fmt[:8])
+    bits = struct.unpack("<H", fmt[14:16])[0]
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # Los dos primeros bytes del GUID del subformato son el formato real
+        format_tag = struct.unpack("<H", fmt[24:26])[0]
+    supported = (
+        (format_tag == WAVE_FORMAT_PCM and bits in (8, 16, 24, 32))
+        or (format_tag == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64))
+    )
+    if not supported or channels < 1 or not samplerate:
+        raise WavFormatError(
+            f"Formato WAV no soportado por el lector nativo "
+            f"(formato {format_tag}, {bits} bits, {channels} canales)"
+        )
+    return format_tag, channels, samplerate, bits
+
+
+def pcm_dtype(format_tag: int, bits: int) -> np.dtype:
+    """Tipo de numpy de una muestra (24 bits se lee como 3 bytes sueltos)."""
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        return np.dtype("<f4" if bits == 32 else "<f8")
+    return np.dtype({8: "u1", 16: "<i2", 24: "u1", 32: "<i4"}[bits])
+
+
+def pcm_to_mono(
+    samples: np.ndarray,
+    format_tag: int,
+    bits: int,
+    channels: int,
+    out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Frames PCM crudos (n_frames * canales muestras de `pcm_dtype`) -> mono float32.
+    Da exactamente lo mismo que leer con soundfile en float32 (entero / 2^(bits-1),
+    8 bits sin signo centrado) y promediar los canales como librosa.to_mono,
+    pero sin el array intermedio (n_frames, canales) en float32: cada canal se
+    convierte y se suma sobre `out` (escalar por una potencia de 2 es exacto).
+    """
+    if format_tag != WAVE_FORMAT_IEEE_FLOAT and bits == 24:
+        b = samples.reshape(-1, 3).astype(np.int32)
+        samples = (b[:, 0] << 8) | (b[:, 1] << 16) | (b[:, 2] << 24)
+    frames = samples.reshape(-1, channels)
+    if out is None:
+        out = np.empty(len(frames), dtype=np.float32)
+
+    column = np.empty_like(out) if channels > 1 else None
+    for c in range(channels):
+        target = out if c == 0 else column
+        np.copyto(target, frames[:, c], casting="unsafe")
+        if format_tag != WAVE_FORMAT_IEEE_FLOAT and bits == 8:
+            target -= 128
+        if c:
+            out += column
+    if channels > 1:
+        out /= channels
+    if format_tag != WAVE_FORMAT_IEEE_FLOAT:
+        out *= np.float32(PCM_SCALE[bits])
+    return out
+
+
+class WavInfo:
+    """Formato y ubicación de los datos PCM de un WAV."""
+
+    __slots__ = ("format_tag", "channels", "samplerate", "bits", "data_offset", "n_frames")
+
+    def __init__(self, format_tag: int, channels: int, samplerate: int, bits: int,
+                 data_offset: int, n_frames: int):
+        self.format_tag = format_tag
+        self.channels = channels
+        self.samplerate = samplerate
+        self.bits = bits
+        self.data_offset = data_offset
+        self.n_frames = n_frames
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.channels * self.bits // 8
+
+
+def read_wav_info(audio_path: str) -> WavInfo:
+    """Lee la cabecera (RIFF o RF64) y localiza el chunk de datos."""
+    file_size = os.path.getsize(audio_path)
+    fmt = None
+    ds64_data_size = None
+    with open(audio_path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] not in (b"RIFF", b"RF64") or header[8:12] != b"WAVE":
+            raise WavFormatError("Cabecera RIFF/WAVE no encontrada")
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise WavFormatError("El WAV no tiene chunk de datos")
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"fmt ":
+                fmt = parse_fmt_chunk(f.read(size))
+                f.seek(size & 1, os.SEEK_CUR)
+            elif chunk_id == b"ds64":
+                # RF64: el tamaño real de los datos (64 bits) va después del tamaño RIFF
+                ds64 = f.read(size)
+                if len(ds64) >= 16:
+                    ds64_data_size = struct.unpack("<Q", ds64[8:16])[0]
+                f.seek(size & 1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise WavFormatError("Chunk de datos antes del formato")
+                data_offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+
+    available = file_size - data_offset
+    if size == 0xFFFFFFFF and ds64_data_size is not None:
+        size = ds64_data_size
+    elif size in (0, 0xFFFFFFFF):
+        # Escritura en vivo sin cerrar: los datos llegan hasta el final del archivo
+        size = available
+    format_tag, channels, samplerate, bits = fmt
+    # Un archivo truncado se lee hasta el último frame completo
+    n_frames = min(size, available) // (channels * bits // 8)
+    return WavInfo(format_tag, channels, samplerate, bits, data_offset, n_frames)
+
+
+def load_wav_mono(audio_path: str, sr: int) -> Tuple[np.ndarray, int]:
+    """
+    Equivalente rápido de load_audio_mono para WAV PCM/float: mono float32 a
+    `sr` con el peak normalizado. Lanza WavFormatError si el formato no se
+    soporta. El remuestreo usa resample_poly en lugar de soxr, así que las
+    muestras difieren levemente (ver benchmarks/bench_wav_loader.py).
+    """
+    info = read_wav_info(audio_path)
+    mono = np.empty(info.n_frames, dtype=np.float32)
+    if info.n_frames:
+        _read_mono(audio_path, info, mono)
+
+    y = mono
+    if info.samplerate != sr and len(mono):
+        g = math.gcd(sr, info.samplerate)
+        y = signal.resample_poly(mono, sr // g, info.samplerate // g)
+        del mono
+
+    peak = float(np.max(np.abs(y))) if y.size else 0.0
+    if peak > 0:
+        y /= np.float32(peak)
+    return y, sr
+
+
+def _read_mono(audio_path: str, info: WavInfo, out: np.ndarray):
+    """Convierte los datos mapeados a mono en `out`, liberando cada bloque ya leído."""
+    dtype = pcm_dtype(info.format_tag, info.bits)
+    samples_per_frame = info.frame_bytes // dtype.itemsize
+    # mmap exige un offset alineado a la granularidad de asignación
+    start = info.data_offset - info.data_offset % mmap.ALLOCATIONGRANULARITY
+    skip = info.data_offset - start
+    length = skip + info.n_frames * info.frame_bytes
+    with open(audio_path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=start)
+    try:
+        data = np.frombuffer(mm, dtype=dtype, count=info.n_frames * samples_per_frame, offset=skip)
+        released = 0
+        for a in range(0, info.n_frames, WAV_BLOCK_FRAMES):
+            b = min(a + WAV_BLOCK_FRAMES, info.n_frames)
+            pcm_to_mono(
+                data[a * samples_per_frame:b * samples_per_frame],
+                info.format_tag, info.bits, info.channels, out=out[a:b]
+            )
+            # Soltar las páginas ya convertidas para que no cuenten en la memoria del proceso
+            done = (skip + b * info.frame_bytes) // mmap.PAGESIZE * mmap.PAGESIZE
+            if hasattr(mm, "madvise") and done > released:
+                mm.madvise(mmap.MADV_DONTNEED, released, done - released)
+                released = done
+        del data
+    finally:
+        mm.close()
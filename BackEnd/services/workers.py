@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# services/workers.py
+#
+# Capa de ejecución para el trabajo pesado de las transcripciones, fuera del
+# event loop de FastAPI:
+#   - Un pool de procesos para extracción de características, decodificación y PDF.
+#   - Un único worker de inferencia (hilo) dueño del modelo compartido.
+#   - Control de admisión: máximo de transcripciones en ejecución y en cola.
+#   - Reenvío del progreso de los workers al event loop (para SSE).
+#   - Las etapas medidas dentro del pool (services/metrics.py) vuelven con el
+#     resultado y se registran en el proceso principal.
+
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from services.metrics import metrics
+
+# Cola de progreso dentro de cada proceso del pool (la asigna el initializer)
+_worker_progress_queue = None
+
+
+def _init_cpu_worker(progress_queue, metrics_enabled: bool = False, metrics_interval: float = 0.01):
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+    metrics.start(metrics_enabled, metrics_interval)
+
+
+def _call_in_worker(fn: Callable, args: tuple, progress_task: Optional[str] = None):
+    """
+    Ejecuta `fn(*args)` en un worker y retorna (resultado, etapas medidas).
+    Con `progress_task`, `fn` recibe `progress=...` y su progreso se reenvía.
+    """
+    with metrics.collect(publish=False) as records:
+        if progress_task is None:
+            result = fn(*args)
+        else:
+            def progress(fraction: float, step: Optional[str] = None):
+                _worker_progress_queue.put((progress_task, fraction, step))
+            result = fn(*args, progress=progress)
+    return result, records
+
+
+class QueueFullError(Exception):
+    """No hay lugar en la cola de transcripciones."""
+
+
+class WorkerPool:
+    """
+    Ejecutores compartidos por todas las tareas de transcripción.
+    Las funciones enviadas al pool de procesos deben ser funciones de módulo
+    (serializables con pickle) que no importen Keras.
+    """
+
+    def __init__(self):
+        self._cpu_executor: Optional[ProcessPoolExecutor] = None
+        self._inference_executor: Optional[ThreadPoolExecutor] = None
+        self._ingest_executor: Optional[ThreadPoolExecutor] = None
+        self._running_slots: Optional[asyncio.Semaphore] = None
+        self.cpu_workers = 2
+        self.max_concurrent = 2
+        self.max_queued = 8
+        self.inference_threads = 1
+        self.admitted = 0
+        self.running = 0
+        # Recibe (task_id, fracción, paso) en el event loop
+        self.progress_listener: Optional[Callable[[str, float, Optional[str]], None]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._progress_queue = None
+
+    def start(self, cpu_workers: int, max_concurrent: int, max_queued: int, inference_threads: int = 1):
+        """
+        Crea los ejecutores. Se llama desde el lifespan de la aplicación.
+        Con el servidor de inferencia activo conviene un hilo de inferencia por
+        transcripción simultánea: los hilos solo preparan ventanas y esperan
+        resultados, y el modelo se ejecuta en el hilo del servidor.
+        """
+        self.inference_threads = max(1, inference_threads)
+        self.cpu_workers = max(1, cpu_workers)
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max(0, max_queued)
+        self._running_slots = asyncio.Semaphore(self.max_concurrent)
+        self._loop = asyncio.get_running_loop()
+
+        # "spawn" evita heredar el estado de TensorFlow del proceso principal
+        context = multiprocessing.get_context("spawn")
+        self._progress_queue = context.Queue()
+        threading.Thread(
+            target=self._drain_progress, args=(self._progress_queue,),
+            name="progreso", daemon=True
+        ).start()
+        self._cpu_executor = ProcessPoolExecutor(
+            max_workers=self.cpu_workers,
+            mp_context=context,
+            initializer=_init_cpu_worker,
+            initargs=(self._progress_queue, metrics.enabled, metrics.sampler.interval)
+        )
+        self._inference_executor = ThreadPoolExecutor(
+            max_workers=self.inference_threads, thread_name_prefix="inferencia"
+        )
+        # Características calculadas mientras llega la subida (services/ingest.py)
+        self._ingest_executor = ThreadPoolExecutor(max_workers=self.cpu_workers, thread_name_prefix="ingesta")
+        print(f"⚙️  Workers iniciados: {self.cpu_workers} procesos, "
+              f"{self.max_concurrent} transcripciones simultáneas, cola de {self.max_queued}")
+
+    def shutdown(self):
+        """Detiene los ejecutores sin esperar trabajos pendientes."""
+        for executor in (self._cpu_executor, self._inference_executor, self._ingest_executor):
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._cpu_executor = None
+        self._inference_executor = None
+        self._ingest_executor = None
+        if self._progress_queue is not None:
+            self._progress_queue.put(None)
+            self._progress_queue = None
+
+    def _ensure_started(self):
+        if self._cpu_executor is None:
+            self.start(self.cpu_workers, self.max_concurrent, self.max_queued, self.inference_threads)
+
+    # --- Control de admisión ---
+
+    @property
+    def capacity(self) -> int:
+        return self.max_concurrent + self.max_queued
+
+    def admit(self):
+        """
+        Reserva un lugar para una nueva transcripción.
+        Lanza QueueFullError si ya hay demasiadas en ejecución o en cola.
+        """
+        if self.admitted >= self.capacity:
+            raise QueueFullError(
+                f"Hay {self.admitted} transcripciones en proceso; intenta de nuevo más tarde"
+            )
+        self.admitted += 1
+
+    def release(self):
+        """Libera el lugar reservado con admit()."""
+        self.admitted = max(0, self.admitted - 1)
+
+    @asynccontextmanager
+    async def running_slot(self):
+        """Espera un lugar de ejecución (las demás tareas admitidas quedan en cola)."""
+        self._ensure_started()
+        async with self._running_slots:
+            self.running += 1
+            try:
+                yield
+            finally:
+                self.running -= 1
+
+    # --- Progreso ---
+
+    def _drain_progress(self, progress_queue):
+        """Hilo que pasa el progreso de los procesos del pool al event loop."""
+        while True:
+            item = progress_queue.get()
+            if item is None:
+                break
+            self.publish_progress(*item)
+
+    def publish_progress(self, task_id: str, fraction: float, step: Optional[str] = None):
+        """Entrega el progreso de una tarea al listener. Se puede llamar desde cualquier hilo."""
+        if self.progress_listener is None or self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self.progress_listener, task_id, fraction, step)
+        except RuntimeError:
+            # El event loop ya se cerró (apagado del servidor)
+            pass
+
+    # --- Ejecución ---
+
+    async def run_cpu(self, fn: Callable, *args, progress_task: Optional[str] = None,
+                      metrics_task: Optional[str] = None):
+        """
+        Ejecuta `fn(*args)` en el pool de procesos. Con `progress_task`, `fn`
+        recibe un argumento `progress(fracción, paso)` que se reenvía al listener.
+        Las etapas medidas dentro de `fn` se asocian a `metrics_task` (o a `progress_task`).
+        """
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        result, records = await loop.run_in_executor(
+            self._cpu_executor, _call_in_worker, fn, args, progress_task
+        )
+        if records:
+            metrics.merge(records, metrics_task or progress_task)
+        return result
+
+    async def run_inference(self, fn: Callable, *args):
+        """Ejecuta `fn(*args)` en el worker de inferencia."""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._inference_executor, fn, *args)
+
+    async def run_ingest(self, fn: Callable, *args):
+        """
+        Ejecuta `fn(*args)` en un hilo de ingesta. Se usa para procesar el audio
+        de una subida en curso, cuyo estado (el extractor) vive en este proceso.
+        """
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._ingest_executor, fn, *args)
+
+    def stats(self) -> dict:
+        return {
+            "cpu_workers": self.cpu_workers,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "inference_threads": self.inference_threads,
+            "running": self.running,
+            "queued": max(0, self.admitted - self.running),
+        }
+
+
+# Instancia compartida por todo el proceso
+worker_pool = WorkerPool()
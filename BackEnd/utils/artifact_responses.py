@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# utils/artifact_responses.py
+#
+# Respuestas de descarga de los artefactos de una tarea (MIDI, PDF, MusicXML)
+# con validación por caché y rangos:
+#   - ETag y Last-Modified; If-None-Match / If-Modified-Since -> 304.
+#   - Range de un solo intervalo (bytes=a-b, bytes=a-, bytes=-n) -> 206, con
+#     If-Range; un rango imposible -> 416. Varios intervalos se ignoran (200).
+# El contenido sale de memoria o se lee del disco por bloques. `iter_zip`
+# arma un ZIP a medida que se envía (sin archivo temporal ni el ZIP completo
+# en memoria), para la descarga combinada.
+
+import io
+import time
+import zipfile
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterable, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from services.artifacts import StoredArtifact
+
+# Bytes por lectura al enviar un archivo desde el disco
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Formatos ya comprimidos: se guardan sin comprimir dentro del ZIP
+STORED_EXTENSIONS = (".pdf", ".zip", ".png")
+
+
+def content_disposition(filename: str) -> str:
+    """Cabecera de descarga; los nombres no ASCII van codificados (RFC 5987)."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Intervalo (inicio, fin inclusive) de una cabecera Range de un solo rango.
+    Retorna None si no aplica (se responde completo) y lanza ValueError si
+    el rango no se puede satisfacer.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = (part.strip() for part in spec.partition("-"))
+    if not sep or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None  # Cabecera mal formada: se ignora
+    if not first:
+        # Sufijo: los últimos n bytes
+        if int(last) == 0:
+            raise ValueError("Rango vacío")
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Rango fuera del archivo")
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _not_modified(request: Request, artifact: StoredArtifact) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or artifact.etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(artifact.modified_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range_applies(request: Request, artifact: StoredArtifact) -> bool:
+    """If-Range: el rango solo vale si el cliente tiene la misma versión."""
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == artifact.etag
+    try:
+        # Con una fecha la coincidencia debe ser exacta (RFC 9110 §13.1.5)
+        return int(artifact.modified_at) == int(parsedate_to_datetime(if_range).timestamp())
+    except (TypeError, ValueError):
+        return False
+
+
+def _iter_file(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def artifact_response(request: Request, artifact: StoredArtifact, media_type: str, filename: str) -> Response:
+    """Respuesta de descarga con ETag/Last-Modified, 304 y rangos."""
+    headers = {
+        "ETag": artifact.etag,
+        "Last-Modified": formatdate(artifact.modified_at, usegmt=True),
+        "Accept-Ranges": "bytes",
+        # El MIDI cambia en la misma URL al re-decodificar: revalidar siempre
+        "Cache-Control": "private, no-cache",
+    }
+    if _not_modified(request, artifact):
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Disposition"] = content_disposition(filename)
+    start, end, status_code = 0, artifact.size - 1, 200
+    range_header = request.headers.get("range")
+    if range_header and artifact.size and _range_applies(request, artifact):
+        try:
+            interval = parse_range(range_header, artifact.size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{artifact.size}"})
+        if interval is not None:
+            start, end = interval
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{artifact.size}"
+
+    length = end - start + 1
+    if artifact.data is not None:
+        return Response(
+            content=artifact.data[start:end + 1], status_code=status_code, media_type=media_type, headers=headers
+        )
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(
+        _iter_file(artifact.path, start, length), status_code=status_code, media_type=media_type, headers=headers
+    )
+
+
+class _ZipChunks(io.RawIOBase):
+    """Destino de ZipFile que acumula lo escrito hasta que se envía (no admite seek)."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def iter_zip(members: Iterable[Tuple[str, StoredArtifact]]) -> Iterator[bytes]:
+    """
+    ZIP con los artefactos `(nombre, artefacto)`, emitido por partes. Sin
+    seek, zipfile escribe el tamaño de cada archivo en un descriptor al final.
+    """
+    sink = _ZipChunks()
+    with zipfile.ZipFile(sink, mode="w") as zf:
+        for name, artifact in members:
+            info = zipfile.ZipInfo(name, date_time=_zip_date(artifact.modified_at))
+            info.compress_type = (
+                zipfile.ZIP_STORED if name.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+            )
+            if artifact.data is not None:
+                zf.writestr(info, artifact.data)
+            else:
+                with zf.open(info, mode="w") as dest:
+                    for chunk in _iter_file(artifact.path, 0, artifact.size):
+                        dest.write(chunk)
+                        yield from _pending(sink)
+            yield from _pending(sink)
+    # Directorio central, escrito al cerrar
+    yield from _pending(sink)
+
+
+def _pending(sink: _ZipChunks) -> Iterator[bytes]:
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def _zip_date(timestamp: float) -> tuple:
+    # ZIP no admite fechas anteriores a 1980
+    return time.localtime(max(timestamp, 315532800))[:6]
@@ -1,22 +1,160 @@
 import os
+import uuid
+import hashlib
+import zipfile
 from pathlib import Path
-from typing import List
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
 import shutil
+import aiofiles
 from config import settings
 
-async def save_uploaded_file(file, temp_dir: str = None) -> str:
-    """Guarda el archivo subido en una ubicación temporal"""
+# Bytes por lectura/escritura al guardar una subida
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Bytes necesarios para validar la cabecera RIFF/WAVE
+WAV_HEADER_SIZE = 12
+
+
+class UploadError(ValueError):
+    """Subida rechazada; `status_code` es el código HTTP que corresponde."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def client_filename(filename: Optional[str]) -> str:
+    """
+    Nombre del archivo según el cliente, sin directorios. Solo se usa para
+    mostrarlo (títulos, Content-Disposition): las rutas del servidor nunca
+    se arman con él.
+    """
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    if not name or name in (".", "..") or "/" in name or "\x00" in name:
+        raise UploadError("Nombre de archivo no válido")
+    return name
+
+
+def validate_wav_header(header: bytes):
+    """Lanza UploadError si los primeros bytes no son una cabecera RIFF/WAVE."""
+    if len(header) < WAV_HEADER_SIZE or header[:4] not in (b"RIFF", b"RF64") or header[8:12] != b"WAVE":
+        raise UploadError("El archivo no es un WAV válido (cabecera RIFF/WAVE no encontrada)", status_code=415)
+
+
+def size_limit_error(max_size: int) -> UploadError:
+    return UploadError(f"Archivo demasiado grande. Tamaño máximo: {max_size // (1024 * 1024)}MB", status_code=413)
+
+
+async def save_uploaded_file(
+    file,
+    temp_dir: str = None,
+    filename: str = None,
+    max_size: int = None,
+    validate_wav: bool = False
+) -> Tuple[str, str]:
+    """
+    Guarda el archivo subido en `temp_dir` como `filename` (por defecto, un
+    nombre único: dos subidas con el mismo nombre no se pisan).
+    Retorna la ruta y el hash SHA-256 del contenido, calculado mientras se guarda.
+    
+    Se copia por bloques de UPLOAD_CHUNK_SIZE con escrituras asíncronas
+    (aiofiles) y se corta apenas se supera `max_size` (MAX_FILE_SIZE por
+    defecto) o, con `validate_wav`, si los primeros bytes no son RIFF/WAVE.
+    Mientras se escribe el archivo se llama <nombre>.part; si algo falla se
+    elimina, así que nunca queda un archivo a medias con el nombre final.
+    """
     temp_dir = temp_dir or settings.UPLOAD_FOLDER
-    Path(temp_dir).mkdir(exist_ok=True)
+    max_size = max_size or settings.MAX_FILE_SIZE
+    Path(temp_dir).mkdir(exist_ok=True, parents=True)
     
-    file_path = os.path.join(temp_dir, file.filename)
+    # Starlette conoce el tamaño de la parte multipart: rechazar sin copiar nada
+    if getattr(file, "size", None) and file.size > max_size:
+        raise size_limit_error(max_size)
     
-    # Guardar el archivo en chunks
-    with open(file_path, 'wb') as buffer:
-        while content := await file.read(1024):
-            buffer.write(content)
+    # basename: el nombre del cliente nunca debe poder salir de temp_dir
+    name = filename or f"{uuid.uuid4().hex}_{os.path.basename(file.filename or 'audio')}"
+    file_path = os.path.join(temp_dir, name)
     
-    return file_path
+    async def read_chunks():
+        while content := await file.read(UPLOAD_CHUNK_SIZE):
+            yield content
+    
+    digest = await write_upload_stream(read_chunks(), file_path, max_size, validate_wav)
+    return file_path, digest
+
+
+async def write_upload_stream(
+    chunks: AsyncIterator[bytes],
+    file_path: str,
+    max_size: int = None,
+    validate_wav: bool = False,
+    on_chunk: Optional[Callable[[bytes], Awaitable[None]]] = None
+) -> str:
+    """
+    Escribe los bloques de una subida en `file_path` y retorna su SHA-256.
+    Corta apenas se supera `max_size` o, con `validate_wav`, si los primeros
+    bytes no son RIFF/WAVE. `on_chunk(bloque)` recibe cada bloque ya validado
+    (p. ej. para procesar el audio mientras sigue llegando).
+    """
+    max_size = max_size or settings.MAX_FILE_SIZE
+    part_path = file_path + ".part"
+    digest = hashlib.sha256()
+    size = 0
+    header = b""
+    
+    try:
+        async with aiofiles.open(part_path, "wb") as buffer:
+            async for content in chunks:
+                size += len(content)
+                if size > max_size:
+                    raise size_limit_error(max_size)
+                if validate_wav and len(header) < WAV_HEADER_SIZE:
+                    header += content[:WAV_HEADER_SIZE - len(header)]
+                    if len(header) >= WAV_HEADER_SIZE:
+                        validate_wav_header(header)
+                await buffer.write(content)
+                digest.update(content)
+                if on_chunk is not None:
+                    await on_chunk(content)
+        if validate_wav and len(header) < WAV_HEADER_SIZE:
+            validate_wav_header(header)
+        os.replace(part_path, file_path)
+    except BaseException:
+        cleanup_files([part_path])
+        raise
+    
+    return digest.hexdigest()
+
+def extract_wavs_from_zip(
+    zip_path: str,
+    target_dir: str,
+    first_index: int = 0,
+    max_files: int = None
+) -> List[Tuple[str, str, str]]:
+    """
+    Extrae los WAV de un ZIP (ignora carpetas y otros archivos).
+    Retorna [(nombre original, ruta extraída, hash SHA-256), ...].
+    Lanza ValueError si un WAV supera MAX_FILE_SIZE o hay más de `max_files`.
+    """
+    entries = []
+    with zipfile.ZipFile(zip_path) as archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name.lower().endswith(".wav") or info.filename.startswith("__MACOSX"):
+                continue
+            if info.file_size > settings.MAX_FILE_SIZE:
+                raise ValueError(f"{name} supera el tamaño máximo de {settings.MAX_FILE_SIZE // (1024 * 1024)}MB")
+            if max_files is not None and first_index + len(entries) >= max_files:
+                raise ValueError(f"El lote supera el máximo de {max_files} archivos")
+            
+            # Prefijo con el índice: nombres repetidos en distintas carpetas del ZIP
+            file_path = os.path.join(target_dir, f"{first_index + len(entries):03d}_{name}")
+            digest = hashlib.sha256()
+            with archive.open(info) as source, open(file_path, "wb") as target:
+                while chunk := source.read(1024 * 1024):
+                    target.write(chunk)
+                    digest.update(chunk)
+            entries.append((name, file_path, digest.hexdigest()))
+    return entries
 
 def cleanup_files(file_paths: List[str]):
     """Elimina archivos temporales"""
@@ -10,7 +10,8 @@ const PianoTranscription = () => {
   const [status, setStatus] = useState('idle'); // idle, uploading, processing, completed, error
   const [message, setMessage] = useState('');
   const [error, setError] = useState(null);
-  const [setTranscriptionInfo] = useState(null);
+  const [, setTranscriptionInfo] = useState(null);
+  const [progress, setProgress] = useState(0);
   const [hasPdf, setHasPdf] = useState(false);
   const [acceptTerms, setAcceptTerms] = useState(false);
   
@@ -48,6 +49,7 @@ const PianoTranscription = () => {
     setStatus('uploading');
     setMessage('Subiendo archivo...');
     setError(null);
+    setProgress(0);
 
     try {
       // 1. Subir archivo e iniciar transcripción
@@ -69,8 +71,8 @@ const PianoTranscription = () => {
       setStatus('processing');
       setMessage('Transcripción en proceso...');
 
-      // 2. Iniciar polling para verificar el estado
-      startPolling(data.task_id);
+      // 2. Seguir el progreso (eventos del servidor, con polling como respaldo)
+      followProgress(data.task_id);
 
     } catch (err) {
       setStatus('error');
@@ -79,23 +81,59 @@ const PianoTranscription = () => {
     }
   };
 
-  // Polling para verificar el estado
+  // Aplica un estado recibido del servidor; retorna true si la tarea terminó
+  const handleStatus = (data) => {
+    setMessage(data.message);
+    setProgress(data.progress || 0);
+    setHasPdf(data.has_pdf);
+
+    if (data.status === 'completed') {
+      setStatus('completed');
+      setTranscriptionInfo(data.transcription_info);
+      return true;
+    }
+    if (data.status === 'failed') {
+      setStatus('error');
+      setError(data.error);
+      return true;
+    }
+    return false;
+  };
+
+  // Progreso en tiempo real con Server-Sent Events
+  const followProgress = (taskId) => {
+    if (typeof EventSource === 'undefined') {
+      startPolling(taskId);
+      return;
+    }
+
+    const source = new EventSource(`${API_BASE_URL}/transcribe/events/${taskId}`);
+    let finished = false;
+
+    source.onmessage = (event) => {
+      finished = handleStatus(JSON.parse(event.data));
+      if (finished) {
+        source.close();
+      }
+    };
+
+    source.onerror = () => {
+      // Si se pierde la conexión antes de terminar, seguir con polling
+      source.close();
+      if (!finished) {
+        startPolling(taskId);
+      }
+    };
+  };
+
+  // Polling para verificar el estado (respaldo si no hay eventos del servidor)
   const startPolling = (taskId) => {
     const interval = setInterval(async () => {
       try {
         const response = await fetch(`${API_BASE_URL}/transcribe/status/${taskId}`);
         const data = await response.json();
 
-        setMessage(data.message);
-        setHasPdf(data.has_pdf);
-
-        if (data.status === 'completed') {
-          setStatus('completed');
-          setTranscriptionInfo(data.transcription_info);
-          clearInterval(interval);
-        } else if (data.status === 'failed') {
-          setStatus('error');
-          setError(data.error);
+        if (handleStatus(data)) {
           clearInterval(interval);
         }
       } catch (err) {
@@ -119,6 +157,7 @@ const PianoTranscription = () => {
     setMessage('');
     setError(null);
     setTranscriptionInfo(null);
+    setProgress(0);
     setHasPdf(false);
     setAcceptTerms(false);
   };
@@ -241,6 +280,18 @@ const PianoTranscription = () => {
                 </p>
                 
                 <p className="text-base text-blue-200 text-center">{message}</p>
+
+                {status === 'processing' && (
+                  <div className="mt-6">
+                    <div className="w-full bg-slate-700/60 rounded-full h-3 overflow-hidden">
+                      <div
+                        className="bg-gradient-to-r from-cyan-500 to-blue-500 h-3 rounded-full transition-all duration-500"
+                        style={{ width: `${progress}%` }}
+                      ></div>
+                    </div>
+                    <p className="text-sm text-cyan-300 text-center mt-2">{progress}%</p>
+                  </div>
+                )}
                 
                 <p className="text-sm text-blue-300/70 text-center mt-6">
                   Este proceso puede tardar varios minutos dependiendo de la duración del audio